@@ -0,0 +1,374 @@
+"""
+Benchmark suite for bioRSP.
+
+Times the core analysis and preprocessing functions on generated data across a
+grid of cell counts, resolutions and foreground fractions. Each case reports
+the best wall time over several repeats and the peak memory of one traced run.
+Results are saved as JSON and can be compared against a stored baseline.
+
+Usage:
+    python benchmarks/run_benchmarks.py --preset quick --output results.json
+    python benchmarks/run_benchmarks.py --preset full --baseline baseline.json
+    python benchmarks/run_benchmarks.py --only convert_to_polar calculate_differences
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from biorsp.analysis.find_points import find_foreground_background_points
+from biorsp.analysis.polar_conversion import convert_to_polar
+from biorsp.analysis.rsp_analysis import perform_rsp_analysis
+from biorsp.analysis.rsp_calculations import calculate_differences
+from biorsp.preprocessing.clustering import compute_dbscan
+from biorsp.preprocessing.filtering import filter_dge_matrix
+
+PRESETS = {
+    "quick": dict(
+        cells=[10_000, 50_000],
+        resolutions=[100, 1000],
+        fractions=[0.01, 0.1],
+    ),
+    "full": dict(
+        cells=[10_000, 100_000, 500_000, 2_000_000],
+        resolutions=[100, 1000, 4000],
+        fractions=[0.01, 0.1, 0.5],
+    ),
+}
+
+
+def generate_embedding(n_cells, n_clusters=8, seed=0):
+    """
+    Generate a t-SNE-like embedding: Gaussian clusters spread over a square.
+
+    Parameters:
+    - n_cells: Number of cells.
+    - n_clusters: Number of clusters.
+    - seed: Random seed.
+
+    Returns:
+    - 2D numpy array of shape (n_cells, 2).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-40, 40, size=(n_clusters, 2))
+    labels = rng.integers(0, n_clusters, n_cells)
+    return centers[labels] + rng.normal(scale=4.0, size=(n_cells, 2))
+
+
+def generate_dge(n_genes, n_cells, foreground_fraction=0.1, seed=0):
+    """
+    Generate a count matrix whose first gene is expressed in a fixed fraction of cells.
+
+    Parameters:
+    - n_genes: Number of genes.
+    - n_cells: Number of cells.
+    - foreground_fraction: Fraction of cells expressing the first gene above 1.
+    - seed: Random seed.
+
+    Returns:
+    - DataFrame of counts (rows=genes, columns=cells).
+    """
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(0.3, size=(n_genes, n_cells)).astype(np.int32)
+    counts[0] = 0
+    counts[0, rng.random(n_cells) < foreground_fraction] = 2
+    return pd.DataFrame(
+        counts,
+        index=[f"Gene{i}" for i in range(n_genes)],
+        columns=[f"Cell{j}" for j in range(n_cells)],
+    )
+
+
+def foreground_split(embedding, foreground_fraction, seed=0):
+    rng = np.random.default_rng(seed)
+    return embedding[rng.random(embedding.shape[0]) < foreground_fraction]
+
+
+def setup_convert_to_polar(n_cells):
+    embedding = generate_embedding(n_cells)
+    vantage_point = embedding.mean(axis=0)
+    return lambda: convert_to_polar(embedding, vantage_point)
+
+
+def setup_calculate_differences(n_cells, resolution, foreground_fraction):
+    embedding = generate_embedding(n_cells)
+    foreground_points = foreground_split(embedding, foreground_fraction)
+    vantage_point = embedding.mean(axis=0)
+    angle_range = np.array([0, 2 * np.pi])
+    return lambda: calculate_differences(
+        foreground_points,
+        embedding,
+        np.pi,
+        resolution,
+        vantage_point,
+        angle_range,
+        "absolute",
+    )
+
+
+def setup_perform_rsp_analysis(n_cells, resolution, foreground_fraction):
+    embedding = generate_embedding(n_cells)
+    foreground_points = foreground_split(embedding, foreground_fraction)
+    vantage_point = embedding.mean(axis=0)
+    return lambda: perform_rsp_analysis(
+        foreground_points, embedding, vantage_point, resolution=resolution
+    )
+
+
+def setup_find_foreground_background_points(n_cells, foreground_fraction):
+    embedding = generate_embedding(n_cells)
+    dge_matrix = generate_dge(4, n_cells, foreground_fraction)
+    dbscan_df = pd.DataFrame(
+        {"cluster": np.random.default_rng(0).integers(0, 4, n_cells)}
+    )
+    return lambda: find_foreground_background_points(
+        "Gene0", dge_matrix, embedding, dbscan_df, selected_clusters=[1, 2]
+    )
+
+
+def setup_filter_dge_matrix(n_cells):
+    dge_matrix = generate_dge(500, n_cells)
+    return lambda: filter_dge_matrix(dge_matrix, threshold_umi=140, threshold_gene=10)
+
+
+def setup_compute_dbscan(n_cells):
+    embedding = generate_embedding(n_cells)
+    # Keep the expected neighbourhood size roughly constant across cell counts.
+    eps = 4.0 * np.sqrt(10_000 / n_cells)
+    return lambda: compute_dbscan(embedding, eps=eps, min_samples=20)
+
+
+def setup_compute_dbscan_grid(n_cells):
+    embedding = generate_embedding(n_cells)
+    eps = 4.0 * np.sqrt(10_000 / n_cells)
+    return lambda: compute_dbscan(embedding, eps=eps, min_samples=20, engine="grid")
+
+
+# name -> (setup function, parameter axes, largest cell count to run)
+BENCHMARKS = {
+    "convert_to_polar": (setup_convert_to_polar, ["n_cells"], None),
+    "calculate_differences": (
+        setup_calculate_differences,
+        ["n_cells", "resolution", "foreground_fraction"],
+        None,
+    ),
+    "perform_rsp_analysis": (
+        setup_perform_rsp_analysis,
+        ["n_cells", "resolution", "foreground_fraction"],
+        None,
+    ),
+    "find_foreground_background_points": (
+        setup_find_foreground_background_points,
+        ["n_cells", "foreground_fraction"],
+        None,
+    ),
+    "filter_dge_matrix": (setup_filter_dge_matrix, ["n_cells"], 100_000),
+    "compute_dbscan": (setup_compute_dbscan, ["n_cells"], 200_000),
+    "compute_dbscan_grid": (setup_compute_dbscan_grid, ["n_cells"], None),
+}
+
+
+def measure(func, repeat=3):
+    """
+    Time a function and record its peak memory.
+
+    Timing runs are untraced; the peak comes from one extra run under tracemalloc,
+    which sees Python objects and numpy buffers but not memory allocated inside
+    compiled extensions (e.g., scikit-learn's neighbour search).
+
+    Parameters:
+    - func: Callable without arguments.
+    - repeat: Number of timed runs.
+
+    Returns:
+    - Dictionary with the best and mean time in seconds and the peak memory in bytes.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "time": min(times),
+        "mean_time": float(np.mean(times)),
+        "peak_memory": peak_memory,
+    }
+
+
+def benchmark_cases(name, grid):
+    """
+    Parameter combinations of one benchmark for a grid.
+
+    Parameters:
+    - name: Benchmark name.
+    - grid: Dictionary with "cells", "resolutions" and "fractions" lists.
+
+    Returns:
+    - List of parameter dictionaries.
+    """
+    _, axes, max_cells = BENCHMARKS[name]
+    values = {
+        "n_cells": grid["cells"],
+        "resolution": grid["resolutions"],
+        "foreground_fraction": grid["fractions"],
+    }
+    cases = [
+        dict(zip(axes, combination))
+        for combination in itertools.product(*(values[axis] for axis in axes))
+    ]
+    if max_cells is not None:
+        cases = [case for case in cases if case["n_cells"] <= max_cells]
+    return cases
+
+
+def case_key(result):
+    return result["benchmark"], tuple(sorted(result["params"].items()))
+
+
+def run_benchmarks(grid, names=None, repeat=3):
+    """
+    Run every benchmark case of a grid.
+
+    Parameters:
+    - grid: Dictionary with "cells", "resolutions" and "fractions" lists.
+    - names: Optional list of benchmark names (default: all).
+    - repeat: Number of timed runs per case.
+
+    Returns:
+    - List of result dictionaries with benchmark, params, time, mean_time and peak_memory.
+    """
+    results = []
+    for name in names or BENCHMARKS:
+        setup = BENCHMARKS[name][0]
+        for params in benchmark_cases(name, grid):
+            measurement = measure(setup(**params), repeat=repeat)
+            results.append({"benchmark": name, "params": params, **measurement})
+            print(
+                f"{name:<36} {format_params(params):<48} "
+                f"{measurement['time'] * 1e3:>10.1f} ms "
+                f"{measurement['peak_memory'] / 2**20:>9.1f} MiB",
+                flush=True,
+            )
+    return results
+
+
+def format_params(params):
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+def compare_to_baseline(results, baseline, tolerance=0.1):
+    """
+    Compare results against a baseline run of the same cases.
+
+    Parameters:
+    - results: List of result dictionaries from run_benchmarks.
+    - baseline: List of result dictionaries from a previous run.
+    - tolerance: Relative slowdown (or memory growth) reported as a regression.
+
+    Returns:
+    - List of comparison dictionaries with the time and memory ratios (new / baseline)
+      and a regression flag, for every case present in both runs.
+    """
+    baseline_by_key = {case_key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        reference = baseline_by_key.get(case_key(result))
+        if reference is None:
+            continue
+        time_ratio = result["time"] / reference["time"]
+        memory_ratio = result["peak_memory"] / max(reference["peak_memory"], 1)
+        comparisons.append(
+            {
+                "benchmark": result["benchmark"],
+                "params": result["params"],
+                "time_ratio": time_ratio,
+                "memory_ratio": memory_ratio,
+                "regression": time_ratio > 1 + tolerance
+                or memory_ratio > 1 + tolerance,
+            }
+        )
+    return comparisons
+
+
+def print_comparison(comparisons):
+    print(f"\n{'benchmark':<36} {'params':<48} {'speedup':>8} {'memory':>8}")
+    for comparison in comparisons:
+        flag = "  REGRESSION" if comparison["regression"] else ""
+        print(
+            f"{comparison['benchmark']:<36} {format_params(comparison['params']):<48} "
+            f"{1 / comparison['time_ratio']:>7.2f}x {comparison['memory_ratio']:>7.2f}x"
+            f"{flag}"
+        )
+
+
+def metadata():
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--cells", type=int, nargs="+", help="Override cell counts.")
+    parser.add_argument(
+        "--resolutions", type=int, nargs="+", help="Override resolutions."
+    )
+    parser.add_argument(
+        "--fractions", type=float, nargs="+", help="Override foreground fractions."
+    )
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="JSON results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit with status 1 if any case regresses beyond the tolerance.",
+    )
+    args = parser.parse_args(argv)
+
+    grid = dict(PRESETS[args.preset])
+    for axis in ("cells", "resolutions", "fractions"):
+        if getattr(args, axis):
+            grid[axis] = getattr(args, axis)
+
+    results = run_benchmarks(grid, names=args.only, repeat=args.repeat)
+    report = {"metadata": metadata(), "grid": grid, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        comparisons = compare_to_baseline(results, baseline, args.tolerance)
+        print_comparison(comparisons)
+        if args.fail_on_regression and any(c["regression"] for c in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,7 @@ setup(
         "pandas",
         "matplotlib",
         "scikit-learn",
+        "scipy",
         "umap-learn",
     ],
     classifiers=[
@@ -1,13 +1,13 @@
 from .preprocessing import *
 from .analysis import *
 from .visualization import *
+from .data import *
+from .utils import *
 
 # TODO: FUTURE MODULE IDEAS FOR PACKAGE
-# from .data import *
 # from .model import *
 # from .pipeline import *
 # from .simulation import *
-# from .utils import *
 # from .plot import *
 # from .metrics import *
 # from .evaluation import *
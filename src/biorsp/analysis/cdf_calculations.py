@@ -1,8 +1,13 @@
 import numpy as np
-from biorsp.analysis.polar_conversion import convert_to_polar, in_scanning_range
+from biorsp.analysis import rsp_calculations
 from biorsp.analysis.histogram import compute_histogram, compute_cdf
+from biorsp.utils.profiling import profiled
 
+# np.trapz was renamed to np.trapezoid in NumPy 2.0 and later removed.
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
 
+
+@profiled("analysis.compute_cdfs")
 def compute_cdfs(
     fg_projection, bg_projection, angle, scanning_window, resolution, mode
 ):
@@ -50,7 +55,7 @@ def compute_area(fg_cdf, bg_cdf, window):
     - The area under the absolute difference between the CDFs.
     """
     dx = window / fg_cdf.shape[0]
-    return np.trapz(np.abs(bg_cdf - fg_cdf), dx=dx)
+    return trapezoid(np.abs(bg_cdf - fg_cdf), dx=dx)
 
 
 def calculate_differences(
@@ -61,38 +66,41 @@ def calculate_differences(
     vantage_point,
     angle_range,
     mode,
+    precision="double",
+    n_bins=None,
+    exact=False,
 ):
     """
     Calculate the differences between foreground and background CDFs.
 
+    Same as rsp_calculations.calculate_differences, kept here for existing imports.
+
     Parameters:
     - foreground_points: Numpy array of (x, y) coordinates for foreground cells.
     - background_points: Numpy array of (x, y) coordinates for background cells.
     - scanning_window: Scanning window size in radians.
-    - resolution: Number of bins for the histogram.
+    - resolution: Number of scanning angles.
     - vantage_point: 2D numpy array for the vantage point.
     - angle_range: Angular range for CDF computation.
     - mode: Mode for scaling the foreground and background CDFs.
+    - precision: "double" or "single" (float32 angles, see get_precision).
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - exact: If True, integrate the gap between the CDFs exactly from the sorted
+      angles in each window instead of binning them, the limit of compute_area
+      as n_bins grows (n_bins is ignored).
 
     Returns:
     - differences: Numpy array of differences between the foreground and background CDFs.
     """
-    _, fg_theta = convert_to_polar(foreground_points, vantage_point)
-    _, bg_theta = convert_to_polar(background_points, vantage_point)
-
-    differences = np.empty(resolution)
-    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
-
-    for i, angle in enumerate(angles):
-        fg_in_range = in_scanning_range(fg_theta, angle, scanning_window)
-        bg_in_range = in_scanning_range(bg_theta, angle, scanning_window)
-
-        fg_projection = fg_theta[fg_in_range]
-        bg_projection = bg_theta[bg_in_range]
-
-        fg_cdf, bg_cdf = compute_cdfs(
-            fg_projection, bg_projection, angle, scanning_window, resolution, mode
-        )
-        differences[i] = compute_area(fg_cdf, bg_cdf, scanning_window)
-
-    return differences
+    return rsp_calculations.calculate_differences(
+        foreground_points,
+        background_points,
+        scanning_window,
+        resolution,
+        vantage_point,
+        angle_range,
+        mode,
+        precision=precision,
+        n_bins=n_bins,
+        exact=exact,
+    )
@@ -0,0 +1,169 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from biorsp.analysis.polar_conversion import convert_to_polar
+
+PolarTransform = namedtuple("PolarTransform", ["r", "theta", "order", "rank"])
+PolarTransform.__doc__ = """
+Polar coordinates of every cell of an embedding around one vantage point.
+
+- r: Numpy array of radial coordinates, sorted by angle.
+- theta: Numpy array of angular coordinates, sorted.
+- order: Cell index at each sorted position (the argsort of the angles).
+- rank: Sorted position of each cell (the inverse of order).
+"""
+
+
+class EmbeddingContext:
+    """
+    Embedding coordinates and cluster labels shared by many analysis calls.
+
+    Polar transforms are computed lazily per vantage point and kept in a bounded
+    least-recently-used cache, so repeated analyses against the same embedding
+    and vantage point only gather precomputed angles.
+    """
+
+    def __init__(self, embedding, labels=None, max_cached=8, precision="double"):
+        """
+        Parameters:
+        - embedding: 2D numpy array with the t-SNE (or UMAP) coordinates for each cell.
+        - labels: Optional cluster labels for each cell, as a 1D array or a DataFrame
+          with a "cluster" column (e.g., from DBSCAN).
+        - max_cached: Maximum number of vantage points whose polar transforms are kept.
+        - precision: "double" or "single" (float32 angles and int32 ranks, see
+          get_precision), halving the size of each cached transform.
+        """
+        embedding = np.asarray(embedding)
+        if embedding.ndim != 2 or embedding.shape[1] != 2:
+            raise ValueError("Embedding must be a 2D array of (x, y) coordinates.")
+
+        if labels is not None:
+            if hasattr(labels, "columns"):
+                labels = labels["cluster"].values
+            labels = np.asarray(labels)
+            if labels.shape[0] != embedding.shape[0]:
+                raise ValueError(
+                    "Cluster labels do not match the number of embedding points."
+                )
+
+        self.embedding = embedding
+        self.labels = labels
+        self.max_cached = max_cached
+        self.precision = precision
+        self._polar_cache = OrderedDict()
+
+    @property
+    def n_cells(self):
+        return self.embedding.shape[0]
+
+    def cluster_mask(self, selected_clusters=None):
+        """
+        Boolean mask of the cells in the selected clusters.
+
+        Parameters:
+        - selected_clusters: List of cluster labels, or None to select every cell.
+
+        Returns:
+        - Boolean numpy array with one entry per cell, or None when no clusters are given.
+        """
+        if selected_clusters is None:
+            return None
+        if self.labels is None:
+            raise ValueError("Cluster selection requires cluster labels.")
+        return np.isin(self.labels, list(selected_clusters))
+
+    def cluster_indices(self, selected_clusters=None):
+        """
+        Indices of the cells in the selected clusters.
+
+        Parameters:
+        - selected_clusters: List of cluster labels, or None to select every cell.
+
+        Returns:
+        - Sorted integer numpy array of cell indices.
+        """
+        mask = self.cluster_mask(selected_clusters)
+        if mask is None:
+            return np.arange(self.n_cells)
+        return np.flatnonzero(mask)
+
+    def centroid(self, cell_indices=None):
+        """
+        Mean position of a set of cells, the default vantage point.
+
+        Parameters:
+        - cell_indices: Optional integer numpy array of cells (default: all cells).
+
+        Returns:
+        - 1D numpy array with the (x, y) centroid.
+        """
+        if cell_indices is None:
+            return self.embedding.mean(axis=0)
+        return self.embedding[cell_indices].mean(axis=0)
+
+    def polar(self, vantage_point):
+        """
+        Polar transform of every cell around a vantage point, cached.
+
+        Parameters:
+        - vantage_point: 2D numpy array for the vantage point.
+
+        Returns:
+        - A PolarTransform.
+        """
+        key = tuple(np.asarray(vantage_point, dtype=np.float64).ravel())
+        if key in self._polar_cache:
+            self._polar_cache.move_to_end(key)
+            return self._polar_cache[key]
+
+        r, theta, order = convert_to_polar(
+            self.embedding, np.asarray(key), return_order=True, precision=self.precision
+        )
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0], dtype=order.dtype)
+        transform = PolarTransform(r, theta, order, rank)
+
+        self._polar_cache[key] = transform
+        while len(self._polar_cache) > self.max_cached:
+            self._polar_cache.popitem(last=False)
+        return transform
+
+    def sorted_positions(self, cell_indices, vantage_point):
+        """
+        Sorted positions of a set of cells in the polar transform of a vantage point.
+
+        Parameters:
+        - cell_indices: Integer numpy array of cells, or None for every cell.
+        - vantage_point: 2D numpy array for the vantage point.
+
+        Returns:
+        - Ascending integer numpy array of positions into the sorted angles.
+        """
+        transform = self.polar(vantage_point)
+        if cell_indices is None:
+            return np.arange(self.n_cells)
+        return np.sort(transform.rank[cell_indices])
+
+    def polar_subset(self, cell_indices, vantage_point):
+        """
+        Polar coordinates of a set of cells, sorted by angle, without re-sorting angles.
+
+        Parameters:
+        - cell_indices: Integer numpy array of cells, or None for every cell.
+        - vantage_point: 2D numpy array for the vantage point.
+
+        Returns:
+        - sorted_r: Numpy array of radial coordinates, sorted by angular coordinates.
+        - sorted_theta: Numpy array of angular coordinates, sorted.
+        """
+        transform = self.polar(vantage_point)
+        if cell_indices is None:
+            return transform.r, transform.theta
+        positions = self.sorted_positions(cell_indices, vantage_point)
+        return transform.r[positions], transform.theta[positions]
+
+    def clear_cache(self):
+        """
+        Drop every cached polar transform.
+        """
+        self._polar_cache.clear()
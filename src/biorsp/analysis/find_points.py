@@ -1,19 +1,31 @@
 import numpy as np
+from biorsp.analysis.precision import get_precision
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.utils.profiling import profiled
 
 
+@profiled("analysis.find_foreground_background_points")
 def find_foreground_background_points(
-    gene_name, dge_matrix, tsne_results, dbscan_df, threshold=1, selected_clusters=None
+    gene_name,
+    dge_matrix,
+    tsne_results,
+    dbscan_df,
+    threshold=1,
+    selected_clusters=None,
+    precision="double",
 ):
     """
     Find foreground and background points based on gene expression levels in bioRSP.
 
     Parameters:
     - gene_name: The gene of interest.
-    - dge_matrix: DataFrame containing gene expression data (rows=genes, columns=cells).
+    - dge_matrix: DataFrame or ExpressionMatrix containing gene expression data
+      (rows=genes, columns=cells).
     - tsne_results: 2D numpy array with t-SNE (or UMAP) coordinates for each cell.
     - dbscan_df: DataFrame with DBSCAN cluster labels for each cell.
     - threshold: Expression level threshold for foreground points (default=1).
     - selected_clusters: List of cluster labels to focus on (optional).
+    - precision: "double", or "single" to return float32 coordinates (see get_precision).
 
     Returns:
     - foreground_points: Numpy array of (x, y) coordinates for cells with expression above the threshold.
@@ -26,35 +38,49 @@ def find_foreground_background_points(
             "DBSCAN cluster labels do not match the number of t-SNE results."
         )
 
-    if gene_name not in dge_matrix.index:
-        raise ValueError(f"Gene '{gene_name}' not found in the dataset.")
-
-    gene_expression = dge_matrix.loc[gene_name]
-    cell_barcodes = dge_matrix.columns
-
     # Filter cells by selected clusters if specified
     if selected_clusters is not None:
-        selected_indices = [
-            idx
-            for idx, cluster in enumerate(dbscan_clusters)
-            if cluster in selected_clusters
-        ]
-        # Filter the t-SNE results and gene expression data based on selected clusters
-        tsne_results = tsne_results[selected_indices]
-        selected_barcodes = [cell_barcodes[idx] for idx in selected_indices]
-        gene_expression = gene_expression[selected_barcodes]
-        cell_index_map = {barcode: idx for idx, barcode in enumerate(selected_barcodes)}
+        cell_mask = np.isin(dbscan_clusters, list(selected_clusters))
     else:
-        selected_indices = range(len(dbscan_clusters))
-        cell_index_map = {barcode: idx for idx, barcode in enumerate(cell_barcodes)}
+        cell_mask = None
 
-    # Foreground points: Cells with gene expression above the threshold
-    foreground_indices = gene_expression[gene_expression > threshold].index
-    foreground_points = np.array(
-        [tsne_results[cell_index_map[barcode]] for barcode in foreground_indices]
+    foreground_indices = find_foreground_indices(
+        gene_name, dge_matrix, threshold=threshold, cell_mask=cell_mask
     )
+    float_dtype = get_precision(precision).float_dtype
+    foreground_points = tsne_results[foreground_indices].astype(float_dtype, copy=False)
 
     # Background points are all cells within the selected clusters
-    background_points = tsne_results
+    if cell_mask is not None:
+        background_points = tsne_results[cell_mask].astype(float_dtype, copy=False)
+    else:
+        background_points = np.array(tsne_results, dtype=float_dtype)
+
+    return foreground_points, background_points
+
+
+@profiled("analysis.find_foreground_indices")
+def find_foreground_indices(gene_name, dge_matrix, threshold=1, cell_mask=None):
+    """
+    Find the cells expressing a gene above a threshold.
+
+    Parameters:
+    - gene_name: The gene of interest.
+    - dge_matrix: DataFrame or ExpressionMatrix containing gene expression data
+      (rows=genes, columns=cells).
+    - threshold: Expression level threshold for foreground cells (default=1).
+    - cell_mask: Optional boolean numpy array restricting the eligible cells.
+
+    Returns:
+    - Sorted integer numpy array of foreground cell columns.
+    """
+    if isinstance(dge_matrix, ExpressionMatrix):
+        return dge_matrix.foreground_indices(gene_name, threshold, cell_mask)
+
+    if gene_name not in dge_matrix.index:
+        raise ValueError(f"Gene '{gene_name}' not found in the dataset.")
 
-    return foreground_points, np.array(background_points)
+    foreground = dge_matrix.loc[gene_name].to_numpy() > threshold
+    if cell_mask is not None:
+        foreground &= cell_mask
+    return np.flatnonzero(foreground)
@@ -1,6 +1,8 @@
 import numpy as np
+from biorsp.utils.profiling import profiled
 
 
+@profiled("analysis.compute_histogram")
 def compute_histogram(projection, resolution, angle, window):
     """
     Compute a histogram of a projection based on a scanning window.
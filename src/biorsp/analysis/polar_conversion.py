@@ -1,27 +1,39 @@
 import numpy as np
+from biorsp.analysis.precision import get_precision
+from biorsp.utils.profiling import profiled
 
 
-def convert_to_polar(coords, vantage_point):
+@profiled("analysis.convert_to_polar")
+def convert_to_polar(coords, vantage_point, return_order=False, precision="double"):
     """
     Convert 2D coordinates to polar coordinates.
 
     Parameters:
     - coords: 2D numpy array of coordinates.
     - vantage_point: 2D numpy array representing the reference point for polar conversion.
+    - return_order: If True, also return the permutation that sorts the input by angle.
+    - precision: "double" or "single" (float32 angles and int32 indices, see get_precision).
 
     Returns:
     - sorted_r: Numpy array of radial coordinates, sorted by angular coordinates.
     - sorted_theta: Numpy array of angular coordinates, sorted.
+    - sorted_indices: Numpy array of input row indices in sorted order (only if return_order).
     """
+    float_dtype, index_dtype, _ = get_precision(precision)
     if coords.shape[0] == 0:
-        return np.array([]), np.array([])
+        empty = np.array([], dtype=float_dtype)
+        if return_order:
+            return empty, empty, np.array([], dtype=index_dtype)
+        return empty, empty
 
-    translated_coords = coords - vantage_point
+    translated_coords = np.subtract(coords, vantage_point, dtype=float_dtype)
     r = np.sqrt(translated_coords[:, 0] ** 2 + translated_coords[:, 1] ** 2)
     theta = np.arctan2(translated_coords[:, 1], translated_coords[:, 0])
     theta = np.mod(theta + 2 * np.pi, 2 * np.pi)
 
-    sorted_indices = np.argsort(theta)
+    sorted_indices = np.argsort(theta).astype(index_dtype, copy=False)
+    if return_order:
+        return r[sorted_indices], theta[sorted_indices], sorted_indices
     return r[sorted_indices], theta[sorted_indices]
 
 
@@ -1,12 +1,18 @@
 import numpy as np
 from biorsp.analysis.rsp_calculations import (
+    calculate_adaptive_differences,
     calculate_deviation_score,
     calculate_rsp_area,
+    calculate_batch_differences,
+    calculate_context_differences,
     calculate_differences,
+    calculate_multiscale_differences,
     calculate_rmsd,
 )
+from biorsp.utils.profiling import profiled
 
 
+@profiled("analysis.perform_rsp_analysis")
 def perform_rsp_analysis(
     foreground_points,
     background_points,
@@ -15,6 +21,9 @@ def perform_rsp_analysis(
     resolution=1000,
     angle_range=np.array([0, 2 * np.pi]),
     mode="absolute",
+    precision="double",
+    n_bins=None,
+    exact=False,
 ):
     """
     Perform full RSP analysis including RSP area, RMSD, and deviation score.
@@ -24,9 +33,13 @@ def perform_rsp_analysis(
     - background_points: Numpy array of (x, y) coordinates for background cells.
     - vantage_point: 2D numpy array for the vantage point.
     - scanning_window: Scanning window size in radians.
-    - resolution: Number of bins for the histogram.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - exact: If True, integrate the gap between the CDFs exactly instead of binning
+      (n_bins is ignored), giving bin-independent scores.
     - angle_range: Angular range for CDF computation.
     - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - precision: "double" or "single" (float32 angles and differences, see get_precision).
 
     Returns:
     - rsp_area: Calculated RSP area.
@@ -42,6 +55,9 @@ def perform_rsp_analysis(
         vantage_point,
         angle_range,
         mode,
+        precision=precision,
+        n_bins=n_bins,
+        exact=exact,
     )
 
     rsp_area = calculate_rsp_area(differences, angle_range, resolution)
@@ -51,3 +67,230 @@ def perform_rsp_analysis(
     )
 
     return rsp_area, rmsd, deviation_score, differences
+
+
+@profiled("analysis.perform_multiscale_rsp_analysis")
+def perform_multiscale_rsp_analysis(
+    foreground_points,
+    background_points,
+    vantage_point,
+    scanning_windows=(np.pi / 8, np.pi / 4, np.pi / 2, np.pi),
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    precision="double",
+    n_bins=None,
+):
+    """
+    Perform RSP analysis for several scanning window sizes in one pass.
+
+    Parameters:
+    - foreground_points: Numpy array of (x, y) coordinates for foreground cells.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - vantage_point: 2D numpy array for the vantage point.
+    - scanning_windows: List of scanning window sizes in radians.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - precision: "double" or "single" (float32 angles and differences, see get_precision).
+
+    Returns:
+    - rsp_areas: Numpy array of RSP areas, one per window size.
+    - rmsds: Numpy array of Root Mean Square Deviations, one per window size.
+    - deviation_scores: Numpy array of deviation scores, one per window size.
+    - differences: Numpy array of shape (len(scanning_windows), resolution).
+    """
+    differences = calculate_multiscale_differences(
+        foreground_points,
+        background_points,
+        scanning_windows,
+        resolution,
+        vantage_point,
+        angle_range,
+        mode,
+        precision=precision,
+        n_bins=n_bins,
+    )
+
+    rsp_areas = calculate_rsp_area(differences, angle_range, resolution)
+    rmsds = calculate_rmsd(differences)
+    deviation_scores = calculate_deviation_score(
+        rsp_areas, differences, resolution, angle_range
+    )
+
+    return rsp_areas, rmsds, deviation_scores, differences
+
+
+@profiled("analysis.perform_batch_rsp_analysis")
+def perform_batch_rsp_analysis(
+    foreground_masks,
+    background_points,
+    vantage_point,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    chunk_size=32,
+    precision="double",
+    n_bins=None,
+):
+    """
+    Perform RSP analysis for many genes sharing one background.
+
+    Parameters:
+    - foreground_masks: Boolean numpy array or scipy sparse matrix of shape
+      (genes, cells) marking each gene's foreground cells among the background points.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - vantage_point: 2D numpy array for the vantage point.
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - chunk_size: Number of genes processed together.
+    - precision: "double" or "single" (float32 angles and differences, see get_precision).
+
+    Returns:
+    - rsp_areas: Numpy array of RSP areas, one per gene.
+    - rmsds: Numpy array of Root Mean Square Deviations, one per gene.
+    - deviation_scores: Numpy array of deviation scores, one per gene.
+    - differences: Numpy array of shape (genes, resolution).
+    """
+    differences = calculate_batch_differences(
+        foreground_masks,
+        background_points,
+        scanning_window,
+        resolution,
+        vantage_point,
+        angle_range,
+        mode,
+        chunk_size=chunk_size,
+        precision=precision,
+        n_bins=n_bins,
+    )
+
+    rsp_areas = calculate_rsp_area(differences, angle_range, resolution)
+    rmsds = calculate_rmsd(differences)
+    deviation_scores = calculate_deviation_score(
+        rsp_areas, differences, resolution, angle_range
+    )
+
+    return rsp_areas, rmsds, deviation_scores, differences
+
+
+@profiled("analysis.perform_context_rsp_analysis")
+def perform_context_rsp_analysis(
+    context,
+    foreground_indices,
+    background_indices=None,
+    vantage_point=None,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    n_bins=None,
+):
+    """
+    Perform full RSP analysis on cells of an embedding, reusing cached polar transforms.
+
+    Parameters:
+    - context: EmbeddingContext holding the embedding coordinates.
+    - foreground_indices: Integer numpy array of foreground cells.
+    - background_indices: Integer numpy array of background cells (default: every cell).
+    - vantage_point: 2D numpy array for the vantage point (default: background centroid).
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+
+    Returns:
+    - rsp_area: Calculated RSP area.
+    - rmsd: Root Mean Square Deviation.
+    - deviation_score: Deviation score.
+    - differences: Numpy array of differences between foreground and background CDFs.
+    """
+    if vantage_point is None:
+        vantage_point = context.centroid(background_indices)
+
+    differences = calculate_context_differences(
+        context,
+        foreground_indices,
+        background_indices,
+        scanning_window,
+        resolution,
+        vantage_point,
+        angle_range,
+        mode,
+        n_bins=n_bins,
+    )
+
+    rsp_area = calculate_rsp_area(differences, angle_range, resolution)
+    rmsd = calculate_rmsd(differences)
+    deviation_score = calculate_deviation_score(
+        rsp_area, differences, resolution, angle_range
+    )
+
+    return rsp_area, rmsd, deviation_score, differences
+
+
+@profiled("analysis.perform_adaptive_rsp_analysis")
+def perform_adaptive_rsp_analysis(
+    foreground_points,
+    background_points,
+    vantage_point,
+    scanning_window=np.pi,
+    n_bins=1000,
+    initial_resolution=64,
+    max_resolution=1024,
+    tolerance=5e-3,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    precision="double",
+):
+    """
+    Perform RSP analysis on scanning angles refined only where the differences change.
+
+    Parameters:
+    - foreground_points: Numpy array of (x, y) coordinates for foreground cells.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - vantage_point: 2D numpy array for the vantage point.
+    - scanning_window: Scanning window size in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - initial_resolution: Number of uniform scanning angles to start from.
+    - max_resolution: Number of scanning angles of the finest grid.
+    - tolerance: Largest change in differences tolerated between neighbouring angles.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - precision: "double" or "single" (float32 angles and differences, see get_precision).
+
+    Returns:
+    - rsp_area: Calculated RSP area, integrated over the non-uniform angles.
+    - rmsd: Root Mean Square Deviation, weighted by the angular spacing.
+    - deviation_score: Deviation score.
+    - differences: Numpy array of differences, one per angle.
+    - angles: Numpy array of the scanning angles, sorted ascending.
+    """
+    angles, differences = calculate_adaptive_differences(
+        foreground_points,
+        background_points,
+        scanning_window,
+        n_bins,
+        vantage_point,
+        angle_range,
+        mode,
+        initial_resolution=initial_resolution,
+        max_resolution=max_resolution,
+        tolerance=tolerance,
+        precision=precision,
+    )
+
+    resolution = len(angles)
+    rsp_area = calculate_rsp_area(differences, angle_range, resolution, angles=angles)
+    rmsd = calculate_rmsd(differences, angles=angles, angle_range=angle_range)
+    deviation_score = calculate_deviation_score(
+        rsp_area, differences, resolution, angle_range, angles=angles
+    )
+
+    return rsp_area, rmsd, deviation_score, differences, angles
@@ -1,8 +1,16 @@
 import numpy as np
-from biorsp.analysis.polar_conversion import convert_to_polar, in_scanning_range
-from biorsp.analysis.cdf_calculations import compute_cdfs, compute_area
+from biorsp.analysis.polar_conversion import convert_to_polar
+from biorsp.analysis.sweep import (
+    sweep_adaptive_differences,
+    sweep_batch_differences,
+    sweep_differences,
+    sweep_exact_differences,
+    sweep_multiscale_differences,
+)
+from biorsp.utils.profiling import profiled
 
 
+@profiled("analysis.calculate_differences")
 def calculate_differences(
     foreground_points,
     background_points,
@@ -11,6 +19,9 @@ def calculate_differences(
     vantage_point,
     angle_range,
     mode,
+    precision="double",
+    n_bins=None,
+    exact=False,
 ):
     """
     Calculate the differences between foreground and background CDFs.
@@ -19,86 +30,340 @@ def calculate_differences(
     - foreground_points: Numpy array of (x, y) coordinates for foreground cells.
     - background_points: Numpy array of (x, y) coordinates for background cells.
     - scanning_window: Scanning window size in radians.
-    - resolution: Number of bins for the histogram.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
     - vantage_point: 2D numpy array for the vantage point.
     - angle_range: Angular range for CDF computation.
     - mode: Mode for scaling foreground and background CDFs.
+    - precision: "double" or "single" (float32 angles, see get_precision).
+    - exact: If True, integrate the gap between the CDFs exactly from the sorted
+      angles in each window instead of binning them (n_bins is ignored).
 
     Returns:
     - differences: Numpy array of differences between foreground and background CDFs.
     """
-    _, fg_theta = convert_to_polar(foreground_points, vantage_point)
-    _, bg_theta = convert_to_polar(background_points, vantage_point)
+    _, fg_theta = convert_to_polar(
+        foreground_points, vantage_point, precision=precision
+    )
+    _, bg_theta = convert_to_polar(
+        background_points, vantage_point, precision=precision
+    )
 
-    differences = np.empty(resolution)
+    n_bins = resolution if n_bins is None else n_bins
     angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+    if exact:
+        differences = sweep_exact_differences(
+            fg_theta, bg_theta, angles, scanning_window, mode
+        )
+    else:
+        differences = sweep_differences(
+            fg_theta, bg_theta, angles, scanning_window, n_bins, mode
+        )
 
-    for i, angle in enumerate(angles):
-        fg_in_range = in_scanning_range(fg_theta, angle, scanning_window)
-        bg_in_range = in_scanning_range(bg_theta, angle, scanning_window)
+    return differences
 
-        fg_projection = fg_theta[fg_in_range]
-        bg_projection = bg_theta[bg_in_range]
 
-        fg_cdf, bg_cdf = compute_cdfs(
-            fg_projection, bg_projection, angle, scanning_window, resolution, mode
-        )
-        differences[i] = compute_area(fg_cdf, bg_cdf, scanning_window)
+def angle_weights(angles, angle_range):
+    """
+    Angular width of the sector each scanning angle stands for.
 
-    return differences
+    Each sector extends from its angle to the next one, and the last to the end
+    of the angle range, so a uniform grid gets (angle_range[1] - angle_range[0]) /
+    resolution everywhere.
 
+    Parameters:
+    - angles: Numpy array of scanning angles in radians, sorted ascending.
+    - angle_range: The range of angles over which the differences are calculated.
 
-def calculate_rsp_area(differences, angle_range, resolution):
+    Returns:
+    - Numpy array of sector widths, one per angle.
+    """
+    return np.diff(np.append(angles, angle_range[1]))
+
+
+def calculate_rsp_area(differences, angle_range, resolution, angles=None):
     """
     Calculate the RSP area from the differences.
 
     Parameters:
-    - differences: Numpy array of differences between foreground and background CDFs.
+    - differences: Numpy array of differences between foreground and background CDFs,
+      angles on the last axis.
     - angle_range: The range of angles over which the differences are calculated.
-    - resolution: The number of bins in the histogram.
+    - resolution: The number of scanning angles.
+    - angles: Optional non-uniform scanning angles of the differences (e.g., from
+      adaptive refinement); by default the angles are uniform.
 
     Returns:
-    - rsp_area: The calculated RSP area.
+    - rsp_area: The calculated RSP area, one per leading index of differences.
     """
-    delta_theta = (angle_range[1] - angle_range[0]) / resolution
+    if angles is None:
+        delta_theta = (angle_range[1] - angle_range[0]) / resolution
+    else:
+        delta_theta = angle_weights(angles, angle_range)
     segment_areas = 0.5 * delta_theta * np.power(differences, 2)
-    rsp_area = np.sum(segment_areas)
+    rsp_area = np.sum(segment_areas, axis=-1)
 
     return rsp_area
 
 
-def calculate_rmsd(differences):
+def calculate_rmsd(differences, angles=None, angle_range=None):
     """
     Calculate the Root Mean Square Deviation (RMSD) from the differences.
 
     Parameters:
     - differences: Numpy array of differences between foreground and background CDFs.
+    - angles: Optional non-uniform scanning angles of the differences; each
+      difference is then weighted by the width of its sector.
+    - angle_range: The range of angles, required with angles.
 
     Returns:
-    - rmsd: The calculated RMSD.
+    - rmsd: The calculated RMSD, one per leading index of differences.
     """
-    rmsd = np.sqrt(np.mean(np.square(differences)))
+    if angles is None:
+        rmsd = np.sqrt(np.mean(np.square(differences), axis=-1))
+    else:
+        weights = angle_weights(angles, angle_range)
+        rmsd = np.sqrt(np.average(np.square(differences), axis=-1, weights=weights))
 
     return rmsd
 
 
-def calculate_deviation_score(rsp_area, differences, resolution, angle_range):
+def calculate_deviation_score(
+    rsp_area, differences, resolution, angle_range, angles=None
+):
     """
     Calculate the deviation score based on the RSP area.
 
     Parameters:
-    - rsp_area: The calculated RSP area.
+    - rsp_area: The calculated RSP area (scalar or array matching the leading axes).
     - differences: Numpy array of differences between the foreground and background CDFs.
-    - resolution: The resolution for the calculation.
+    - resolution: The number of scanning angles.
     - angle_range: Angular range over which the radar scans.
+    - angles: Optional non-uniform scanning angles of the differences; by default
+      the angles are uniform.
 
     Returns:
     - deviation_score: The calculated deviation score.
     """
+    rsp_area = np.asarray(rsp_area)
     radius = np.sqrt(rsp_area / np.pi)
-    delta_theta = (angle_range[1] - angle_range[0]) / resolution
 
-    intersection_area = np.sum(np.minimum(differences, radius)) * delta_theta
-    if rsp_area != 0:
-        return intersection_area / rsp_area
-    return 0  # Handle case where rsp_area is 0
+    if angles is None:
+        delta_theta = (angle_range[1] - angle_range[0]) / resolution
+        intersection_area = (
+            np.sum(np.minimum(differences, radius[..., None]), axis=-1) * delta_theta
+        )
+    else:
+        intersection_area = np.sum(
+            np.minimum(differences, radius[..., None])
+            * angle_weights(angles, angle_range),
+            axis=-1,
+        )
+    # Handle case where rsp_area is 0
+    nonzero = rsp_area != 0
+    deviation_score = np.where(
+        nonzero, intersection_area / np.where(nonzero, rsp_area, 1), 0
+    )
+    return deviation_score[()]
+
+
+@profiled("analysis.calculate_multiscale_differences")
+def calculate_multiscale_differences(
+    foreground_points,
+    background_points,
+    scanning_windows,
+    resolution,
+    vantage_point,
+    angle_range,
+    mode,
+    precision="double",
+    n_bins=None,
+):
+    """
+    Calculate the differences between foreground and background CDFs for several window sizes.
+
+    Parameters:
+    - foreground_points: Numpy array of (x, y) coordinates for foreground cells.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - scanning_windows: List of scanning window sizes in radians.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - vantage_point: 2D numpy array for the vantage point.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs.
+    - precision: "double" or "single" (float32 angles, see get_precision).
+
+    Returns:
+    - differences: Numpy array of shape (len(scanning_windows), resolution).
+    """
+    _, fg_theta = convert_to_polar(
+        foreground_points, vantage_point, precision=precision
+    )
+    _, bg_theta = convert_to_polar(
+        background_points, vantage_point, precision=precision
+    )
+
+    n_bins = resolution if n_bins is None else n_bins
+    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+    differences = sweep_multiscale_differences(
+        fg_theta, bg_theta, angles, scanning_windows, n_bins, mode
+    )
+
+    return differences
+
+
+@profiled("analysis.calculate_batch_differences")
+def calculate_batch_differences(
+    foreground_masks,
+    background_points,
+    scanning_window,
+    resolution,
+    vantage_point,
+    angle_range,
+    mode,
+    chunk_size=32,
+    precision="double",
+    n_bins=None,
+):
+    """
+    Calculate the differences between foreground and background CDFs for many genes.
+
+    Parameters:
+    - foreground_masks: Boolean numpy array or scipy sparse matrix of shape
+      (genes, cells) marking each gene's foreground cells among the background points.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - vantage_point: 2D numpy array for the vantage point.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs.
+    - chunk_size: Number of genes processed together.
+    - precision: "double" or "single" (float32 angles, see get_precision).
+
+    Returns:
+    - differences: Numpy array of shape (genes, resolution).
+    """
+    if foreground_masks.shape[1] != background_points.shape[0]:
+        raise ValueError(
+            "Foreground masks do not match the number of background points."
+        )
+
+    _, bg_theta, bg_order = convert_to_polar(
+        background_points, vantage_point, return_order=True, precision=precision
+    )
+
+    n_bins = resolution if n_bins is None else n_bins
+    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+    differences = sweep_batch_differences(
+        foreground_masks,
+        bg_theta,
+        angles,
+        scanning_window,
+        n_bins,
+        mode,
+        cell_order=bg_order,
+        gene_chunk_size=chunk_size,
+    )
+
+    return differences
+
+
+@profiled("analysis.calculate_context_differences")
+def calculate_context_differences(
+    context,
+    foreground_indices,
+    background_indices,
+    scanning_window,
+    resolution,
+    vantage_point,
+    angle_range,
+    mode,
+    n_bins=None,
+):
+    """
+    Calculate the differences between foreground and background CDFs for cells of an embedding.
+
+    Angles come from the context's cached polar transform, so only the selected
+    cells are gathered.
+
+    Parameters:
+    - context: EmbeddingContext holding the embedding coordinates.
+    - foreground_indices: Integer numpy array of foreground cells.
+    - background_indices: Integer numpy array of background cells, or None for every cell.
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of scanning angles.
+    - n_bins: Number of histogram bins inside each window (default: resolution).
+    - vantage_point: 2D numpy array for the vantage point.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs.
+
+    Returns:
+    - differences: Numpy array of differences between foreground and background CDFs.
+    """
+    _, fg_theta = context.polar_subset(foreground_indices, vantage_point)
+    _, bg_theta = context.polar_subset(background_indices, vantage_point)
+
+    n_bins = resolution if n_bins is None else n_bins
+    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+    differences = sweep_differences(
+        fg_theta, bg_theta, angles, scanning_window, n_bins, mode
+    )
+
+    return differences
+
+
+@profiled("analysis.calculate_adaptive_differences")
+def calculate_adaptive_differences(
+    foreground_points,
+    background_points,
+    scanning_window,
+    n_bins,
+    vantage_point,
+    angle_range,
+    mode,
+    initial_resolution=64,
+    max_resolution=1024,
+    tolerance=5e-3,
+    precision="double",
+):
+    """
+    Calculate the differences between foreground and background CDFs on an adaptive angle grid.
+
+    Parameters:
+    - foreground_points: Numpy array of (x, y) coordinates for foreground cells.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - scanning_window: Scanning window size in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - vantage_point: 2D numpy array for the vantage point.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs.
+    - initial_resolution: Number of uniform scanning angles to start from.
+    - max_resolution: Number of scanning angles of the finest grid.
+    - tolerance: Largest change in differences tolerated between neighbouring angles.
+    - precision: "double" or "single" (float32 angles, see get_precision).
+
+    Returns:
+    - angles: Numpy array of the non-uniform scanning angles, sorted ascending.
+    - differences: Numpy array of differences, one per angle.
+    """
+    _, fg_theta = convert_to_polar(
+        foreground_points, vantage_point, precision=precision
+    )
+    _, bg_theta = convert_to_polar(
+        background_points, vantage_point, precision=precision
+    )
+
+    angles, differences = sweep_adaptive_differences(
+        fg_theta,
+        bg_theta,
+        angle_range,
+        scanning_window,
+        n_bins,
+        mode,
+        initial_resolution=initial_resolution,
+        max_resolution=max_resolution,
+        tolerance=tolerance,
+    )
+
+    return angles, differences
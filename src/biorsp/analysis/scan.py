@@ -0,0 +1,662 @@
+import hashlib
+import json
+import os
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from biorsp.analysis.polar_conversion import convert_to_polar
+from biorsp.analysis.rsp_calculations import (
+    calculate_deviation_score,
+    calculate_rmsd,
+    calculate_rsp_area,
+)
+from biorsp.analysis.sweep import sweep_batch_differences
+from biorsp.data.expression import ExpressionMatrix, threshold_matrix
+from biorsp.data.gene_stats import foreground_counts, load_gene_stats
+from biorsp.utils.profiling import (
+    Profiler,
+    is_profiling,
+    merge_events,
+    profiled,
+    reset_profiling,
+)
+
+RESULT_COLUMNS = ["Gene", "RSP_Area", "RMSD", "Deviation_Score"]
+MANIFEST_NAME = "manifest.json"
+
+_worker = None
+_worker_profiler = None
+
+
+def pool_context():
+    """
+    Multiprocessing context of the scan workers.
+
+    Workers are started from a clean server process rather than forked from the
+    caller: forking after UMAP has started numba's TBB threads hangs the caller
+    at exit.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class ScanWorker:
+    """
+    Per-process state of a gene scan: expression rows, background angles and parameters.
+    """
+
+    def __init__(
+        self, data, indices, indptr, shape, embedding, background_cells, params
+    ):
+        """
+        Parameters:
+        - data, indices, indptr: CSR arrays of the genes x cells expression matrix.
+        - shape: Shape of the expression matrix.
+        - embedding: 2D numpy array with the embedding coordinates for each cell.
+        - background_cells: Integer numpy array of background cells, or None for every cell.
+        - params: Dictionary of scan parameters (see run_gene_scan).
+        """
+        self.matrix = csr_matrix((data, indices, indptr), shape=shape, copy=False)
+        self.background_cells = background_cells
+        self.params = params
+
+        background_points = (
+            embedding if background_cells is None else embedding[background_cells]
+        )
+        self.n_background = background_points.shape[0]
+        _, self.bg_theta, self.bg_order = convert_to_polar(
+            background_points,
+            params["vantage_point"],
+            return_order=True,
+            precision=params["precision"],
+        )
+
+        angle_range = params["angle_range"]
+        self.angles = np.linspace(
+            angle_range[0], angle_range[1], params["resolution"], endpoint=False
+        )
+
+    @profiled("analysis.scan_chunk")
+    def scan(self, rows):
+        """
+        Run RSP analysis for a chunk of genes.
+
+        Parameters:
+        - rows: Integer numpy array of gene rows.
+
+        Returns:
+        - rows: Gene rows that passed the coverage filter.
+        - rsp_areas, rmsds, deviation_scores: Numpy arrays of statistics for those rows.
+        - differences: Numpy array of shape (len(rows), resolution).
+        """
+        params = self.params
+        masks = threshold_matrix(self.matrix[rows], params["threshold"])
+        if self.background_cells is not None:
+            masks = masks[:, self.background_cells]
+
+        coverage = masks.getnnz(axis=1) / max(self.n_background, 1)
+        keep = coverage >= params["min_coverage"]
+        rows, masks = np.asarray(rows)[keep], masks[np.flatnonzero(keep)]
+
+        differences = sweep_batch_differences(
+            masks,
+            self.bg_theta,
+            self.angles,
+            params["scanning_window"],
+            params["resolution"],
+            params["mode"],
+            cell_order=self.bg_order,
+        )
+        rsp_areas = calculate_rsp_area(
+            differences, params["angle_range"], params["resolution"]
+        )
+        rmsds = calculate_rmsd(differences)
+        deviation_scores = calculate_deviation_score(
+            rsp_areas, differences, params["resolution"], params["angle_range"]
+        )
+        return rows, rsp_areas, rmsds, deviation_scores, differences
+
+
+def _init_worker(paths, shape, params, profiling=False):
+    global _worker, _worker_profiler
+    reset_profiling()
+    if profiling:
+        # Stages recorded here are returned with each chunk and merged by the parent.
+        _worker_profiler = Profiler()
+        _worker_profiler.start()
+
+    arrays = {
+        name: None if path is None else np.load(path, mmap_mode="r")
+        for name, path in paths.items()
+    }
+    _worker = ScanWorker(
+        arrays["data"],
+        arrays["indices"],
+        arrays["indptr"],
+        shape,
+        arrays["embedding"],
+        arrays["background_cells"],
+        params,
+    )
+
+
+def _scan_chunk(task):
+    chunk_id, rows = task
+    result = _worker.scan(rows)
+    events = _worker_profiler.drain() if _worker_profiler is not None else []
+    return chunk_id, result, events
+
+
+def prepare_scan(
+    dge_matrix,
+    tsne_results,
+    dbscan_df,
+    genes=None,
+    threshold=1,
+    selected_clusters=None,
+    min_coverage=0.05,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    precision="double",
+):
+    """
+    Resolve the inputs of a gene scan into an expression matrix, rows and parameters.
+
+    Parameters are those of run_gene_scan.
+
+    Returns:
+    - expression: ExpressionMatrix of the input data.
+    - rows: Integer numpy array of the gene rows to scan, in scan order, without
+      the genes below min_coverage (see load_gene_stats).
+    - background_cells: Integer numpy array of background cells, or None for every cell.
+    - params: Dictionary of scan parameters, including the vantage point.
+    """
+    if threshold < 0:
+        raise ValueError("Gene scans require a non-negative threshold.")
+
+    if isinstance(dge_matrix, ExpressionMatrix):
+        expression = dge_matrix
+    else:
+        expression = ExpressionMatrix.from_dataframe(dge_matrix)
+
+    dbscan_clusters = dbscan_df["cluster"].values
+    if len(dbscan_clusters) != tsne_results.shape[0]:
+        raise ValueError(
+            "DBSCAN cluster labels do not match the number of t-SNE results."
+        )
+
+    if selected_clusters is not None:
+        background_cells = np.flatnonzero(
+            np.isin(dbscan_clusters, list(selected_clusters))
+        )
+        background_points = tsne_results[background_cells]
+    else:
+        background_cells = None
+        background_points = tsne_results
+
+    if genes is None:
+        rows = np.arange(expression.shape[0])
+    else:
+        rows = np.array([expression.gene_row(gene) for gene in genes], dtype=np.int64)
+
+    if min_coverage > 0:
+        # Genes with too small a foreground are dropped using the per-gene
+        # statistics, before any of their rows are read.
+        stats = load_gene_stats(
+            expression,
+            thresholds=(threshold,),
+            cluster_labels=None if selected_clusters is None else dbscan_clusters,
+        )
+        counts = foreground_counts(stats, threshold, selected_clusters)
+        coverage = counts[rows] / max(background_points.shape[0], 1)
+        rows = rows[coverage >= min_coverage]
+
+    params = dict(
+        threshold=threshold,
+        min_coverage=min_coverage,
+        scanning_window=scanning_window,
+        resolution=resolution,
+        angle_range=np.asarray(angle_range, dtype=np.float64),
+        mode=mode,
+        precision=precision,
+        vantage_point=background_points.mean(axis=0),
+    )
+    return expression, rows, background_cells, params
+
+
+def iter_scan_chunks(
+    expression,
+    tsne_results,
+    rows,
+    background_cells,
+    params,
+    n_jobs=1,
+    chunk_size=64,
+    temp_dir=None,
+    ordered=True,
+):
+    """
+    Scan chunks of gene rows, serially or on a process pool.
+
+    For parallel scans the embedding and the CSR arrays of the expression matrix
+    are written once to .npy files that every worker memory-maps read-only, so
+    tasks only carry gene rows.
+
+    Parameters:
+    - expression: ExpressionMatrix of the input data.
+    - tsne_results: 2D numpy array with the embedding coordinates for each cell.
+    - rows: Integer numpy array of the gene rows to scan.
+    - background_cells: Integer numpy array of background cells, or None for every cell.
+    - params: Dictionary of scan parameters from prepare_scan.
+    - n_jobs: Number of worker processes (-1 for all cores, 1 for a serial scan).
+    - chunk_size: Number of genes per task.
+    - temp_dir: Directory for the memory-mapped arrays (default: the system temp dir).
+    - ordered: If True, yield chunks in scan order; otherwise yield them as they
+      complete, so no finished chunk is held back behind a slow one.
+
+    Yields:
+    - chunk: Integer numpy array of the gene rows of the chunk.
+    - result: The output of ScanWorker.scan for the chunk.
+    """
+    chunks = [
+        rows[start : start + chunk_size] for start in range(0, len(rows), chunk_size)
+    ]
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    matrix = expression.matrix
+
+    if n_jobs is None or n_jobs <= 1 or len(chunks) <= 1:
+        worker = ScanWorker(
+            matrix.data,
+            matrix.indices,
+            matrix.indptr,
+            matrix.shape,
+            tsne_results,
+            background_cells,
+            params,
+        )
+        for chunk in chunks:
+            yield chunk, worker.scan(chunk)
+        return
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+        arrays = dict(
+            embedding=np.asarray(tsne_results),
+            background_cells=background_cells,
+        )
+        if expression.files is not None:
+            # Workers map the files of an on-disk cache directly.
+            paths = dict(expression.files)
+        else:
+            arrays.update(
+                data=matrix.data,
+                indices=matrix.indices,
+                indptr=matrix.indptr.astype(matrix.indices.dtype),
+            )
+            paths = {}
+        for name, array in arrays.items():
+            if array is None:
+                paths[name] = None
+                continue
+            paths[name] = os.path.join(directory, f"{name}.npy")
+            np.save(paths[name], array)
+
+        with pool_context().Pool(
+            n_jobs,
+            initializer=_init_worker,
+            initargs=(paths, matrix.shape, params, is_profiling()),
+        ) as pool:
+            pending, next_chunk = {}, 0
+            for chunk_id, result, events in pool.imap_unordered(
+                _scan_chunk, enumerate(chunks)
+            ):
+                merge_events(events)
+                if not ordered:
+                    yield chunks[chunk_id], result
+                    continue
+                pending[chunk_id] = result
+                while next_chunk in pending:
+                    yield chunks[next_chunk], pending.pop(next_chunk)
+                    next_chunk += 1
+
+
+@profiled("analysis.run_gene_scan")
+def run_gene_scan(
+    dge_matrix,
+    tsne_results,
+    dbscan_df,
+    genes=None,
+    threshold=1,
+    selected_clusters=None,
+    min_coverage=0.05,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    precision="double",
+    n_jobs=1,
+    chunk_size=64,
+    temp_dir=None,
+):
+    """
+    Run RSP analysis for every gene against a shared background.
+
+    Genes whose foreground covers less than min_coverage of the background are
+    skipped. The vantage point is the background centroid. Parallel scans give
+    the same results as serial scans.
+
+    Parameters:
+    - dge_matrix: DataFrame or ExpressionMatrix containing gene expression data
+      (rows=genes, columns=cells).
+    - tsne_results: 2D numpy array with t-SNE (or UMAP) coordinates for each cell.
+    - dbscan_df: DataFrame with DBSCAN cluster labels for each cell.
+    - genes: Optional list of genes to scan (default: every gene, in index order).
+    - threshold: Expression level threshold for foreground points (default=1).
+    - selected_clusters: List of cluster labels to focus on (optional).
+    - min_coverage: Minimum foreground/background size ratio for a gene to be analyzed.
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of bins for the histogram.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - precision: "double" or "single" (float32 angles and differences, see
+      get_precision), roughly halving the memory of each worker.
+    - n_jobs: Number of worker processes (-1 for all cores, 1 for a serial scan).
+    - chunk_size: Number of genes per task.
+    - temp_dir: Directory for the memory-mapped arrays of parallel scans.
+
+    Returns:
+    - rsp_results_df: DataFrame with columns Gene, RSP_Area, RMSD and Deviation_Score.
+    """
+    expression, rows, background_cells, params = prepare_scan(
+        dge_matrix,
+        tsne_results,
+        dbscan_df,
+        genes=genes,
+        threshold=threshold,
+        selected_clusters=selected_clusters,
+        min_coverage=min_coverage,
+        scanning_window=scanning_window,
+        resolution=resolution,
+        angle_range=angle_range,
+        mode=mode,
+        precision=precision,
+    )
+
+    frames = []
+    for _, (chunk_rows, rsp_areas, rmsds, deviation_scores, _) in iter_scan_chunks(
+        expression,
+        tsne_results,
+        rows,
+        background_cells,
+        params,
+        n_jobs=n_jobs,
+        chunk_size=chunk_size,
+        temp_dir=temp_dir,
+    ):
+        frames.append(
+            pd.DataFrame(
+                {
+                    "Gene": expression.index[chunk_rows],
+                    "RSP_Area": rsp_areas,
+                    "RMSD": rmsds,
+                    "Deviation_Score": deviation_scores,
+                }
+            )
+        )
+
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def scan_fingerprint(expression, rows, params):
+    """
+    JSON-compatible description of a scan, used to validate checkpoints.
+
+    Parameters:
+    - expression: ExpressionMatrix of the input data.
+    - rows: Integer numpy array of the gene rows to scan.
+    - params: Dictionary of scan parameters from prepare_scan.
+
+    Returns:
+    - Dictionary of the scan parameters, data shape and a hash of the scanned genes.
+    """
+    fingerprint = {
+        name: value.tolist() if isinstance(value, np.ndarray) else value
+        for name, value in params.items()
+    }
+    fingerprint["shape"] = list(expression.shape)
+    fingerprint["genes"] = hashlib.sha256(
+        "\n".join(map(str, expression.index[rows])).encode()
+    ).hexdigest()
+    # Round-trip through JSON so the fingerprint compares equal to a loaded one.
+    return json.loads(json.dumps(fingerprint))
+
+
+class ScanWriter:
+    """
+    Append-only writer for gene scan results with a checkpoint manifest.
+
+    Result rows are appended to a CSV file and, optionally, each chunk's
+    differences are saved to its own .npz file. After every chunk the manifest
+    records the scan parameters, the completed genes and the committed size of
+    the CSV file, so an interrupted scan can resume where it stopped.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        fingerprint,
+        results_name="biorsp_results.csv",
+        save_differences=False,
+    ):
+        """
+        Parameters:
+        - output_dir: Directory for the results, differences and manifest.
+        - fingerprint: Scan description from scan_fingerprint.
+        - results_name: File name of the results CSV.
+        - save_differences: If True, save each gene's differences vector.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.results_path = os.path.join(output_dir, results_name)
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self.save_differences = save_differences
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest["params"] != fingerprint:
+                raise ValueError(
+                    f"Checkpoint in '{output_dir}' was written with different scan parameters."
+                )
+        else:
+            # Without a checkpoint, existing results were not written by this
+            # writer: never truncate them.
+            if (
+                os.path.exists(self.results_path)
+                and os.path.getsize(self.results_path) > 0
+            ):
+                raise ValueError(
+                    f"'{self.results_path}' exists without a checkpoint manifest; "
+                    "remove it or choose another output directory."
+                )
+            self.manifest = {
+                "params": fingerprint,
+                "results_size": 0,
+                "difference_files": [],
+                "completed_genes": [],
+            }
+            # Commit the empty checkpoint first, so rows of an interrupted first
+            # chunk are recognised as uncommitted on resume.
+            self.commit()
+
+        # Drop rows appended after the last committed checkpoint.
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r+b") as f:
+                f.truncate(self.manifest["results_size"])
+        self.completed_genes = set(self.manifest["completed_genes"])
+
+    def commit(self):
+        """
+        Atomically write the manifest.
+        """
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def write(
+        self, scanned_genes, genes, rsp_areas, rmsds, deviation_scores, differences
+    ):
+        """
+        Append the results of one chunk and commit the checkpoint.
+
+        Parameters:
+        - scanned_genes: Every gene of the chunk, including genes skipped by the
+          coverage filter.
+        - genes: Genes with results.
+        - rsp_areas, rmsds, deviation_scores: Numpy arrays of statistics for those genes.
+        - differences: Numpy array of shape (len(genes), resolution).
+        """
+        chunk_df = pd.DataFrame(
+            {
+                "Gene": genes,
+                "RSP_Area": rsp_areas,
+                "RMSD": rmsds,
+                "Deviation_Score": deviation_scores,
+            }
+        )
+        with open(self.results_path, "a", newline="") as f:
+            chunk_df.to_csv(f, header=f.tell() == 0, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+            results_size = f.tell()
+
+        if self.save_differences and len(genes) > 0:
+            name = f"differences_{len(self.manifest['difference_files']):05d}.npz"
+            np.savez(
+                os.path.join(self.output_dir, name),
+                genes=np.asarray(genes, dtype=str),
+                differences=differences,
+            )
+            self.manifest["difference_files"].append(name)
+
+        scanned_genes = [str(gene) for gene in scanned_genes]
+        self.completed_genes.update(scanned_genes)
+        self.manifest["completed_genes"].extend(scanned_genes)
+        self.manifest["results_size"] = results_size
+        self.commit()
+
+
+def iter_saved_differences(output_dir):
+    """
+    Read back the differences saved by a streamed gene scan, one chunk at a time.
+
+    Parameters:
+    - output_dir: Output directory of stream_gene_scan.
+
+    Yields:
+    - genes: Numpy array of gene names.
+    - differences: Numpy array of shape (len(genes), resolution).
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    for name in manifest["difference_files"]:
+        with np.load(os.path.join(output_dir, name)) as saved:
+            yield saved["genes"], saved["differences"]
+
+
+@profiled("analysis.stream_gene_scan")
+def stream_gene_scan(
+    dge_matrix,
+    tsne_results,
+    dbscan_df,
+    output_dir,
+    genes=None,
+    threshold=1,
+    selected_clusters=None,
+    min_coverage=0.05,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    precision="double",
+    save_differences=False,
+    results_name="biorsp_results.csv",
+    n_jobs=1,
+    chunk_size=64,
+    temp_dir=None,
+):
+    """
+    Run a gene scan that streams results to disk and resumes from its checkpoint.
+
+    Each chunk of genes is appended to the results CSV as soon as it completes,
+    so memory does not grow with the number of genes. Re-running with the same
+    output directory skips the completed genes; the parameters must match those
+    recorded in the manifest.
+
+    Parameters:
+    - output_dir: Directory for the results CSV, differences and manifest.
+    - save_differences: If True, also save each gene's differences vector
+      (read back with iter_saved_differences).
+    - results_name: File name of the results CSV.
+    - Other parameters are those of run_gene_scan.
+
+    Returns:
+    - results_path: Path of the results CSV, with rows in completion order.
+    """
+    expression, rows, background_cells, params = prepare_scan(
+        dge_matrix,
+        tsne_results,
+        dbscan_df,
+        genes=genes,
+        threshold=threshold,
+        selected_clusters=selected_clusters,
+        min_coverage=min_coverage,
+        scanning_window=scanning_window,
+        resolution=resolution,
+        angle_range=angle_range,
+        mode=mode,
+        precision=precision,
+    )
+    writer = ScanWriter(
+        output_dir,
+        scan_fingerprint(expression, rows, params),
+        results_name=results_name,
+        save_differences=save_differences,
+    )
+
+    gene_names = expression.index
+    if writer.completed_genes:
+        pending = ~np.isin(gene_names[rows].astype(str), list(writer.completed_genes))
+        rows = rows[pending]
+
+    for chunk, result in iter_scan_chunks(
+        expression,
+        tsne_results,
+        rows,
+        background_cells,
+        params,
+        n_jobs=n_jobs,
+        chunk_size=chunk_size,
+        temp_dir=temp_dir,
+        ordered=False,
+    ):
+        chunk_rows, rsp_areas, rmsds, deviation_scores, differences = result
+        writer.write(
+            gene_names[chunk],
+            gene_names[chunk_rows],
+            rsp_areas,
+            rmsds,
+            deviation_scores,
+            differences,
+        )
+
+    return writer.results_path
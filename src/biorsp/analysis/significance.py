@@ -0,0 +1,243 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.stats import norm
+from biorsp.analysis.polar_conversion import convert_to_polar
+from biorsp.analysis.rsp_calculations import (
+    calculate_deviation_score,
+    calculate_rmsd,
+    calculate_rsp_area,
+)
+from biorsp.analysis.sweep import background_windows, sweep_batch_differences
+from biorsp.utils.profiling import profiled
+
+STATISTICS = ("rsp_area", "rmsd", "deviation_score")
+
+
+def compute_statistic(differences, statistic, resolution, angle_range):
+    """
+    Compute one RSP statistic for a stack of differences.
+
+    Parameters:
+    - differences: Numpy array of differences, angles on the last axis.
+    - statistic: One of "rsp_area", "rmsd", "deviation_score".
+    - resolution: Number of bins for the histogram.
+    - angle_range: Angular range for CDF computation.
+
+    Returns:
+    - Numpy array of the statistic with the angle axis reduced.
+    """
+    if statistic == "rmsd":
+        return calculate_rmsd(differences)
+    rsp_area = calculate_rsp_area(differences, angle_range, resolution)
+    if statistic == "rsp_area":
+        return rsp_area
+    if statistic == "deviation_score":
+        return calculate_deviation_score(rsp_area, differences, resolution, angle_range)
+    raise ValueError(f"Unknown statistic: {statistic}.")
+
+
+def random_foreground_masks(n_cells, foreground_size, n_masks, rng):
+    """
+    Draw random foreground sets of a fixed size from the background.
+
+    Parameters:
+    - n_cells: Number of background cells.
+    - foreground_size: Number of cells in each random foreground.
+    - n_masks: Number of random foregrounds.
+    - rng: Numpy random Generator.
+
+    Returns:
+    - Boolean scipy CSR matrix of shape (n_masks, n_cells).
+    """
+    indices = np.concatenate(
+        [
+            np.sort(rng.choice(n_cells, foreground_size, replace=False))
+            for _ in range(n_masks)
+        ]
+    ).astype(np.int64)
+    indptr = np.arange(n_masks + 1) * foreground_size
+    data = np.ones(indices.shape[0], dtype=bool)
+    return csr_matrix((data, indices, indptr), shape=(n_masks, n_cells))
+
+
+def empirical_p_value(n_extreme, n_permutations):
+    """
+    Empirical permutation p-value with the +1 correction.
+
+    Parameters:
+    - n_extreme: Number of permutations at least as extreme as the observation.
+    - n_permutations: Number of permutations evaluated.
+
+    Returns:
+    - The p-value (n_extreme + 1) / (n_permutations + 1).
+    """
+    return (np.asarray(n_extreme) + 1) / (np.asarray(n_permutations) + 1)
+
+
+def p_value_bounds(n_extreme, n_permutations, confidence=0.999):
+    """
+    Wilson score interval for the true p-value after a number of permutations.
+
+    Parameters:
+    - n_extreme: Number of permutations at least as extreme as the observation.
+    - n_permutations: Number of permutations evaluated.
+    - confidence: Two-sided confidence level of the interval.
+
+    Returns:
+    - lower, upper: Bounds of the interval.
+    """
+    z = norm.ppf(0.5 + confidence / 2)
+    p_hat = n_extreme / n_permutations
+    denominator = 1 + z**2 / n_permutations
+    center = (p_hat + z**2 / (2 * n_permutations)) / denominator
+    half_width = (
+        z
+        * np.sqrt(p_hat * (1 - p_hat) / n_permutations + z**2 / (4 * n_permutations**2))
+        / denominator
+    )
+    return center - half_width, center + half_width
+
+
+def benjamini_hochberg(p_values):
+    """
+    Adjust p-values for the false discovery rate across genes (Benjamini-Hochberg).
+
+    Parameters:
+    - p_values: Numpy array of p-values; NaN entries are ignored.
+
+    Returns:
+    - Numpy array of adjusted p-values (q-values) in the input order.
+    """
+    p_values = np.asarray(p_values, dtype=np.float64)
+    q_values = np.full(p_values.shape, np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if tested.shape[0] == 0:
+        return q_values
+
+    order = tested[np.argsort(p_values[tested])]
+    ranked = p_values[order] * tested.shape[0] / np.arange(1, tested.shape[0] + 1)
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+
+@profiled("analysis.permutation_test")
+def permutation_test(
+    foreground_masks,
+    background_points,
+    vantage_point,
+    statistic="rsp_area",
+    alternative="greater",
+    n_permutations=1000,
+    batch_size=100,
+    alpha=0.05,
+    early_stopping=True,
+    confidence=0.999,
+    seed=None,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+):
+    """
+    Test RSP statistics against random foregrounds of the same size.
+
+    For every gene, random foreground sets with as many cells as the gene's
+    foreground are drawn from the background and scored in batches of
+    batch_size permutations. With early stopping, a gene stops drawing once the
+    confidence interval of its p-value lies entirely above alpha. Genes that
+    look significant always run every permutation: their p-values are
+    BH-adjusted across genes afterwards, so they need the full resolution of
+    n_permutations rather than just enough to clear alpha on their own.
+
+    Parameters:
+    - foreground_masks: Boolean numpy array or scipy sparse matrix of shape
+      (genes, cells), or a 1D boolean array for a single gene, marking foreground
+      cells among the background points.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - vantage_point: 2D numpy array for the vantage point.
+    - statistic: One of "rsp_area", "rmsd", "deviation_score".
+    - alternative: "greater" if large statistics are extreme, "less" otherwise.
+    - n_permutations: Maximum number of permutations per gene.
+    - batch_size: Number of permutations scored together.
+    - alpha: Significance level used for early stopping.
+    - early_stopping: If True, stop a gene once its p-value is clearly above alpha.
+    - confidence: Confidence level of the early stopping interval.
+    - seed: Seed for reproducible permutations; each gene gets an independent stream.
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of bins for the histogram.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+
+    Returns:
+    - observed: Numpy array of the observed statistic per gene.
+    - p_values: Numpy array of empirical p-values per gene.
+    - q_values: Numpy array of Benjamini-Hochberg adjusted p-values across genes.
+    - n_used: Numpy array of the number of permutations evaluated per gene.
+    """
+    if alternative not in ("greater", "less"):
+        raise ValueError(f"Unknown alternative: {alternative}.")
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic: {statistic}.")
+
+    single_gene = np.ndim(foreground_masks) == 1
+    if single_gene:
+        foreground_masks = np.asarray(foreground_masks)[None, :]
+    if foreground_masks.shape[1] != background_points.shape[0]:
+        raise ValueError(
+            "Foreground masks do not match the number of background points."
+        )
+    foreground_masks = csr_matrix(foreground_masks, dtype=bool)
+    foreground_masks.eliminate_zeros()
+
+    n_genes, n_cells = foreground_masks.shape
+    _, bg_theta, bg_order = convert_to_polar(
+        background_points, vantage_point, return_order=True
+    )
+    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+    # The background windows are the same for the observed foregrounds and every
+    # permutation batch of every gene.
+    windows = background_windows(bg_theta, angles, scanning_window, resolution)
+
+    def score(masks):
+        differences = sweep_batch_differences(
+            masks,
+            bg_theta,
+            angles,
+            scanning_window,
+            resolution,
+            mode,
+            cell_order=bg_order,
+            windows=windows,
+        )
+        return compute_statistic(differences, statistic, resolution, angle_range)
+
+    observed = score(foreground_masks)
+    foreground_sizes = np.diff(foreground_masks.indptr)
+    n_extreme = np.zeros(n_genes, dtype=np.int64)
+    n_used = np.zeros(n_genes, dtype=np.int64)
+    streams = np.random.SeedSequence(seed).spawn(n_genes)
+
+    for gene in range(n_genes):
+        rng = np.random.default_rng(streams[gene])
+        while n_used[gene] < n_permutations:
+            n_batch = min(batch_size, n_permutations - n_used[gene])
+            null = score(
+                random_foreground_masks(n_cells, foreground_sizes[gene], n_batch, rng)
+            )
+            if alternative == "greater":
+                n_extreme[gene] += np.count_nonzero(null >= observed[gene])
+            else:
+                n_extreme[gene] += np.count_nonzero(null <= observed[gene])
+            n_used[gene] += n_batch
+
+            if early_stopping:
+                lower, _ = p_value_bounds(n_extreme[gene], n_used[gene], confidence)
+                if lower > alpha:
+                    break
+
+    p_values = empirical_p_value(n_extreme, n_used)
+    q_values = benjamini_hochberg(p_values)
+
+    if single_gene:
+        return observed[0], p_values[0], q_values[0], n_used[0]
+    return observed, p_values, q_values, n_used
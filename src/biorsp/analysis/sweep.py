@@ -0,0 +1,617 @@
+from fractions import Fraction
+from math import gcd
+
+import numpy as np
+from scipy.sparse import issparse
+from biorsp.analysis.precision import theta_precision
+from biorsp.utils.profiling import profiled
+
+
+def window_starts(angles, scanning_window):
+    """
+    Compute the start angle of every scanning window.
+
+    Parameters:
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_window: Size of the scanning window in radians.
+
+    Returns:
+    - Numpy array of window start angles wrapped into [0, 2 * pi).
+    """
+    return (np.asarray(angles) - scanning_window / 2) % (2 * np.pi)
+
+
+def extend_circular(sorted_theta):
+    """
+    Unroll sorted angles over two turns so circular windows become contiguous slices.
+
+    Parameters:
+    - sorted_theta: Numpy array of angles in [0, 2 * pi), sorted ascending.
+
+    Returns:
+    - Numpy array of length 2 * N holding sorted_theta followed by sorted_theta + 2 * pi.
+    """
+    return np.concatenate([sorted_theta, sorted_theta + 2 * np.pi])
+
+
+def angular_lattice(values, max_size=2**20):
+    """
+    Find the coarsest circular grid on which every given angle lies.
+
+    Parameters:
+    - values: Iterable of angles in radians (window offsets, bin widths, centers).
+    - max_size: Largest number of grid points per turn worth tabulating.
+
+    Returns:
+    - The number of grid points per turn, or None if no such grid is small enough.
+    """
+    values = np.atleast_1d(np.asarray(values, dtype=np.float64)) / (2 * np.pi)
+    n_grid = 1
+    for value in np.unique(np.round(values, 12)):
+        denominator = Fraction(float(value)).limit_denominator(max_size).denominator
+        n_grid = n_grid * denominator // gcd(n_grid, denominator)
+        if n_grid > max_size:
+            return None
+
+    steps = values * n_grid
+    if not np.allclose(steps, np.round(steps), rtol=0, atol=1e-8):
+        return None
+    return n_grid
+
+
+class AngularCounts:
+    """
+    Cumulative counts of sorted angles, shared by every scanning window of a sweep.
+
+    Counting the points below a bin edge is a binary search on the angles
+    unrolled over two turns. When all bin edges lie on a common circular grid
+    the counts at every grid point are tabulated once and then only gathered.
+    Ranks and counts use the compact types of the angles' precision.
+    """
+
+    def __init__(self, sorted_theta):
+        """
+        Parameters:
+        - sorted_theta: Numpy array of angles in [0, 2 * pi), sorted ascending.
+        """
+        self.n_points = sorted_theta.shape[0]
+        self.extended = extend_circular(sorted_theta)
+        self.precision = theta_precision(sorted_theta)
+        self._tables = {}
+
+    def _ranks(self, values, side):
+        # Search in the angles' own type so float32 angles are never upcast.
+        values = np.asarray(values, dtype=self.extended.dtype)
+        ranks = np.searchsorted(self.extended, values, side=side)
+        return ranks.astype(self.precision.index_dtype, copy=False)
+
+    def grid_table(self, n_grid):
+        """
+        Counts of points strictly below and at-or-below every grid point over two turns.
+
+        Parameters:
+        - n_grid: Number of grid points per turn.
+
+        Returns:
+        - left, right: Integer numpy arrays of length 2 * n_grid + 1.
+        """
+        if n_grid not in self._tables:
+            grid = np.arange(2 * n_grid + 1) * (2 * np.pi / n_grid)
+            self._tables[n_grid] = (
+                self._ranks(grid, side="left"),
+                self._ranks(grid, side="right"),
+            )
+        return self._tables[n_grid]
+
+    def window_ranks(self, angles, scanning_window, n_bins, n_grid=None):
+        """
+        Locate every window start and histogram bin edge in the unrolled angles.
+
+        Parameters:
+        - angles: Numpy array of scanning window centers in radians.
+        - scanning_window: Size of the scanning window in radians.
+        - n_bins: Number of histogram bins inside each window.
+        - n_grid: Optional grid size from angular_lattice covering all bin edges.
+
+        Returns:
+        - lower: Integer numpy array of shape (len(angles),), the rank of each window start.
+        - upper: Integer numpy array of shape (len(angles), n_bins), the rank of each
+          upper bin edge. The last bin is closed on the right.
+        """
+        starts = window_starts(angles, scanning_window)
+
+        if n_grid is not None:
+            left, right = self.grid_table(n_grid)
+            grid_step = 2 * np.pi / n_grid
+            lower = np.round(starts / grid_step).astype(np.int64) % n_grid
+            upper = lower[:, None] + np.round(
+                np.linspace(0, scanning_window, n_bins + 1)[1:] / grid_step
+            ).astype(np.int64)
+            np.minimum(upper, 2 * n_grid, out=upper)
+            upper[:, :-1] = left[upper[:, :-1]]
+            upper[:, -1] = right[upper[:, -1]]
+            return left[lower], upper.astype(self.precision.index_dtype, copy=False)
+
+        upper_edges = starts[:, None] + np.linspace(0, scanning_window, n_bins + 1)[1:]
+        lower = self._ranks(starts, side="left")
+        upper = np.empty(upper_edges.shape, dtype=self.precision.index_dtype)
+        upper[:, :-1] = self._ranks(upper_edges[:, :-1], side="left")
+        upper[:, -1] = self._ranks(upper_edges[:, -1], side="right")
+        return lower, upper
+
+    def window_counts(self, angles, scanning_window, n_bins, n_grid=None):
+        """
+        Count, for every scanning window, the points below each histogram bin edge.
+
+        Row i equals np.cumsum(compute_histogram(...)) for the window centered
+        at angles[i], without a pass over the points.
+
+        Parameters:
+        - angles: Numpy array of scanning window centers in radians.
+        - scanning_window: Size of the scanning window in radians.
+        - n_bins: Number of histogram bins inside each window.
+        - n_grid: Optional grid size from angular_lattice covering all bin edges.
+
+        Returns:
+        - counts: Integer numpy array of shape (len(angles), n_bins).
+        """
+        count_dtype = self.precision.count_dtype
+        if self.n_points == 0:
+            return np.zeros((len(angles), n_bins), dtype=count_dtype)
+
+        lower, upper = self.window_ranks(angles, scanning_window, n_bins, n_grid)
+        counts = upper - lower[:, None]
+        np.minimum(counts, self.n_points, out=counts)
+        return counts.astype(count_dtype, copy=False)
+
+
+def cumulative_window_counts(sorted_theta, angles, scanning_window, n_bins):
+    """
+    Count, for every scanning window, the points below each histogram bin edge.
+
+    Parameters:
+    - sorted_theta: Numpy array of angles in [0, 2 * pi), sorted ascending.
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_window: Size of the scanning window in radians.
+    - n_bins: Number of histogram bins inside each window.
+
+    Returns:
+    - counts: Integer numpy array of shape (len(angles), n_bins).
+    """
+    return AngularCounts(sorted_theta).window_counts(angles, scanning_window, n_bins)
+
+
+def sweep_lattice(angles, scanning_windows, n_bins):
+    """
+    Choose a shared count grid for a sweep, or None when binary search is cheaper.
+
+    Parameters:
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_windows: Iterable of scanning window sizes in radians.
+    - n_bins: Number of histogram bins inside each window.
+
+    Returns:
+    - The number of grid points per turn, or None.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    if angles.shape[0] == 0:
+        return None
+
+    values = [angles[0]]
+    if angles.shape[0] > 1:
+        values.append(angles[1] - angles[0])
+    for scanning_window in scanning_windows:
+        values.extend([scanning_window / 2, scanning_window / n_bins])
+
+    n_grid = angular_lattice(values)
+    if n_grid is None or 2 * n_grid > angles.shape[0] * n_bins * len(scanning_windows):
+        return None
+
+    steps = angles * n_grid / (2 * np.pi)
+    if not np.allclose(steps, np.round(steps), rtol=0, atol=1e-8):
+        return None
+    return n_grid
+
+
+def window_differences(fg_counts, bg_counts, scanning_window, mode, dtype=np.float64):
+    """
+    Compute the area between foreground and background CDFs from cumulative counts.
+
+    Parameters:
+    - fg_counts: Numpy array of cumulative foreground counts, bins on the last axis.
+    - bg_counts: Numpy array of cumulative background counts, broadcastable to fg_counts.
+    - scanning_window: Size of the scanning window in radians.
+    - mode: Mode for scaling CDFs.
+    - dtype: Floating point type of the CDFs and areas.
+
+    Returns:
+    - Numpy array of areas with the bin axis reduced.
+    """
+    fg_total = fg_counts[..., -1:].astype(dtype)
+    bg_total = bg_counts[..., -1:].astype(dtype)
+
+    # Each CDF is its counts times one factor per window: 1 / total, or 0 when
+    # the window is empty. In absolute mode the foreground CDF is additionally
+    # scaled by fg_total / bg_total, which reduces to 1 / bg_total.
+    fg_scale, bg_scale = window_scales(fg_total, bg_total, mode, dtype)
+
+    gap = np.multiply(fg_counts, fg_scale, dtype=dtype)
+    gap -= np.multiply(bg_counts, bg_scale, dtype=dtype)
+    np.abs(gap, out=gap)
+
+    # Trapezoidal rule with uniform spacing.
+    dx = scanning_window / fg_counts.shape[-1]
+    return dx * (gap.sum(axis=-1) - 0.5 * (gap[..., 0] + gap[..., -1]))
+
+
+def sweep_differences(
+    fg_theta, bg_theta, angles, scanning_window, n_bins, mode, chunk_size=256
+):
+    """
+    Calculate the CDF differences for every scanning window in a single sweep.
+
+    Parameters:
+    - fg_theta: Numpy array of foreground angles in radians, sorted ascending.
+    - bg_theta: Numpy array of background angles in radians, sorted ascending.
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_window: Size of the scanning window in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - mode: Mode for scaling CDFs.
+    - chunk_size: Number of windows evaluated at once, bounding peak memory.
+
+    Returns:
+    - differences: Numpy array of differences, one per angle.
+    """
+    return sweep_multiscale_differences(
+        fg_theta, bg_theta, angles, [scanning_window], n_bins, mode, chunk_size
+    )[0]
+
+
+@profiled("analysis.sweep_multiscale_differences")
+def sweep_multiscale_differences(
+    fg_theta, bg_theta, angles, scanning_windows, n_bins, mode, chunk_size=256
+):
+    """
+    Calculate the CDF differences for several scanning window sizes in a single sweep.
+
+    The angular count structures of the foreground and background are built
+    once and shared by every window size.
+
+    Parameters:
+    - fg_theta: Numpy array of foreground angles in radians, sorted ascending.
+    - bg_theta: Numpy array of background angles in radians, sorted ascending.
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_windows: Iterable of scanning window sizes in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - mode: Mode for scaling CDFs.
+    - chunk_size: Number of windows evaluated at once, bounding peak memory.
+
+    Returns:
+    - differences: Numpy array of shape (len(scanning_windows), len(angles)), in the
+      floating point type of the background angles.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    scanning_windows = list(scanning_windows)
+
+    fg_counts = AngularCounts(fg_theta)
+    bg_counts = AngularCounts(bg_theta)
+    dtype = bg_counts.precision.float_dtype
+    differences = np.empty((len(scanning_windows), angles.shape[0]), dtype=dtype)
+    n_grid = sweep_lattice(angles, scanning_windows, n_bins)
+
+    for i, scanning_window in enumerate(scanning_windows):
+        for start in range(0, angles.shape[0], chunk_size):
+            chunk = angles[start : start + chunk_size]
+            differences[i, start : start + chunk_size] = window_differences(
+                fg_counts.window_counts(chunk, scanning_window, n_bins, n_grid),
+                bg_counts.window_counts(chunk, scanning_window, n_bins, n_grid),
+                scanning_window,
+                mode,
+                dtype,
+            )
+
+    return differences
+
+
+@profiled("analysis.sweep_adaptive_differences")
+def sweep_adaptive_differences(
+    fg_theta,
+    bg_theta,
+    angle_range,
+    scanning_window,
+    n_bins,
+    mode,
+    initial_resolution=64,
+    max_resolution=1024,
+    tolerance=5e-3,
+):
+    """
+    Calculate the CDF differences on an adaptively refined grid of scanning angles.
+
+    Starting from initial_resolution uniform angles, every gap whose two end
+    angles differ by more than tolerance is split at its midpoint, until no gap
+    needs refinement or the spacing of max_resolution angles is reached. Only the
+    new angles are evaluated in each round. All angles lie on the uniform grid of
+    initial_resolution * 2**k angles, the first power of two at least max_resolution.
+
+    Parameters:
+    - fg_theta: Numpy array of foreground angles in radians, sorted ascending.
+    - bg_theta: Numpy array of background angles in radians, sorted ascending.
+    - angle_range: Angular range for CDF computation.
+    - scanning_window: Size of the scanning window in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - mode: Mode for scaling CDFs.
+    - initial_resolution: Number of uniform angles of the coarse grid.
+    - max_resolution: Number of angles of the finest grid.
+    - tolerance: Largest change in differences tolerated between neighbouring angles.
+
+    Returns:
+    - angles: Numpy array of the scanning angles, sorted ascending.
+    - differences: Numpy array of differences, one per angle.
+    """
+    n_levels = max(0, int(np.ceil(np.log2(max_resolution / initial_resolution))))
+    n_fine = initial_resolution * 2**n_levels
+    fine_step = (angle_range[1] - angle_range[0]) / n_fine
+    circular = np.isclose(angle_range[1] - angle_range[0], 2 * np.pi)
+
+    fg_counts = AngularCounts(fg_theta)
+    bg_counts = AngularCounts(bg_theta)
+    dtype = bg_counts.precision.float_dtype
+    n_grid = sweep_lattice(
+        angle_range[0] + np.arange(n_fine) * fine_step, [scanning_window], n_bins
+    )
+
+    def evaluate(positions, chunk_size=256):
+        angles = angle_range[0] + positions * fine_step
+        differences = np.empty(angles.shape[0], dtype=dtype)
+        for start in range(0, angles.shape[0], chunk_size):
+            chunk = angles[start : start + chunk_size]
+            differences[start : start + chunk_size] = window_differences(
+                fg_counts.window_counts(chunk, scanning_window, n_bins, n_grid),
+                bg_counts.window_counts(chunk, scanning_window, n_bins, n_grid),
+                scanning_window,
+                mode,
+                dtype,
+            )
+        return differences
+
+    # Angles are kept as integer positions on the fine grid so midpoints are exact.
+    positions = np.arange(0, n_fine, 2**n_levels)
+    differences = evaluate(positions)
+    while True:
+        gaps = np.diff(np.append(positions, n_fine))
+        following = np.append(
+            differences[1:], differences[0] if circular else differences[-1]
+        )
+        refine = (np.abs(following - differences) > tolerance) & (gaps > 1)
+        if not refine.any():
+            break
+
+        new_positions = positions[refine] + gaps[refine] // 2
+        positions = np.concatenate([positions, new_positions])
+        differences = np.concatenate([differences, evaluate(new_positions)])
+        order = np.argsort(positions, kind="stable")
+        positions, differences = positions[order], differences[order]
+
+    return angle_range[0] + positions * fine_step, differences
+
+
+def window_scales(fg_total, bg_total, mode, dtype=np.float64):
+    """
+    Normalisation factors turning cumulative window counts into CDFs.
+
+    Parameters:
+    - fg_total: Numpy array of foreground counts per window.
+    - bg_total: Numpy array of background counts per window.
+    - mode: Mode for scaling CDFs.
+    - dtype: Floating point type of the factors.
+
+    Returns:
+    - fg_scale, bg_scale: Numpy arrays of factors, 0 for empty windows.
+    """
+    fg_total = np.asarray(fg_total, dtype=dtype)
+    bg_total = np.asarray(bg_total, dtype=dtype)
+    bg_scale = np.divide(
+        1.0, bg_total, out=np.zeros(bg_total.shape, dtype), where=bg_total > 0
+    )
+    fg_scale = np.divide(
+        1.0, fg_total, out=np.zeros(fg_total.shape, dtype), where=fg_total > 0
+    )
+    if mode == "absolute":
+        fg_scale = np.where(bg_total > 0, bg_scale, fg_scale)
+    return fg_scale, bg_scale
+
+
+@profiled("analysis.sweep_exact_differences")
+def sweep_exact_differences(fg_theta, bg_theta, angles, scanning_window, mode):
+    """
+    Calculate the exact area between foreground and background CDFs for every window.
+
+    Foreground and background angles are merged once and unrolled over two
+    turns, so each window is a contiguous run of the merged samples. Between
+    consecutive samples both CDFs are constant, and the area is the sum of
+    |F_fg - F_bg| times the gap to the next sample (or to the window end). This
+    is the limit of the binned differences as n_bins grows.
+
+    Each window costs one pass over its samples (a slice of the merged arrays
+    and a dot product), so the total cost is resolution times the number of
+    samples per window, while the binned sweep costs resolution times n_bins.
+    At resolution 1000 and a half-turn window the two match at 20k cells and
+    the exact sweep is about 6x slower at 100k; the binned sweep needs
+    n_bins=100000 (about 2.5 s) to come within 1e-7 of the exact areas.
+
+    Parameters:
+    - fg_theta: Numpy array of foreground angles in radians, sorted ascending.
+    - bg_theta: Numpy array of background angles in radians, sorted ascending.
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_window: Size of the scanning window in radians.
+    - mode: Mode for scaling CDFs.
+
+    Returns:
+    - differences: Numpy array of differences, one per angle.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    dtype = theta_precision(bg_theta).float_dtype
+    differences = np.zeros(angles.shape[0], dtype=dtype)
+
+    n_fg = fg_theta.shape[0]
+    theta = np.concatenate([fg_theta, bg_theta])
+    n_points = theta.shape[0]
+    if n_points == 0:
+        return differences
+
+    order = np.argsort(theta, kind="stable")
+    merged = extend_circular(theta[order])
+    # Length over which the CDFs hold after each sample. The last sample of a
+    # window holds until the window end instead, corrected per window below.
+    spacing = np.zeros(2 * n_points, dtype=np.float64)
+    spacing[:-1] = np.diff(merged)
+    fg_prefix = np.zeros(2 * n_points + 1, dtype=np.float64)
+    np.cumsum(np.tile(order < n_fg, 2), out=fg_prefix[1:])
+    passed = np.arange(1, n_points + 1, dtype=np.float64)
+
+    starts = window_starts(angles, scanning_window)
+    ends = starts + scanning_window
+    lower = np.searchsorted(merged, starts.astype(merged.dtype), side="left")
+    upper = np.searchsorted(merged, ends.astype(merged.dtype), side="right")
+    np.minimum(upper, lower + n_points, out=upper)
+
+    sizes = upper - lower
+    fg_total = fg_prefix[upper] - fg_prefix[lower]
+    fg_scale, bg_scale = window_scales(fg_total, sizes - fg_total, mode)
+    # With j samples passed, of which f are foreground, the gap between the
+    # CDFs is (fg_scale + bg_scale) * f - bg_scale * j.
+    total_scale = fg_scale + bg_scale
+
+    for window in np.flatnonzero(sizes > 0):
+        start, stop = lower[window], upper[window]
+        gap = fg_prefix[start + 1 : stop + 1] - fg_prefix[start]
+        gap *= total_scale[window]
+        gap -= bg_scale[window] * passed[: stop - start]
+        np.abs(gap, out=gap)
+        area = gap @ spacing[start:stop]
+        last = stop - 1
+        area += gap[-1] * (ends[window] - merged[last] - spacing[last])
+        differences[window] = area
+
+    return differences
+
+
+def prefix_counts(masks):
+    """
+    Running foreground counts along the sorted background, unrolled over two turns.
+
+    Parameters:
+    - masks: Boolean numpy array of shape (genes, cells), cells in sorted-angle order.
+
+    Returns:
+    - prefix: Integer numpy array of shape (genes, 2 * cells + 1) where prefix[:, j]
+      counts the foreground cells among the first j unrolled background cells.
+    """
+    n_genes, n_cells = masks.shape
+    prefix = np.zeros((n_genes, 2 * n_cells + 1), dtype=np.int32)
+    np.cumsum(masks, axis=1, dtype=np.int32, out=prefix[:, 1 : n_cells + 1])
+    prefix[:, n_cells + 1 :] = (
+        prefix[:, n_cells : n_cells + 1] + prefix[:, 1 : n_cells + 1]
+    )
+    return prefix
+
+
+@profiled("analysis.background_windows")
+def background_windows(bg_theta, angles, scanning_window, n_bins, chunk_size=64):
+    """
+    Background ranks and counts of every window, shared by all foregrounds.
+
+    Parameters:
+    - bg_theta: Numpy array of background angles in radians, sorted ascending.
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_window: Size of the scanning window in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - chunk_size: Number of windows per chunk, bounding peak memory.
+
+    Returns:
+    - bg_counts: AngularCounts of the background.
+    - window_chunks: List of (window slice, lower ranks, upper ranks, background
+      counts) tuples, one per chunk of windows.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    bg_counts = AngularCounts(bg_theta)
+    n_grid = sweep_lattice(angles, [scanning_window], n_bins)
+    window_chunks = []
+    for start in range(0, angles.shape[0], chunk_size):
+        chunk = angles[start : start + chunk_size]
+        lower, upper = bg_counts.window_ranks(chunk, scanning_window, n_bins, n_grid)
+        counts = np.minimum(upper - lower[:, None], bg_counts.n_points).astype(
+            bg_counts.precision.count_dtype, copy=False
+        )
+        window_chunks.append((slice(start, start + chunk_size), lower, upper, counts))
+    return bg_counts, window_chunks
+
+
+@profiled("analysis.sweep_batch_differences")
+def sweep_batch_differences(
+    foreground_masks,
+    bg_theta,
+    angles,
+    scanning_window,
+    n_bins,
+    mode,
+    cell_order=None,
+    gene_chunk_size=32,
+    chunk_size=64,
+    windows=None,
+):
+    """
+    Calculate the CDF differences of many foregrounds against one shared background.
+
+    Background ranks and counts are computed once. Foreground counts for a chunk
+    of genes are read off prefix sums of their masks at those shared ranks.
+
+    Parameters:
+    - foreground_masks: Boolean numpy array or scipy sparse matrix of shape
+      (genes, cells) marking the foreground cells of each gene within the background.
+    - bg_theta: Numpy array of background angles in radians, sorted ascending.
+    - angles: Numpy array of scanning window centers in radians.
+    - scanning_window: Size of the scanning window in radians.
+    - n_bins: Number of histogram bins inside each window.
+    - mode: Mode for scaling CDFs.
+    - cell_order: Optional permutation sorting the mask columns by angle.
+    - gene_chunk_size: Number of genes evaluated at once.
+    - chunk_size: Number of windows evaluated at once, bounding peak memory.
+    - windows: Optional result of background_windows for the same background,
+      angles and window, reused instead of being recomputed (e.g. across the
+      batches of a permutation test).
+
+    Returns:
+    - differences: Numpy array of shape (genes, len(angles)), in the floating point
+      type of the background angles.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    n_genes = foreground_masks.shape[0]
+
+    if windows is None:
+        windows = background_windows(
+            bg_theta, angles, scanning_window, n_bins, chunk_size
+        )
+    bg_counts, window_chunks = windows
+    dtype = bg_counts.precision.float_dtype
+    differences = np.empty((n_genes, angles.shape[0]), dtype=dtype)
+
+    for gene_start in range(0, n_genes, gene_chunk_size):
+        genes = slice(gene_start, gene_start + gene_chunk_size)
+        masks = foreground_masks[genes]
+        masks = masks.toarray() if issparse(masks) else np.asarray(masks)
+        if cell_order is not None:
+            masks = masks[:, cell_order]
+
+        prefix = prefix_counts(masks != 0)
+        totals = prefix[:, bg_counts.n_points, None, None]
+
+        for window_slice, lower, upper, counts in window_chunks:
+            fg_counts = prefix[:, upper] - prefix[:, lower][:, :, None]
+            np.minimum(fg_counts, totals, out=fg_counts)
+            differences[genes, window_slice] = window_differences(
+                fg_counts, counts, scanning_window, mode, dtype
+            )
+
+    return differences
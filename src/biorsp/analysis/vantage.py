@@ -0,0 +1,299 @@
+import numpy as np
+from biorsp.analysis.rsp_calculations import (
+    calculate_deviation_score,
+    calculate_rmsd,
+    calculate_rsp_area,
+)
+from biorsp.analysis.sweep import sweep_batch_differences
+from biorsp.utils.profiling import profiled
+
+STATISTICS = ("rsp_area", "rmsd", "deviation_score")
+
+
+def vantage_grid(points, grid_size=10, padding=0.0):
+    """
+    Build a regular grid of vantage points over the bounding box of an embedding.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - grid_size: Number of grid points per axis (int) or (n_x, n_y).
+    - padding: Fraction of the box size added on every side.
+
+    Returns:
+    - Numpy array of shape (n_x * n_y, 2) with the grid vantage points.
+    """
+    n_x, n_y = np.broadcast_to(grid_size, 2)
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    margin = (upper - lower) * padding
+    xs = np.linspace(lower[0] - margin[0], upper[0] + margin[0], n_x)
+    ys = np.linspace(lower[1] - margin[1], upper[1] + margin[1], n_y)
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    return np.column_stack([grid_x.ravel(), grid_y.ravel()])
+
+
+def cluster_vantage_points(
+    points, labels, method="centroid", exclude_noise=True, max_candidates=1000, seed=0
+):
+    """
+    Build one vantage point per cluster.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - labels: Numpy array of cluster labels for each point (0 is noise, as returned
+      by compute_dbscan).
+    - method: "centroid" for the cluster mean, or "medoid" for the cluster member with
+      the smallest total distance to the other members.
+    - exclude_noise: If True, skip cluster 0.
+    - max_candidates: For medoids, the number of members tried as candidates;
+      larger clusters use a random subset of candidates.
+    - seed: Random seed for the candidate subset.
+
+    Returns:
+    - clusters: Numpy array of cluster labels.
+    - vantage_points: Numpy array of shape (len(clusters), 2).
+    """
+    if method not in ("centroid", "medoid"):
+        raise ValueError(f"Unknown vantage point method: {method}.")
+
+    labels = np.asarray(labels)
+    clusters = np.unique(labels)
+    if exclude_noise:
+        clusters = clusters[clusters != 0]
+
+    rng = np.random.default_rng(seed)
+    vantage_points = np.empty((len(clusters), 2))
+    for i, cluster in enumerate(clusters):
+        members = points[labels == cluster]
+        if method == "centroid":
+            vantage_points[i] = members.mean(axis=0)
+            continue
+
+        candidates = members
+        if members.shape[0] > max_candidates:
+            candidates = members[
+                rng.choice(members.shape[0], max_candidates, replace=False)
+            ]
+        total_distance = np.zeros(candidates.shape[0])
+        for start in range(0, members.shape[0], 4096):
+            block = members[start : start + 4096]
+            total_distance += np.linalg.norm(
+                candidates[:, None, :] - block[None, :, :], axis=-1
+            ).sum(axis=1)
+        vantage_points[i] = candidates[np.argmin(total_distance)]
+
+    return clusters, vantage_points
+
+
+def polar_angles(points, vantage_points):
+    """
+    Angular coordinates of every point around every vantage point.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates, shape (N, 2).
+    - vantage_points: Numpy array of vantage points, shape (V, 2).
+
+    Returns:
+    - Numpy array of angles in [0, 2 * pi) with shape (V, N).
+    """
+    translated_x = points[None, :, 0] - vantage_points[:, 0, None]
+    translated_y = points[None, :, 1] - vantage_points[:, 1, None]
+    theta = np.arctan2(translated_y, translated_x)
+    return np.mod(theta + 2 * np.pi, 2 * np.pi)
+
+
+@profiled("analysis.evaluate_vantage_points")
+def evaluate_vantage_points(
+    foreground_masks,
+    background_points,
+    vantage_points,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    max_elements=2**24,
+    return_differences=False,
+):
+    """
+    Perform RSP analysis for a batch of vantage points and genes in one call.
+
+    Polar conversions of the background are broadcast over a chunk of vantage
+    points at a time, with at most max_elements angles in memory.
+
+    Parameters:
+    - foreground_masks: Boolean numpy array or scipy sparse matrix of shape
+      (genes, cells), or a 1D boolean array for a single gene, marking foreground
+      cells among the background points.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - vantage_points: Numpy array of vantage points, shape (V, 2).
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of bins for the histogram.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - max_elements: Upper bound on the number of angles held per chunk of vantage points.
+    - return_differences: If True, also return the differences.
+
+    Returns:
+    - rsp_areas: Numpy array of shape (V, genes), or (V,) for a 1D mask.
+    - rmsds: Numpy array of the same shape.
+    - deviation_scores: Numpy array of the same shape.
+    - differences: Numpy array of shape (V, genes, resolution) (only if return_differences).
+    """
+    single_gene = np.ndim(foreground_masks) == 1
+    if single_gene:
+        foreground_masks = np.asarray(foreground_masks)[None, :]
+    if foreground_masks.shape[1] != background_points.shape[0]:
+        raise ValueError(
+            "Foreground masks do not match the number of background points."
+        )
+
+    vantage_points = np.atleast_2d(np.asarray(vantage_points, dtype=np.float64))
+    n_vantage, n_genes = vantage_points.shape[0], foreground_masks.shape[0]
+    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+
+    rsp_areas = np.empty((n_vantage, n_genes))
+    rmsds = np.empty((n_vantage, n_genes))
+    deviation_scores = np.empty((n_vantage, n_genes))
+    differences = (
+        np.empty((n_vantage, n_genes, resolution)) if return_differences else None
+    )
+
+    chunk_size = max(1, max_elements // max(1, background_points.shape[0]))
+    for start in range(0, n_vantage, chunk_size):
+        theta = polar_angles(
+            background_points, vantage_points[start : start + chunk_size]
+        )
+        order = np.argsort(theta, axis=1)
+        sorted_theta = np.take_along_axis(theta, order, axis=1)
+
+        for offset in range(theta.shape[0]):
+            vantage_differences = sweep_batch_differences(
+                foreground_masks,
+                sorted_theta[offset],
+                angles,
+                scanning_window,
+                resolution,
+                mode,
+                cell_order=order[offset],
+            )
+            i = start + offset
+            rsp_areas[i] = calculate_rsp_area(
+                vantage_differences, angle_range, resolution
+            )
+            rmsds[i] = calculate_rmsd(vantage_differences)
+            deviation_scores[i] = calculate_deviation_score(
+                rsp_areas[i], vantage_differences, resolution, angle_range
+            )
+            if return_differences:
+                differences[i] = vantage_differences
+
+    results = [rsp_areas, rmsds, deviation_scores]
+    if return_differences:
+        results.append(differences)
+    if single_gene:
+        results = [result[:, 0] for result in results]
+    return tuple(results)
+
+
+@profiled("analysis.find_best_vantage_points")
+def find_best_vantage_points(
+    foreground_masks,
+    background_points,
+    candidates="grid",
+    labels=None,
+    statistic="rsp_area",
+    objective="max",
+    grid_size=10,
+    n_refinements=0,
+    scanning_window=np.pi,
+    resolution=1000,
+    angle_range=np.array([0, 2 * np.pi]),
+    mode="absolute",
+    max_elements=2**24,
+):
+    """
+    Search the vantage point that optimizes an RSP statistic, for every gene.
+
+    Parameters:
+    - foreground_masks: Boolean numpy array or scipy sparse matrix of shape
+      (genes, cells), or a 1D boolean array for a single gene.
+    - background_points: Numpy array of (x, y) coordinates for background cells.
+    - candidates: "grid", "centroids", "medoids", or a numpy array of vantage points.
+    - labels: Cluster labels of the background points (for "centroids" and "medoids").
+    - statistic: One of "rsp_area", "rmsd", "deviation_score".
+    - objective: "max" or "min".
+    - grid_size: Number of grid points per axis for "grid" and for refinements.
+    - n_refinements: Number of times to re-grid around each gene's best point, halving
+      the search span each time.
+    - scanning_window: Scanning window size in radians.
+    - resolution: Number of bins for the histogram.
+    - angle_range: Angular range for CDF computation.
+    - mode: Mode for scaling foreground and background CDFs (default="absolute").
+    - max_elements: Upper bound on the number of angles held per chunk of vantage points.
+
+    Returns:
+    - best_vantage_points: Numpy array of shape (genes, 2), or (2,) for a 1D mask.
+    - best_scores: Numpy array of the optimal statistic per gene, or a scalar.
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic: {statistic}.")
+    if objective not in ("max", "min"):
+        raise ValueError(f"Unknown objective: {objective}.")
+
+    if isinstance(candidates, str):
+        if candidates == "grid":
+            vantage_points = vantage_grid(background_points, grid_size)
+        elif candidates in ("centroids", "medoids"):
+            if labels is None:
+                raise ValueError(f"Candidates '{candidates}' require cluster labels.")
+            _, vantage_points = cluster_vantage_points(
+                background_points, labels, method=candidates[:-1]
+            )
+        else:
+            raise ValueError(f"Unknown vantage point candidates: {candidates}.")
+    else:
+        vantage_points = np.atleast_2d(np.asarray(candidates, dtype=np.float64))
+
+    single_gene = np.ndim(foreground_masks) == 1
+    if single_gene:
+        foreground_masks = np.asarray(foreground_masks)[None, :]
+
+    analysis_kwargs = dict(
+        scanning_window=scanning_window,
+        resolution=resolution,
+        angle_range=angle_range,
+        mode=mode,
+        max_elements=max_elements,
+    )
+    pick = np.argmax if objective == "max" else np.argmin
+
+    scores = evaluate_vantage_points(
+        foreground_masks, background_points, vantage_points, **analysis_kwargs
+    )[STATISTICS.index(statistic)]
+    best = pick(scores, axis=0)
+    gene_range = np.arange(scores.shape[1])
+    best_vantage_points = vantage_points[best]
+    best_scores = scores[best, gene_range]
+
+    # Each refinement re-grids +/- span around the current best and halves span.
+    span = (background_points.max(axis=0) - background_points.min(axis=0)) / max(
+        grid_size - 1, 1
+    )
+    for _ in range(n_refinements):
+        offsets = vantage_grid(np.array([-span, span]), grid_size)
+        for gene in gene_range:
+            local_points = best_vantage_points[gene] + offsets
+            local_scores = evaluate_vantage_points(
+                foreground_masks[gene : gene + 1],
+                background_points,
+                local_points,
+                **analysis_kwargs,
+            )[STATISTICS.index(statistic)][:, 0]
+            local_best = pick(local_scores)
+            if pick([best_scores[gene], local_scores[local_best]]) == 1:
+                best_scores[gene] = local_scores[local_best]
+                best_vantage_points[gene] = local_points[local_best]
+        span = span / 2
+
+    if single_gene:
+        return best_vantage_points[0], best_scores[0]
+    return best_vantage_points, best_scores
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from scipy.sparse import csc_matrix, csr_matrix
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.utils.profiling import profiled
+
+CACHE_FORMAT = "biorsp"
+CACHE_VERSION = 1
+METADATA_NAME = "metadata.json"
+ARRAY_NAMES = ("data", "indices", "indptr")
+
+
+def file_hash(file_path, block_size=2**20):
+    """
+    SHA-256 digest of a file, read in blocks.
+
+    Parameters:
+    - file_path: Path of the file.
+    - block_size: Number of bytes read at once.
+
+    Returns:
+    - Hexadecimal digest string.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(file_path, hash_file=True):
+    """
+    Identity of a source file: its size, modification time and content hash.
+
+    Parameters:
+    - file_path: Path of the source file.
+    - hash_file: If False, leave out the content hash.
+
+    Returns:
+    - Dictionary with "size", "mtime_ns" and "sha256".
+    """
+    status = os.stat(file_path)
+    return {
+        "size": status.st_size,
+        "mtime_ns": status.st_mtime_ns,
+        "sha256": file_hash(file_path) if hash_file else None,
+    }
+
+
+def _write_lines(path, values):
+    with open(path, "w", encoding="utf-8") as f:
+        for value in values:
+            f.write(f"{value}\n")
+
+
+def _read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def is_expression_cache(path):
+    """
+    Check whether a path holds a biorsp cache (of any version).
+
+    Parameters:
+    - path: Path to check.
+
+    Returns:
+    - True if path is a directory whose metadata.json has the biorsp format.
+    """
+    try:
+        with open(os.path.join(path, METADATA_NAME)) as f:
+            return json.load(f).get("format") == CACHE_FORMAT
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def _write_cache_files(expression, cache_path, source, params):
+    layouts = {"csr": expression.matrix, "csc": expression.cell_matrix()}
+    for layout, matrix in layouts.items():
+        # Keep indptr in the index type so scipy adopts the mapped arrays as is.
+        arrays = (
+            matrix.data,
+            matrix.indices,
+            matrix.indptr.astype(matrix.indices.dtype),
+        )
+        for name, array in zip(ARRAY_NAMES, arrays):
+            np.save(os.path.join(cache_path, f"{layout}_{name}.npy"), array)
+
+    _write_lines(os.path.join(cache_path, "genes.txt"), expression.index)
+    _write_lines(os.path.join(cache_path, "barcodes.txt"), expression.columns)
+
+    metadata = {
+        "format": CACHE_FORMAT,
+        "version": CACHE_VERSION,
+        "shape": list(expression.shape),
+        "nnz": int(expression.matrix.nnz),
+        "dtype": str(expression.matrix.dtype),
+        "index_dtype": str(expression.matrix.indices.dtype),
+        "layouts": list(layouts),
+        "source": None if source is None else os.path.abspath(source),
+        "source_signature": None if source is None else source_signature(source),
+        "params": json.loads(json.dumps(params)),
+    }
+    with open(os.path.join(cache_path, METADATA_NAME), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+@profiled("data.write_expression_cache")
+def write_expression_cache(expression, cache_path, source=None, params=None):
+    """
+    Write an expression matrix in the biorsp on-disk format.
+
+    The cache is a directory of .npy files holding the CSR and CSC arrays, one
+    text file per index (genes.txt, barcodes.txt) and a metadata.json header.
+    The cache is written into a sibling temporary directory and moved into
+    place, so an interrupted write leaves any previous cache untouched.
+
+    Parameters:
+    - expression: ExpressionMatrix or DataFrame (rows = genes, columns = cells).
+    - cache_path: Directory of the cache. An existing biorsp cache there is
+      replaced; any other existing file or directory raises a ValueError.
+    - source: Optional path of the DGE file the matrix was read from; its hash is
+      recorded so the cache can be validated against it.
+    - params: Optional JSON-compatible dictionary of loading parameters (e.g., QC
+      thresholds), also checked when the cache is opened.
+
+    Returns:
+    - The cache path.
+    """
+    if not isinstance(expression, ExpressionMatrix):
+        expression = ExpressionMatrix.from_dataframe(expression)
+
+    target = os.path.normpath(cache_path)
+    if os.path.lexists(target) and not is_expression_cache(target):
+        raise ValueError(
+            f"'{cache_path}' exists and is not a biorsp cache; refusing to replace it."
+        )
+
+    temp_path = f"{target}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(temp_path)
+    try:
+        _write_cache_files(expression, temp_path, source, params)
+        if not os.path.lexists(target):
+            os.replace(temp_path, target)
+        else:
+            # A directory cannot be replaced by rename: move the old cache aside
+            # first and put it back if the new one cannot be moved in.
+            old_path = f"{target}.old-{uuid.uuid4().hex}"
+            os.replace(target, old_path)
+            try:
+                os.replace(temp_path, target)
+            except OSError:
+                os.replace(old_path, target)
+                raise
+            shutil.rmtree(old_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+    return cache_path
+
+
+def read_cache_metadata(cache_path):
+    """
+    Read and check the header of a biorsp cache.
+
+    Parameters:
+    - cache_path: Directory of the cache.
+
+    Returns:
+    - Dictionary of cache metadata.
+    """
+    metadata_path = os.path.join(cache_path, METADATA_NAME)
+    if not os.path.exists(metadata_path):
+        raise ValueError(f"No complete biorsp cache found in '{cache_path}'.")
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    if metadata.get("format") != CACHE_FORMAT:
+        raise ValueError(f"'{cache_path}' is not a biorsp cache.")
+    if metadata.get("version") != CACHE_VERSION:
+        raise ValueError(
+            f"Unsupported biorsp cache version {metadata.get('version')} in '{cache_path}'."
+        )
+    return metadata
+
+
+def cache_is_valid(cache_path, source=None, params=None):
+    """
+    Check that a cache exists and was written from the given source and parameters.
+
+    The source is compared by size and modification time first; when either
+    differs, its content hash decides, so a touched but unchanged file keeps its
+    cache while an edited file never matches.
+
+    Parameters:
+    - cache_path: Directory of the cache.
+    - source: Optional path of the DGE file the cache should come from.
+    - params: Optional dictionary of loading parameters the cache should match.
+
+    Returns:
+    - True if the cache can be used.
+    """
+    try:
+        metadata = read_cache_metadata(cache_path)
+    except ValueError:
+        return False
+
+    if metadata["params"] != json.loads(json.dumps(params)):
+        return False
+    if source is None:
+        return True
+
+    recorded = metadata["source_signature"]
+    if recorded is None:
+        return False
+    current = source_signature(source, hash_file=False)
+    if current["size"] != recorded["size"]:
+        return False
+    if current["mtime_ns"] == recorded["mtime_ns"]:
+        return True
+    return file_hash(source) == recorded["sha256"]
+
+
+@profiled("data.open_expression_cache")
+def open_expression_cache(cache_path, source=None, params=None):
+    """
+    Open a biorsp cache as a memory-mapped expression matrix.
+
+    Arrays are mapped read-only, so opening is near-instant and processes
+    opening the same cache share its pages. Parallel gene scans pass the
+    mapped files to their workers instead of copying the matrix.
+
+    Parameters:
+    - cache_path: Directory of the cache.
+    - source: Optional path of the DGE file the cache must come from.
+    - params: Optional dictionary of loading parameters the cache must match.
+
+    Returns:
+    - An ExpressionMatrix backed by numpy memmaps.
+    """
+    metadata = read_cache_metadata(cache_path)
+    if (source is not None or params is not None) and not cache_is_valid(
+        cache_path, source, params
+    ):
+        raise ValueError(
+            f"Cache in '{cache_path}' is stale or was written with different parameters."
+        )
+
+    shape = tuple(metadata["shape"])
+    files, matrices = {}, {}
+    for layout, matrix_type in (("csr", csr_matrix), ("csc", csc_matrix)):
+        if layout not in metadata["layouts"]:
+            continue
+        paths = {
+            name: os.path.join(cache_path, f"{layout}_{name}.npy")
+            for name in ARRAY_NAMES
+        }
+        arrays = [np.load(paths[name], mmap_mode="r") for name in ARRAY_NAMES]
+        matrices[layout] = matrix_type(tuple(arrays), shape=shape, copy=False)
+        if layout == "csr":
+            files = paths
+
+    genes = _read_lines(os.path.join(cache_path, "genes.txt"))
+    barcodes = _read_lines(os.path.join(cache_path, "barcodes.txt"))
+    return ExpressionMatrix(
+        matrices["csr"], genes, barcodes, by_cell=matrices.get("csc"), files=files
+    )
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from biorsp.data.expression import ExpressionMatrix
+
+DEFAULT_MAX_BYTES = 2**30
+
+
+def default_cache_dir():
+    """
+    Directory of the default embedding cache.
+
+    Returns:
+    - The BIORSP_CACHE_DIR environment variable if set, else ~/.cache/biorsp,
+      with an "embeddings" subdirectory.
+    """
+    root = os.environ.get("BIORSP_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "biorsp"
+    )
+    return os.path.join(root, "embeddings")
+
+
+def matrix_hash(matrix, max_elements=2**24):
+    """
+    SHA-256 digest of the values of an expression matrix.
+
+    Gene and barcode names are left out: only the values, their layout and their
+    type determine an embedding. Dense input is hashed in blocks of rows.
+
+    Parameters:
+    - matrix: DataFrame, ExpressionMatrix, scipy sparse matrix or numpy array.
+    - max_elements: Upper bound on the number of dense entries copied at once.
+
+    Returns:
+    - Hexadecimal digest string.
+    """
+    if isinstance(matrix, ExpressionMatrix):
+        matrix = matrix.matrix
+    elif hasattr(matrix, "to_numpy"):
+        matrix = matrix.to_numpy()
+
+    digest = hashlib.sha256()
+    if hasattr(matrix, "tocsr"):
+        matrix = matrix.tocsr()
+        matrix.sort_indices()
+        digest.update(f"sparse{matrix.shape}{matrix.dtype}".encode())
+        for array in (matrix.data, matrix.indices, matrix.indptr):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    matrix = np.asarray(matrix)
+    digest.update(f"dense{matrix.shape}{matrix.dtype}".encode())
+    rows = matrix.reshape(matrix.shape[0], -1)
+    block_size = max(1, max_elements // max(1, rows.shape[1]))
+    for start in range(0, rows.shape[0], block_size):
+        digest.update(np.ascontiguousarray(rows[start : start + block_size]).tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed disk cache of embeddings with least-recently-used eviction.
+
+    Entries are .npy files named by a hash of the input matrix, the method and
+    every parameter, so a changed matrix or parameter never hits a stale entry.
+    Reading an entry refreshes its modification time; once the cache exceeds
+    max_bytes, the entries read or written longest ago are removed.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Parameters:
+        - cache_dir: Directory of the cache (default: default_cache_dir()).
+        - max_bytes: Upper bound on the total size of the cached embeddings.
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, method, matrix, params):
+        """
+        Cache key of an embedding.
+
+        Parameters:
+        - method: Name of the embedding method (e.g., "tsne").
+        - matrix: Input matrix (see matrix_hash), or its precomputed hash.
+        - params: JSON-compatible dictionary of every parameter of the method.
+
+        Returns:
+        - Hexadecimal key string.
+        """
+        if not isinstance(matrix, str):
+            matrix = matrix_hash(matrix)
+        description = json.dumps(
+            {"method": method, "matrix": matrix, "params": params}, sort_keys=True
+        )
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key):
+        """
+        Load a cached embedding.
+
+        Parameters:
+        - key: Cache key from key().
+
+        Returns:
+        - Numpy array, or None if the entry does not exist.
+        """
+        path = self.path(key)
+        try:
+            embedding = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            # Mark the entry as recently used. Another process may have evicted
+            # it since it was read, or the cache may be read-only.
+            os.utime(path)
+        except OSError:
+            pass
+        return embedding
+
+    def put(self, key, embedding):
+        """
+        Store an embedding and evict old entries beyond max_bytes.
+
+        Parameters:
+        - key: Cache key from key().
+        - embedding: Numpy array to store.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            np.save(f, np.asarray(embedding))
+        os.replace(f.name, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """
+        Cached entries, least recently used first.
+
+        Returns:
+        - List of (path, size in bytes) tuples.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                status = entry.stat()
+                entries.append((status.st_mtime_ns, entry.path, status.st_size))
+        return [(path, size) for _, path, size in sorted(entries)]
+
+    def size(self):
+        """
+        Total size of the cached embeddings in bytes.
+        """
+        return sum(size for _, size in self.entries())
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        entries = self.entries()
+        total = sum(size for _, size in entries)
+        for path, size in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Remove every cached embedding.
+        """
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+
+def cacheable_params(params):
+    """
+    JSON-compatible copy of embedding parameters, for use in a cache key.
+
+    Numpy scalars (e.g., np.int64(1)) become Python values. Parameters that
+    cannot be described by value, such as a numpy RandomState whose state
+    changes as it is used, make the embedding uncacheable.
+
+    Parameters:
+    - params: Dictionary of every parameter of the method.
+
+    Returns:
+    - Dictionary of plain Python values, or None if the embedding cannot be cached.
+    """
+    cacheable = {}
+    for name, value in params.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is not None and not isinstance(value, (bool, int, float, str)):
+            return None
+        cacheable[name] = value
+    return cacheable
+
+
+def resolve_embedding_cache(cache):
+    """
+    Turn the cache argument of an embedding function into an EmbeddingCache.
+
+    Parameters:
+    - cache: True for the default cache, False or None to disable caching, a
+      directory path, or an EmbeddingCache.
+
+    Returns:
+    - An EmbeddingCache, or None.
+    """
+    if cache is None or cache is False:
+        return None
+    if cache is True:
+        return EmbeddingCache()
+    if isinstance(cache, EmbeddingCache):
+        return cache
+    return EmbeddingCache(cache)
+
+
+def clear_embedding_cache(cache_dir=None):
+    """
+    Remove every embedding from a cache directory (default: default_cache_dir()).
+    """
+    EmbeddingCache(cache_dir).clear()
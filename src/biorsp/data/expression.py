@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+class ExpressionMatrix:
+    """
+    Sparse gene expression store indexed by gene (rows = genes, columns = cells).
+
+    The matrix is kept in CSR layout with sorted column indices, so the cells in
+    which a gene is detected, and their values, are one contiguous slice. The
+    gene and barcode indexes mirror DataFrame.index and DataFrame.columns.
+    """
+
+    def __init__(self, matrix, genes, barcodes, by_cell=None, files=None):
+        """
+        Parameters:
+        - matrix: Scipy sparse matrix or 2D numpy array of shape (genes, cells).
+        - genes: Sequence of gene names, one per row.
+        - barcodes: Sequence of cell barcodes, one per column.
+        - by_cell: Optional CSC copy of the same matrix, for cell-wise access.
+        - files: Optional dictionary of the .npy files backing the CSR arrays
+          ("data", "indices", "indptr"), set when the matrix is memory-mapped.
+        """
+        matrix = csr_matrix(matrix)
+        matrix.sort_indices()
+
+        if matrix.shape != (len(genes), len(barcodes)):
+            raise ValueError(
+                "Expression matrix shape does not match the gene and barcode indexes."
+            )
+
+        self.matrix = matrix
+        self.index = pd.Index(genes)
+        self.columns = pd.Index(barcodes)
+        self.files = files
+        self._by_cell = by_cell
+
+    @classmethod
+    def from_dataframe(cls, dge_matrix):
+        """
+        Build an expression matrix from a dense DataFrame.
+
+        Parameters:
+        - dge_matrix: DataFrame containing gene expression data (rows=genes, columns=cells).
+
+        Returns:
+        - An ExpressionMatrix with the same values, genes and barcodes.
+        """
+        return cls(dge_matrix.to_numpy(), dge_matrix.index, dge_matrix.columns)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def empty(self):
+        return 0 in self.matrix.shape
+
+    def gene_row(self, gene_name):
+        """
+        Return the row position of a gene.
+
+        Parameters:
+        - gene_name: The gene of interest.
+
+        Returns:
+        - The integer row of the gene.
+        """
+        if gene_name not in self.index:
+            raise ValueError(f"Gene '{gene_name}' not found in the dataset.")
+        return self.index.get_loc(gene_name)
+
+    def gene_expression(self, gene_name):
+        """
+        Return the cells in which a gene is detected and the corresponding values.
+
+        Parameters:
+        - gene_name: The gene of interest.
+
+        Returns:
+        - cell_indices: Sorted integer numpy array of cell columns.
+        - values: Numpy array of expression values for those cells.
+        """
+        row = self.gene_row(gene_name)
+        start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+        return self.matrix.indices[start:end], self.matrix.data[start:end]
+
+    def foreground_indices(self, gene_name, threshold=1, cell_mask=None):
+        """
+        Find the cells expressing a gene above a threshold.
+
+        Parameters:
+        - gene_name: The gene of interest.
+        - threshold: Expression level threshold for foreground cells (default=1).
+        - cell_mask: Optional boolean numpy array restricting the eligible cells.
+
+        Returns:
+        - Sorted integer numpy array of foreground cell columns.
+        """
+        if threshold < 0:
+            # Undetected cells (implicit zeros) also pass a negative threshold.
+            row = self.matrix[self.gene_row(gene_name)].toarray().ravel()
+            cell_indices = np.flatnonzero(row > threshold)
+        else:
+            cell_indices, values = self.gene_expression(gene_name)
+            cell_indices = cell_indices[values > threshold]
+
+        if cell_mask is not None:
+            cell_indices = cell_indices[cell_mask[cell_indices]]
+        return cell_indices
+
+    def foreground_mask(self, gene_name, threshold=1, cell_mask=None):
+        """
+        Boolean mask of the cells expressing a gene above a threshold.
+
+        Parameters:
+        - gene_name: The gene of interest.
+        - threshold: Expression level threshold for foreground cells (default=1).
+        - cell_mask: Optional boolean numpy array restricting the eligible cells.
+
+        Returns:
+        - Boolean numpy array with one entry per cell.
+        """
+        mask = np.zeros(self.shape[1], dtype=bool)
+        mask[self.foreground_indices(gene_name, threshold, cell_mask)] = True
+        return mask
+
+    def foreground_matrix(self, gene_names=None, threshold=1, cell_mask=None):
+        """
+        Sparse gene x cell foreground masks for many genes at once.
+
+        Parameters:
+        - gene_names: Optional list of genes (default: all genes, in index order).
+        - threshold: Expression level threshold for foreground cells (default=1).
+        - cell_mask: Optional boolean numpy array selecting the background cells;
+          only those columns are kept, in their original order.
+
+        Returns:
+        - Boolean scipy CSR matrix of shape (genes, background cells).
+        """
+        if threshold < 0:
+            raise ValueError("foreground_matrix requires a non-negative threshold.")
+
+        if gene_names is None:
+            matrix = self.matrix
+        else:
+            matrix = self.matrix[[self.gene_row(gene) for gene in gene_names]]
+
+        masks = threshold_matrix(matrix, threshold)
+        if cell_mask is not None:
+            masks = masks[:, np.flatnonzero(cell_mask)]
+        return masks
+
+    def cell_matrix(self):
+        """
+        Column-major (CSC) copy of the matrix, built on first use.
+
+        Returns:
+        - Scipy CSC matrix of shape (genes, cells).
+        """
+        if self._by_cell is None:
+            self._by_cell = self.matrix.tocsc()
+            self._by_cell.sort_indices()
+        return self._by_cell
+
+    def cell_totals(self):
+        """
+        Total counts (UMIs) of every cell.
+
+        Returns:
+        - Numpy array with one total per cell.
+        """
+        return np.asarray(self.matrix.sum(axis=0)).ravel()
+
+    def gene_detection(self):
+        """
+        Number of cells in which each gene is detected (expression above 0).
+
+        Returns:
+        - Integer numpy array with one count per gene.
+        """
+        return np.diff(threshold_matrix(self.matrix, 0).indptr)
+
+    def subset(self, genes=None, cells=None):
+        """
+        Select genes and cells without densifying.
+
+        Parameters:
+        - genes: Optional boolean mask or integer positions of the genes to keep.
+        - cells: Optional boolean mask or integer positions of the cells to keep.
+
+        Returns:
+        - A new ExpressionMatrix.
+        """
+        matrix, index, columns = self.matrix, self.index, self.columns
+        if genes is not None:
+            genes = np.flatnonzero(genes) if np.asarray(genes).dtype == bool else genes
+            matrix, index = matrix[genes], index[genes]
+        if cells is not None:
+            cells = np.flatnonzero(cells) if np.asarray(cells).dtype == bool else cells
+            matrix, columns = matrix[:, cells], columns[cells]
+        return ExpressionMatrix(matrix, index, columns)
+
+    def to_dataframe(self):
+        """
+        Convert to a dense DataFrame (rows=genes, columns=cells).
+        """
+        return pd.DataFrame(
+            self.matrix.toarray(), index=self.index, columns=self.columns
+        )
+
+
+def threshold_matrix(matrix, threshold):
+    """
+    Boolean sparse matrix of the stored entries above a non-negative threshold.
+
+    Parameters:
+    - matrix: Scipy CSR matrix of expression values.
+    - threshold: Non-negative expression level threshold.
+
+    Returns:
+    - Boolean scipy CSR matrix with the same shape.
+    """
+    masks = csr_matrix(
+        (matrix.data > threshold, matrix.indices, matrix.indptr), shape=matrix.shape
+    )
+    masks.eliminate_zeros()
+    return masks
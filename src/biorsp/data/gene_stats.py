@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.utils.profiling import profiled
+
+GENE_STATS_PREFIX = "gene_stats"
+
+
+def threshold_column(threshold, cluster=None):
+    """
+    Name of the gene statistics column counting the cells above a threshold.
+
+    Parameters:
+    - threshold: Expression level threshold; 0 counts the cells in which the gene
+      is detected.
+    - cluster: Optional cluster label, to count only the cells of that cluster.
+
+    Returns:
+    - The column name.
+    """
+    name = "n_cells" if threshold == 0 else f"n_cells_above_{threshold:g}"
+    if cluster is not None:
+        name += f"_cluster_{cluster}"
+    return name
+
+
+@profiled("data.compute_gene_stats")
+def compute_gene_stats(dge_matrix, thresholds=(1,), cluster_labels=None):
+    """
+    Per-gene QC statistics, computed in one pass over the stored values.
+
+    Parameters:
+    - dge_matrix: DataFrame or ExpressionMatrix (rows = genes, columns = cells).
+    - thresholds: Expression levels for which the cells above are counted.
+    - cluster_labels: Optional numpy array with the cluster label of every cell.
+
+    Returns:
+    - DataFrame indexed by gene with the columns "total_counts", "n_cells" (cells
+      in which the gene is detected) and "n_cells_above_<threshold>" for every
+      threshold, plus, with cluster labels, the same counts within each cluster
+      ("n_cells_cluster_<label>", "n_cells_above_<threshold>_cluster_<label>").
+    """
+    if not isinstance(dge_matrix, ExpressionMatrix):
+        dge_matrix = ExpressionMatrix.from_dataframe(dge_matrix)
+    matrix = dge_matrix.matrix
+    n_genes = matrix.shape[0]
+    levels = [0] + [threshold for threshold in thresholds if threshold != 0]
+
+    columns = {"total_counts": np.asarray(matrix.sum(axis=1)).ravel()}
+    for level in levels:
+        # Entries above the level, counted per row from prefix sums.
+        above = np.concatenate(([0], np.cumsum(matrix.data > level)))
+        columns[threshold_column(level)] = np.diff(above[matrix.indptr])
+
+    if cluster_labels is not None:
+        cluster_labels = np.asarray(cluster_labels)
+        if cluster_labels.shape[0] != matrix.shape[1]:
+            raise ValueError("Cluster labels do not match the number of cells.")
+        clusters, codes = np.unique(cluster_labels, return_inverse=True)
+        entry_rows = np.repeat(np.arange(n_genes), np.diff(matrix.indptr))
+        entry_bins = entry_rows * clusters.shape[0] + codes[matrix.indices]
+        for level in levels:
+            counts = np.bincount(
+                entry_bins[matrix.data > level],
+                minlength=n_genes * clusters.shape[0],
+            ).reshape(n_genes, clusters.shape[0])
+            for position, cluster in enumerate(clusters):
+                columns[threshold_column(level, cluster)] = counts[:, position]
+
+    return pd.DataFrame(columns, index=dge_matrix.index)
+
+
+def gene_stats_key(expression, thresholds, cluster_labels):
+    """
+    JSON-compatible description of a gene statistics table, used to validate it.
+
+    Parameters:
+    - expression: ExpressionMatrix the statistics are computed from.
+    - thresholds: Expression levels of the table.
+    - cluster_labels: Numpy array of cluster labels, or None.
+
+    Returns:
+    - Dictionary of the matrix shape and size, thresholds and a hash of the labels.
+    """
+    labels_hash = None
+    if cluster_labels is not None:
+        labels_hash = hashlib.sha256(
+            "\n".join(map(str, np.asarray(cluster_labels))).encode()
+        ).hexdigest()
+    return {
+        "shape": list(expression.shape),
+        "nnz": int(expression.matrix.nnz),
+        "thresholds": [float(threshold) for threshold in thresholds],
+        "cluster_labels": labels_hash,
+    }
+
+
+def gene_stats_path(cache_path, key):
+    """
+    Path of a gene statistics table in a cache directory.
+
+    Parameters:
+    - cache_path: Directory of the cache.
+    - key: Table description from gene_stats_key.
+
+    Returns:
+    - Path of the .npz file.
+    """
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_path, f"{GENE_STATS_PREFIX}_{digest[:16]}.npz")
+
+
+@profiled("data.load_gene_stats")
+def load_gene_stats(dge_matrix, thresholds=(1,), cluster_labels=None):
+    """
+    Per-gene QC statistics, cached next to the expression data.
+
+    For a matrix opened from a biorsp cache (see open_expression_cache), the
+    table is saved in the cache directory on first use and read back afterwards;
+    rewriting the expression cache removes it. Other matrices, and caches
+    that cannot be written to, get a freshly computed table.
+
+    Parameters:
+    - dge_matrix: DataFrame or ExpressionMatrix (rows = genes, columns = cells).
+    - thresholds: Expression levels for which the cells above are counted.
+    - cluster_labels: Optional numpy array with the cluster label of every cell.
+
+    Returns:
+    - DataFrame of gene statistics, as returned by compute_gene_stats.
+    """
+    if not isinstance(dge_matrix, ExpressionMatrix) or not dge_matrix.files:
+        return compute_gene_stats(dge_matrix, thresholds, cluster_labels)
+    cache_path = os.path.dirname(dge_matrix.files["data"])
+
+    key = gene_stats_key(dge_matrix, thresholds, cluster_labels)
+    stats_path = gene_stats_path(cache_path, key)
+    if os.path.exists(stats_path):
+        with np.load(stats_path) as saved:
+            if json.loads(str(saved["key"])) == key:
+                return pd.DataFrame(
+                    {
+                        name: saved[f"column_{position}"]
+                        for position, name in enumerate(saved["columns"])
+                    },
+                    index=dge_matrix.index,
+                )
+
+    stats = compute_gene_stats(dge_matrix, thresholds, cluster_labels)
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            dir=cache_path, prefix=GENE_STATS_PREFIX, suffix=".tmp", delete=False
+        ) as f:
+            temp_path = f.name
+            np.savez(
+                f,
+                key=json.dumps(key),
+                columns=np.asarray(stats.columns, dtype=str),
+                **{
+                    f"column_{position}": stats[name].to_numpy()
+                    for position, name in enumerate(stats.columns)
+                },
+            )
+        os.replace(temp_path, stats_path)
+    except OSError:
+        # A read-only or full cache directory only loses the cached table.
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+    return stats
+
+
+def foreground_counts(stats, threshold=1, clusters=None):
+    """
+    Number of cells above a threshold for every gene, from a gene statistics table.
+
+    Parameters:
+    - stats: DataFrame of gene statistics from compute_gene_stats.
+    - threshold: Expression level threshold for foreground cells.
+    - clusters: Optional list of cluster labels; only their cells are counted.
+
+    Returns:
+    - Numpy array with one count per gene.
+    """
+    if clusters is None:
+        names = [threshold_column(threshold)]
+    else:
+        prefix = threshold_column(threshold) + "_cluster_"
+        if not any(name.startswith(prefix) for name in stats.columns):
+            raise ValueError(
+                f"Gene statistics have no per-cluster counts above {threshold:g}."
+            )
+        # Clusters without any cell have no column and count nothing.
+        names = [
+            threshold_column(threshold, cluster)
+            for cluster in clusters
+            if threshold_column(threshold, cluster) in stats.columns
+        ]
+    if names and names[0] not in stats.columns:
+        raise ValueError(f"Gene statistics have no column '{names[0]}'.")
+    return stats[names].to_numpy().sum(axis=1).astype(np.int64)
@@ -1,8 +1,36 @@
+from collections import namedtuple
+
+import numpy as np
 import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
 from sklearn.cluster import DBSCAN
+from sklearn.neighbors import NearestNeighbors, radius_neighbors_graph
+from biorsp.utils.profiling import profiled
+
+GridCells = namedtuple(
+    "GridCells", ["order", "keys", "starts", "counts", "cells", "stride"]
+)
+GridCells.__doc__ = """
+Points hashed into square grid cells, as built by grid_cells.
+
+- order: Integer numpy array of the point indices sorted by cell.
+- keys: Sorted integer numpy array of the keys of the occupied cells.
+- starts: Position in order of the first point of every cell.
+- counts: Number of points in every cell.
+- cells: Integer numpy array with the cell of every point.
+- stride: Key difference between horizontally adjacent cells.
+"""
 
+# Offsets of the cells that can hold points within eps of a cell of side
+# eps / sqrt(2): every cell within two steps, corners included.
+GRID_STENCIL = [(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3)]
 
-def compute_dbscan(tsne_results, eps=4, min_samples=50, save_path=None):
+
+@profiled("preprocessing.compute_dbscan")
+def compute_dbscan(
+    tsne_results, eps=4, min_samples=50, save_path=None, engine="sklearn"
+):
     """
     Run DBSCAN on the t-SNE results.
 
@@ -11,12 +39,19 @@ def compute_dbscan(tsne_results, eps=4, min_samples=50, save_path=None):
     - eps: The epsilon parameter for DBSCAN.
     - min_samples: The minimum number of samples for DBSCAN.
     - save_path: Path to save the DBSCAN results.
+    - engine: "sklearn" for sklearn's DBSCAN, or "grid" for grid_dbscan, which
+      uses O(N) memory on 2D embeddings and returns the same labels.
 
     Returns:
     - dbscan_labels: A 1D numpy array with the DBSCAN cluster labels for each cell.
     """
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    dbscan_labels = dbscan.fit_predict(tsne_results)
+    if engine == "sklearn":
+        dbscan = DBSCAN(eps=eps, min_samples=min_samples)
+        dbscan_labels = dbscan.fit_predict(tsne_results)
+    elif engine == "grid":
+        dbscan_labels = grid_dbscan(tsne_results, eps=eps, min_samples=min_samples)
+    else:
+        raise ValueError(f"Unknown DBSCAN engine: {engine}.")
     dbscan_labels += 1
 
     if save_path:
@@ -24,3 +59,523 @@ def compute_dbscan(tsne_results, eps=4, min_samples=50, save_path=None):
         dbscan_results_df.to_csv(save_path, index=False)
 
     return dbscan_labels
+
+
+def number_clusters(components, core):
+    """
+    DBSCAN labels of the core points from their connected components.
+
+    Clusters are numbered in the order of their first core point, as in sklearn.
+
+    Parameters:
+    - components: Integer numpy array of component ids, one per point.
+    - core: Boolean numpy array marking the core points.
+
+    Returns:
+    - Integer numpy array of labels, starting at 0 for core points and -1 elsewhere.
+    """
+    labels = np.full(components.shape[0], -1, dtype=np.int64)
+    core_points = np.flatnonzero(core)
+    core_components, first_core = np.unique(components[core_points], return_index=True)
+    cluster_of_component = np.empty(components.shape[0], dtype=np.int64)
+    cluster_of_component[core_components[np.argsort(first_core)]] = np.arange(
+        core_components.shape[0]
+    )
+    labels[core_points] = cluster_of_component[components[core_points]]
+    return labels
+
+
+def assign_border_points(labels, rows, columns):
+    """
+    Give every non-core point with a core neighbour the smallest label among them.
+
+    This is the cluster that reaches the point first in sklearn's DBSCAN.
+
+    Parameters:
+    - labels: Integer numpy array of core labels (-1 for non-core points), updated
+      in place.
+    - rows, columns: Integer numpy arrays of the edges from non-core points (rows)
+      to core points (columns).
+
+    Returns:
+    - The updated labels.
+    """
+    border_labels = np.full(labels.shape[0], np.iinfo(np.int64).max)
+    np.minimum.at(border_labels, rows, labels[columns])
+    reached = border_labels < np.iinfo(np.int64).max
+    labels[reached] = border_labels[reached]
+    return labels
+
+
+def merge_components(n_points, rows, columns, components=None):
+    """
+    Merge the components joined by a set of edges.
+
+    Parameters:
+    - n_points: Number of points.
+    - rows, columns: Integer numpy arrays of symmetric edges between points.
+    - components: Integer numpy array of component ids, one per point, or None if
+      every point is still its own component; the edges must then be sorted by row.
+
+    Returns:
+    - Integer numpy array of the merged component ids.
+    """
+    if components is None:
+        # Edges sorted by row give the CSR graph without a copy of the edges.
+        indptr = np.zeros(n_points + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_points), out=indptr[1:])
+        graph = csr_matrix(
+            (np.ones(rows.shape[0]), columns, indptr), shape=(n_points, n_points)
+        )
+    elif rows.shape[0] == 0:
+        return components
+    else:
+        # Components are contracted to single nodes, so only the new edges are walked.
+        graph = coo_matrix(
+            (np.ones(rows.shape[0]), (components[rows], components[columns])),
+            shape=(n_points, n_points),
+        ).tocsr()
+
+    # The graph is symmetric, so its strongly connected components are its
+    # connected components, found without building the transpose.
+    _, merged = connected_components(graph, directed=True, connection="strong")
+    merged = merged.astype(columns.dtype)
+    return merged if components is None else merged[components]
+
+
+@profiled("preprocessing.sweep_dbscan")
+def sweep_dbscan(tsne_results, eps_values, min_samples_values):
+    """
+    Run DBSCAN for a grid of (eps, min_samples) values from one neighbour graph.
+
+    The radius-neighbour graph is built once at the largest eps, and each smaller
+    eps only filters the edges kept for the previous one. For a given eps, an edge
+    joins two core points for every min_samples up to the smaller neighbourhood
+    size of its ends, so min_samples values are evaluated from the largest down,
+    merging the clusters of the previous value with the edges that just became
+    core-core. Labels match compute_dbscan for every setting.
+
+    Parameters:
+    - tsne_results: A 2D numpy array with the t-SNE (or UMAP) coordinates for each cell.
+    - eps_values: Sequence of epsilon values.
+    - min_samples_values: Sequence of minimum numbers of samples.
+
+    Returns:
+    - summary: A dataframe with one row per setting and the columns "eps",
+      "min_samples", "n_clusters" and "noise_fraction".
+    - labels: A 2D numpy array of shape (settings, cells) with the cluster labels of
+      each setting, in the order of the summary rows.
+    """
+    eps_values = np.atleast_1d(np.asarray(eps_values, dtype=np.float64))
+    min_samples_values = np.atleast_1d(min_samples_values)
+    n_points = len(tsne_results)
+
+    graph = radius_neighbors_graph(
+        tsne_results, eps_values.max(), mode="distance", include_self=False
+    )
+    indptr, columns, distances = graph.indptr, graph.indices, graph.data
+    rows = np.repeat(np.arange(n_points, dtype=columns.dtype), np.diff(indptr))
+    del graph
+
+    labels = np.empty(
+        (eps_values.shape[0], min_samples_values.shape[0], n_points), dtype=np.int64
+    )
+    for e in np.argsort(-eps_values):
+        within = distances <= eps_values[e]
+        rows, columns, distances = rows[within], columns[within], distances[within]
+
+        # Neighbourhood sizes, the point included, and the largest min_samples
+        # for which each edge links two core points.
+        sizes = (np.bincount(rows, minlength=n_points) + 1).astype(columns.dtype)
+        row_sizes, column_sizes = sizes[rows], sizes[columns]
+        levels = np.minimum(row_sizes, column_sizes)
+        # Only points with fewer neighbours than the largest min_samples can be
+        # border points, so their edges are set aside once.
+        border = row_sizes < min_samples_values.max()
+        border_rows, border_columns = rows[border], columns[border]
+        border_column_sizes = column_sizes[border]
+        border_row_sizes = row_sizes[border]
+        del row_sizes, column_sizes, border
+
+        components = None
+        upper = np.inf
+        for m in np.argsort(-min_samples_values):
+            min_samples = min_samples_values[m]
+            added = (levels >= min_samples) & (levels < upper)
+            components = merge_components(
+                n_points, rows[added], columns[added], components
+            )
+            upper = min(upper, min_samples)
+            del added
+
+            setting_labels = number_clusters(components, sizes >= min_samples)
+            to_core = (border_row_sizes < min_samples) & (
+                border_column_sizes >= min_samples
+            )
+            assign_border_points(
+                setting_labels, border_rows[to_core], border_columns[to_core]
+            )
+            labels[e, m] = setting_labels + 1
+
+    labels = labels.reshape(-1, n_points)
+    summary = pd.DataFrame(
+        {
+            "eps": np.repeat(eps_values, min_samples_values.shape[0]),
+            "min_samples": np.tile(min_samples_values, eps_values.shape[0]),
+            "n_clusters": labels.max(axis=1),
+            "noise_fraction": np.mean(labels == 0, axis=1),
+        }
+    )
+    return summary, labels
+
+
+def grid_cells(points, side):
+    """
+    Hash 2D points into square grid cells.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - side: Side length of the cells.
+
+    Returns:
+    - A GridCells tuple.
+    """
+    # Two empty cells of padding keep the keys of neighbouring cells unique.
+    coords = np.floor((points - points.min(axis=0)) / side).astype(np.int64) + 2
+    stride = coords[:, 1].max() + 3
+    point_keys = coords[:, 0] * stride + coords[:, 1]
+    order = np.argsort(point_keys, kind="stable")
+    keys, starts, counts = np.unique(
+        point_keys[order], return_index=True, return_counts=True
+    )
+    cells = np.empty(points.shape[0], dtype=np.int64)
+    cells[order] = np.repeat(np.arange(keys.shape[0]), counts)
+    return GridCells(order, keys, starts, counts, cells, stride)
+
+
+def neighbour_cells(grid, cells, offset):
+    """
+    Find the cell at a fixed offset from each of a set of cells.
+
+    Parameters:
+    - grid: A GridCells tuple.
+    - cells: Integer numpy array of cells.
+    - offset: (dx, dy) offset in cells.
+
+    Returns:
+    - Integer numpy array of the neighbouring cells, -1 where they are empty.
+    """
+    keys = grid.keys[cells] + offset[0] * grid.stride + offset[1]
+    positions = np.minimum(np.searchsorted(grid.keys, keys), grid.keys.shape[0] - 1)
+    return np.where(grid.keys[positions] == keys, positions, -1)
+
+
+def expand_ranges(starts, counts):
+    """
+    Concatenate the integer ranges [start, start + count).
+
+    Parameters:
+    - starts: Integer numpy array of range starts.
+    - counts: Integer numpy array of range lengths.
+
+    Returns:
+    - Integer numpy array of all the range values, range by range.
+    """
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+
+
+def candidate_pairs(grid, queries, max_elements=2**24):
+    """
+    Pair query points with every point of the cells around their own.
+
+    Parameters:
+    - grid: A GridCells tuple built with a side of eps / sqrt(2).
+    - queries: Integer numpy array of query points.
+    - max_elements: Upper bound on the number of pairs yielded at once.
+
+    Yields:
+    - queries, candidates: Integer numpy arrays of point pairs, covering every
+      point within eps of each query.
+    """
+    query_cells = grid.cells[queries]
+    for offset in GRID_STENCIL:
+        neighbours = neighbour_cells(grid, query_cells, offset)
+        counts = np.where(neighbours >= 0, grid.counts[neighbours], 0)
+        ends = np.cumsum(counts)
+        start = 0
+        while start < queries.shape[0]:
+            done = ends[start - 1] if start else 0
+            stop = max(
+                np.searchsorted(ends, done + max_elements, side="right"), start + 1
+            )
+            chunk_counts = counts[start:stop]
+            yield (
+                np.repeat(queries[start:stop], chunk_counts),
+                grid.order[
+                    expand_ranges(grid.starts[neighbours[start:stop]], chunk_counts)
+                ],
+            )
+            start = stop
+
+
+def within_eps(points, queries, candidates, eps):
+    """
+    Test which point pairs are within eps, as sklearn's neighbour queries do.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - queries, candidates: Integer numpy arrays of point pairs.
+    - eps: The neighbourhood radius.
+
+    Returns:
+    - Boolean numpy array with one entry per pair.
+    """
+    delta = points[queries] - points[candidates]
+    return delta[:, 0] * delta[:, 0] + delta[:, 1] * delta[:, 1] <= eps * eps
+
+
+def extreme_points(values, starts):
+    """
+    Position of the first maximum of every segment of an array.
+
+    Parameters:
+    - values: Numpy array, split into consecutive non-empty segments.
+    - starts: Integer numpy array of segment starts.
+
+    Returns:
+    - maxima: Numpy array of the maximum of every segment.
+    - positions: Integer numpy array of the positions of those maxima.
+    """
+    maxima = np.maximum.reduceat(values, starts)
+    counts = np.diff(np.append(starts, values.shape[0]))
+    is_max = values == np.repeat(maxima, counts)
+    positions = np.where(is_max, np.arange(values.shape[0]), values.shape[0])
+    return maxima, np.minimum.reduceat(positions, starts)
+
+
+def cells_within_eps(points, cell_points, starts, first, second, eps, max_elements):
+    """
+    Test pairs of cells for points within eps of each other, point by point.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - cell_points: Integer numpy array of points, sorted by cell.
+    - starts: Position in cell_points of the first point of every cell.
+    - first, second: Integer numpy arrays of the cell pairs to test.
+    - eps: The neighbourhood radius.
+    - max_elements: Upper bound on the number of point pairs compared at once.
+
+    Returns:
+    - Boolean numpy array, True for the cell pairs with points within eps.
+    """
+    counts = np.diff(np.append(starts, cell_points.shape[0]))
+    first_counts, second_counts = counts[first], counts[second]
+    ends = np.cumsum(first_counts * second_counts)
+    linked = np.zeros(first.shape[0], dtype=bool)
+    start = 0
+    while start < first.shape[0]:
+        done = ends[start - 1] if start else 0
+        stop = max(np.searchsorted(ends, done + max_elements, side="right"), start + 1)
+        sizes = first_counts[start:stop] * second_counts[start:stop]
+        pair = np.repeat(np.arange(start, stop), sizes)
+        within = expand_ranges(np.zeros_like(sizes), sizes)
+        queries = cell_points[starts[first[pair]] + within // second_counts[pair]]
+        candidates = cell_points[starts[second[pair]] + within % second_counts[pair]]
+        linked[pair[within_eps(points, queries, candidates, eps)]] = True
+        start = stop
+    return linked
+
+
+def connect_core_cells(
+    points, core_points, core_starts, core_cells, grid, eps, max_elements=2**24
+):
+    """
+    Link the neighbouring cells that hold core points within eps of each other.
+
+    A pair of cells is settled without comparing all their points when the
+    points of each cell that reach furthest towards the other are within eps,
+    or when even those are separated by more than eps along the offset; only
+    the remaining pairs are compared point by point.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - core_points: Integer numpy array of the core points, sorted by cell.
+    - core_starts: Position in core_points of the first point of every core cell.
+    - core_cells: Integer numpy array of the grid cell of every core cell.
+    - grid: A GridCells tuple built with a side of eps / sqrt(2).
+    - eps: The neighbourhood radius.
+    - max_elements: Upper bound on the number of point pairs compared at once.
+
+    Returns:
+    - rows, columns: Integer numpy arrays of the linked core cell pairs.
+    """
+    n_core_cells = core_cells.shape[0]
+    core_cell_of = np.full(grid.keys.shape[0], -1, dtype=np.int64)
+    core_cell_of[core_cells] = np.arange(n_core_cells)
+    core_coordinates = points[core_points]
+
+    rows, columns = [], []
+    # Every unordered pair of cells is visited once, from its lower cell.
+    for offset in GRID_STENCIL[len(GRID_STENCIL) // 2 + 1 :]:
+        neighbours = neighbour_cells(grid, core_cells, offset)
+        first = np.flatnonzero(neighbours >= 0)
+        second = core_cell_of[neighbours[first]]
+        first, second = first[second >= 0], second[second >= 0]
+        if first.shape[0] == 0:
+            continue
+
+        projections = core_coordinates @ np.asarray(offset, dtype=np.float64)
+        forward, forward_positions = extreme_points(projections, core_starts)
+        backward, backward_positions = extreme_points(-projections, core_starts)
+        gap = -backward[second] - forward[first]
+        linked = within_eps(
+            points,
+            core_points[forward_positions[first]],
+            core_points[backward_positions[second]],
+            eps,
+        )
+        apart = (gap > 0) & (gap * gap > eps * eps * np.dot(offset, offset))
+        undecided = ~linked & ~apart
+
+        if undecided.any():
+            linked[undecided] = cells_within_eps(
+                points,
+                core_points,
+                core_starts,
+                first[undecided],
+                second[undecided],
+                eps,
+                max_elements,
+            )
+
+        rows.append(first[linked])
+        columns.append(second[linked])
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(columns)
+
+
+@profiled("preprocessing.grid_dbscan")
+def grid_dbscan(tsne_results, eps=4, min_samples=50, max_elements=2**24):
+    """
+    DBSCAN for 2D embeddings over a grid of cells of side eps / sqrt(2).
+
+    Any two points in the same cell are within eps, so every point of a cell
+    holding at least min_samples points is a core point, and the other points
+    are counted against the 5 x 5 cells around them. The core points of a cell
+    form one cluster; neighbouring cells are linked when they hold core points
+    within eps, and the cell graph's connected components are the clusters.
+    Memory stays O(N) as no neighbour lists are stored.
+
+    Labels are identical to sklearn's DBSCAN: clusters are numbered in the order
+    of their first core point, and a border point joins the first cluster that
+    reaches it, i.e. the smallest label among its core neighbours.
+
+    Parameters:
+    - tsne_results: A 2D numpy array with the t-SNE (or UMAP) coordinates for each cell.
+    - eps: The epsilon parameter for DBSCAN.
+    - min_samples: The minimum number of samples for DBSCAN (the point included).
+    - max_elements: Upper bound on the number of point pairs compared at once.
+
+    Returns:
+    - dbscan_labels: A 1D numpy array of cluster labels (-1 is noise, as in sklearn).
+    """
+    points = np.asarray(tsne_results, dtype=np.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError("The grid DBSCAN engine requires 2D coordinates.")
+    n_points = points.shape[0]
+    if n_points == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # The cells are shrunk slightly so that rounding keeps them within eps wide.
+    grid = grid_cells(points, eps / np.sqrt(2) * (1 - 1e-9))
+
+    core = grid.counts[grid.cells] >= min_samples
+    sizes = np.zeros(n_points, dtype=np.int64)
+    for queries, candidates in candidate_pairs(
+        grid, np.flatnonzero(~core), max_elements
+    ):
+        sizes += np.bincount(
+            queries[within_eps(points, queries, candidates, eps)], minlength=n_points
+        )
+    core |= sizes >= min_samples
+
+    core_points = grid.order[core[grid.order]]
+    core_cells, core_starts = np.unique(grid.cells[core_points], return_index=True)
+    rows, columns = connect_core_cells(
+        points, core_points, core_starts, core_cells, grid, eps, max_elements
+    )
+    cell_graph = coo_matrix(
+        (np.ones(rows.shape[0]), (rows, columns)),
+        shape=(core_cells.shape[0], core_cells.shape[0]),
+    )
+    _, cell_components = connected_components(cell_graph, directed=False)
+
+    components = np.zeros(n_points, dtype=np.int64)
+    components[core_points] = np.repeat(
+        cell_components, np.diff(np.append(core_starts, core_points.shape[0]))
+    )
+    labels = number_clusters(components, core)
+
+    # Points that are not core have fewer than min_samples neighbours, so their
+    # edges to core points are few and collected before assigning them.
+    border_rows = [np.empty(0, dtype=np.int64)]
+    border_columns = [np.empty(0, dtype=np.int64)]
+    for queries, candidates in candidate_pairs(
+        grid, np.flatnonzero(~core), max_elements
+    ):
+        reached = core[candidates] & within_eps(points, queries, candidates, eps)
+        border_rows.append(queries[reached])
+        border_columns.append(candidates[reached])
+    return assign_border_points(
+        labels, np.concatenate(border_rows), np.concatenate(border_columns)
+    )
+
+
+@profiled("preprocessing.assign_cluster_labels")
+def assign_cluster_labels(
+    tsne_results, dbscan_labels, new_points, n_neighbors=15, max_distance=None
+):
+    """
+    Label new points by a majority vote of their nearest labeled points.
+
+    Labels follow the compute_dbscan convention (0 is noise). Noise neighbours
+    vote like any cluster, so new points in noisy regions stay noise; ties go
+    to the smallest label.
+
+    Parameters:
+    - tsne_results: A 2D numpy array with the coordinates of the labeled cells.
+    - dbscan_labels: A 1D numpy array with their cluster labels.
+    - new_points: A 2D numpy array with the coordinates of the new cells.
+    - n_neighbors: The number of labeled cells voting for each new cell.
+    - max_distance: Optional distance beyond which labeled cells do not vote;
+      new cells without any vote are labeled noise (0).
+
+    Returns:
+    - new_labels: A 1D numpy array with the cluster label of each new cell.
+    """
+    dbscan_labels = np.asarray(dbscan_labels)
+    new_points = np.asarray(new_points)
+    if new_points.shape[0] == 0:
+        return np.zeros(0, dtype=dbscan_labels.dtype)
+
+    n_neighbors = min(n_neighbors, dbscan_labels.shape[0])
+    distances, neighbors = (
+        NearestNeighbors(n_neighbors=n_neighbors)
+        .fit(tsne_results)
+        .kneighbors(new_points)
+    )
+    votes = np.ones(neighbors.shape)
+    if max_distance is not None:
+        votes[distances > max_distance] = 0
+
+    rows = np.repeat(np.arange(new_points.shape[0]), n_neighbors)
+    counts = csr_matrix(
+        (votes.ravel(), (rows, dbscan_labels[neighbors].ravel())),
+        shape=(new_points.shape[0], dbscan_labels.max() + 1),
+    ).toarray()
+    new_labels = np.argmax(counts, axis=1).astype(dbscan_labels.dtype)
+    new_labels[counts.max(axis=1) == 0] = 0
+    return new_labels
@@ -1,31 +1,419 @@
+import pickle
+from collections import namedtuple
+
+import numpy as np
 import pandas as pd
+import sklearn
+import umap
+from scipy.sparse import csr_matrix, diags
 from sklearn.manifold import TSNE
 from umap import UMAP
+from biorsp.data.embedding_cache import cacheable_params, resolve_embedding_cache
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.preprocessing.clustering import assign_cluster_labels
+from biorsp.utils.profiling import profiled
+
+# Bumped when the PCA scores change, so cached embeddings of PCA input are recomputed.
+PCA_VERSION = 2
+
+PCAModel = namedtuple("PCAModel", ["genes", "mean", "components", "target_sum"])
+PCAModel.__doc__ = """
+Fitted PCA pre-reduction, applied to new cells with apply_pca.
+
+- genes: Integer numpy array of the highly variable gene rows used by the PCA.
+- mean: Numpy array of the mean log-normalized value of those genes.
+- components: Numpy array of shape (n_components, genes) with the principal axes.
+- target_sum: Total count of every cell after normalization.
+"""
+
+
+def cells_by_genes(dge_matrix_filtered):
+    """
+    Cell x gene input of an embedding method.
+
+    Parameters:
+    - dge_matrix_filtered: A dataframe or ExpressionMatrix (rows = genes, columns = cells).
+
+    Returns:
+    - The transposed DataFrame, or a scipy CSR matrix for an ExpressionMatrix.
+    """
+    if isinstance(dge_matrix_filtered, ExpressionMatrix):
+        return dge_matrix_filtered.matrix.T.tocsr()
+    return dge_matrix_filtered.T
+
+
+def normalize_log1p(matrix, target_sum=1e4):
+    """
+    Library-size normalization followed by log1p, on a sparse cell x gene matrix.
+
+    Parameters:
+    - matrix: Scipy sparse matrix of counts (rows = cells, columns = genes).
+    - target_sum: Total count of every cell after normalization.
+
+    Returns:
+    - Scipy CSR matrix of float32 log-normalized values.
+    """
+    matrix = csr_matrix(matrix, dtype=np.float32, copy=True)
+    totals = np.asarray(matrix.sum(axis=1), dtype=np.float64).ravel()
+    scale = np.divide(target_sum, totals, out=np.zeros_like(totals), where=totals > 0)
+    matrix = diags(scale.astype(np.float32)) @ matrix
+    np.log1p(matrix.data, out=matrix.data)
+    return matrix.tocsr()
+
+
+def highly_variable_genes(matrix, n_top_genes=2000, n_bins=20):
+    """
+    Select the genes with the highest normalized dispersion.
+
+    Genes are binned by mean expression and the log dispersion (variance over
+    mean) of every gene is z-scored within its bin, so highly expressed genes
+    are not favoured by their mean alone.
+
+    Parameters:
+    - matrix: Scipy sparse matrix of log-normalized values (rows = cells, columns = genes).
+    - n_top_genes: Number of genes to select.
+    - n_bins: Number of mean expression bins.
+
+    Returns:
+    - Sorted integer numpy array of the selected gene columns.
+    """
+    n_cells, n_genes = matrix.shape
+    if n_top_genes >= n_genes:
+        return np.arange(n_genes)
+
+    mean = np.asarray(matrix.mean(axis=0), dtype=np.float64).ravel()
+    mean_square = np.asarray(matrix.multiply(matrix).mean(axis=0)).ravel()
+    variance = (mean_square - mean**2) * n_cells / max(n_cells - 1, 1)
+
+    expressed = mean > 0
+    dispersion = np.full(n_genes, np.nan)
+    dispersion[expressed] = np.log(
+        np.maximum(variance[expressed], 1e-12) / mean[expressed]
+    )
+    bins = pd.cut(mean, n_bins, labels=False)
+    grouped = pd.Series(dispersion).groupby(bins)
+    spread = grouped.transform("std").to_numpy()
+    normalized = (dispersion - grouped.transform("mean").to_numpy()) / np.where(
+        spread > 0, spread, 1
+    )
+    normalized[~expressed] = -np.inf
+    normalized[np.isnan(normalized)] = -np.inf
 
+    return np.sort(np.argsort(-normalized, kind="stable")[:n_top_genes])
 
+
+def randomized_pca(
+    matrix,
+    n_components=50,
+    n_oversamples=10,
+    n_iter=4,
+    random_state=42,
+    return_components=False,
+):
+    """
+    Principal components of a sparse matrix by randomized SVD.
+
+    Columns are centered implicitly (every product subtracts the mean), so the
+    matrix is never densified.
+
+    Parameters:
+    - matrix: Scipy sparse matrix (rows = cells, columns = genes).
+    - n_components: Number of principal components.
+    - n_oversamples: Extra random directions used to improve the range estimate.
+    - n_iter: Number of power iterations.
+    - random_state: The random state for reproducibility.
+    - return_components: If True, also return the principal axes and column means.
+
+    Returns:
+    - Numpy array of shape (cells, n_components) with the component scores.
+    - components: Numpy array of shape (n_components, genes) (only if return_components).
+    - mean: Numpy array of the column means (only if return_components).
+    """
+    matrix = csr_matrix(matrix)
+    n_components = min(n_components, min(matrix.shape) - 1)
+    mean = np.asarray(matrix.mean(axis=0), dtype=np.float64)
+
+    def project(vectors):
+        return matrix @ vectors - mean @ vectors
+
+    def project_transposed(vectors):
+        return matrix.T @ vectors - mean.T @ vectors.sum(axis=0, keepdims=True)
+
+    rng = np.random.default_rng(random_state)
+    basis = rng.normal(size=(matrix.shape[1], n_components + n_oversamples))
+    basis, _ = np.linalg.qr(project(basis))
+    for _ in range(n_iter):
+        basis, _ = np.linalg.qr(project_transposed(basis))
+        basis, _ = np.linalg.qr(project(basis))
+
+    left, singular_values, right = np.linalg.svd(
+        project_transposed(basis).T, full_matrices=False
+    )
+    # Fix the sign of each component for reproducible scores.
+    signs = np.sign(right[np.arange(right.shape[0]), np.argmax(np.abs(right), axis=1)])
+    components = (right * signs[:, None])[:n_components]
+    # Score by projecting on the axes rather than from the SVD factors, so the
+    # fitted cells get exactly the scores apply_pca gives the same cells.
+    scores = project(components.T)
+    if return_components:
+        return scores, components, mean.ravel()
+    return scores
+
+
+@profiled("preprocessing.compute_pca")
+def compute_pca(
+    dge_matrix_filtered,
+    n_components=50,
+    n_top_genes=2000,
+    target_sum=1e4,
+    random_state=42,
+    return_model=False,
+):
+    """
+    Reduce the filtered data to its top principal components.
+
+    Counts are normalized to target_sum per cell and log1p transformed, the
+    n_top_genes highly variable genes are kept and a randomized PCA is run on
+    the sparse result. The components are a much smaller input for t-SNE and
+    UMAP than the full gene space.
+
+    Parameters:
+    - dge_matrix_filtered: A dataframe or ExpressionMatrix containing the filtered data.
+    - n_components: The number of principal components.
+    - n_top_genes: The number of highly variable genes kept before PCA.
+    - target_sum: Total count of every cell after normalization.
+    - random_state: The random state for reproducibility.
+    - return_model: If True, also return the fitted PCAModel.
+
+    Returns:
+    - pca_results: A 2D float32 numpy array of shape (cells, n_components).
+    - model: The PCAModel (only if return_model).
+    """
+    matrix = normalize_log1p(cells_by_genes(dge_matrix_filtered), target_sum)
+    genes = highly_variable_genes(matrix, n_top_genes)
+    pca_results, components, mean = randomized_pca(
+        matrix[:, genes],
+        n_components,
+        random_state=random_state,
+        return_components=True,
+    )
+    # float32 matches the expression values and UMAP's compiled float32 kernels.
+    pca_results = pca_results.astype(np.float32)
+    if return_model:
+        return pca_results, PCAModel(genes, mean, components, target_sum)
+    return pca_results
+
+
+def apply_pca(model, dge_matrix):
+    """
+    Project new cells on the principal axes of a fitted PCA.
+
+    Parameters:
+    - model: A PCAModel from compute_pca.
+    - dge_matrix: A dataframe or ExpressionMatrix with the genes of the fitted
+      data, in the same order (see align_genes).
+
+    Returns:
+    - A 2D float32 numpy array of shape (cells, n_components).
+    """
+    matrix = normalize_log1p(cells_by_genes(dge_matrix), model.target_sum)
+    centered_axes = model.components.T
+    scores = matrix[:, model.genes] @ centered_axes - model.mean @ centered_axes
+    return np.asarray(scores, dtype=np.float32)
+
+
+def align_genes(dge_matrix, genes):
+    """
+    Reorder the genes of a DGE matrix to a reference gene index.
+
+    Genes missing from dge_matrix are filled with zeros and extra genes are dropped.
+
+    Parameters:
+    - dge_matrix: A dataframe or ExpressionMatrix (rows = genes, columns = cells).
+    - genes: Reference gene index.
+
+    Returns:
+    - A matrix of the same type with exactly the reference genes as rows.
+    """
+    genes = pd.Index(genes)
+    if not isinstance(dge_matrix, ExpressionMatrix):
+        return dge_matrix.reindex(genes, fill_value=0)
+
+    positions = dge_matrix.index.get_indexer(genes)
+    found = positions >= 0
+    matrix = (
+        diags(found.astype(dge_matrix.matrix.dtype))
+        @ dge_matrix.matrix[np.where(found, positions, 0)]
+    )
+    return ExpressionMatrix(matrix, genes, dge_matrix.columns)
+
+
+class EmbeddingModel:
+    """
+    Fitted UMAP reducer with the gene index and PCA needed to embed new cells.
+
+    New cells are aligned to the fitted genes, passed through the same PCA
+    pre-reduction (if any) and placed with the reducer's transform, so the
+    coordinates of the fitted cells never change.
+    """
+
+    def __init__(self, reducer, genes, pca=None):
+        """
+        Parameters:
+        - reducer: The fitted UMAP object.
+        - genes: Gene index of the fitted data.
+        - pca: Optional PCAModel applied before the reducer.
+        """
+        self.reducer = reducer
+        self.genes = pd.Index(genes)
+        self.pca = pca
+
+    def transform(self, dge_matrix):
+        """
+        Embed new cells.
+
+        Parameters:
+        - dge_matrix: A dataframe or ExpressionMatrix of the new cells (rows = genes).
+
+        Returns:
+        - A 2D numpy array with the coordinates of each new cell.
+        """
+        dge_matrix = align_genes(dge_matrix, self.genes)
+        if self.pca is None:
+            return self.reducer.transform(cells_by_genes(dge_matrix))
+        return self.reducer.transform(apply_pca(self.pca, dge_matrix))
+
+    def save(self, path):
+        """
+        Persist the model with pickle.
+
+        Parameters:
+        - path: Path of the output file.
+        """
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model saved with save().
+
+        Parameters:
+        - path: Path of the saved model.
+
+        Returns:
+        - The EmbeddingModel.
+        """
+        with open(path, "rb") as f:
+            model = pickle.load(f)
+        if not isinstance(model, cls):
+            raise ValueError(f"'{path}' does not contain an EmbeddingModel.")
+        return model
+
+
+def embedding_input(dge_matrix_filtered, n_pca_components, n_top_genes, random_state):
+    """
+    Input of t-SNE or UMAP: the PCA scores if n_pca_components is set, else the
+    cell x gene matrix.
+    """
+    if n_pca_components is None:
+        return cells_by_genes(dge_matrix_filtered)
+    return compute_pca(
+        dge_matrix_filtered,
+        n_components=n_pca_components,
+        n_top_genes=n_top_genes,
+        random_state=random_state,
+    )
+
+
+def cached_embedding(
+    method, dge_matrix_filtered, params, cache, compute, refresh=False
+):
+    """
+    Look up an embedding in the cache, computing and storing it on a miss.
+
+    Parameters:
+    - method: Name of the embedding method.
+    - dge_matrix_filtered: The input data, hashed into the cache key.
+    - params: Dictionary of every parameter of the method.
+    - cache: Cache argument (see resolve_embedding_cache).
+    - compute: Function computing the embedding.
+    - refresh: If True, always compute and store the embedding.
+
+    Returns:
+    - The embedding as a numpy array. Parameters that cannot be part of a cache
+      key (see cacheable_params) bypass the cache.
+    """
+    cache = resolve_embedding_cache(cache)
+    params = cacheable_params(params)
+    if cache is None or params is None:
+        return compute()
+
+    key = cache.key(method, dge_matrix_filtered, params)
+    embedding = None if refresh else cache.get(key)
+    if embedding is None:
+        embedding = compute()
+        cache.put(key, embedding)
+    return embedding
+
+
+@profiled("preprocessing.compute_tsne")
 def compute_tsne(
-    dge_matrix_filtered, n_components=2, random_state=42, perplexity=30, save_path=None
+    dge_matrix_filtered,
+    n_components=2,
+    random_state=42,
+    perplexity=30,
+    max_iter=1000,
+    n_pca_components=None,
+    n_top_genes=2000,
+    save_path=None,
+    cache=True,
 ):
     """
     Run t-SNE on the filtered data.
 
     Parameters:
-    - dge_matrix_filtered: A dataframe containing the filtered data.
+    - dge_matrix_filtered: A dataframe or ExpressionMatrix containing the filtered data.
     - n_components: The number of components for t-SNE.
     - random_state: The random state for reproducibility.
     - perplexity: The perplexity parameter for t-SNE.
+    - max_iter: The maximum number of optimization iterations.
+    - n_pca_components: If set, run t-SNE on this many principal components of the
+      normalized data (see compute_pca) instead of on every gene.
+    - n_top_genes: The number of highly variable genes kept before PCA.
     - save_path: Path to save the t-SNE results.
+    - cache: True to reuse embeddings from the default EmbeddingCache, False to
+      always recompute, or a cache directory or EmbeddingCache.
 
     Returns:
     - tsne_results: A 2D numpy array with the t-SNE (or UMAP) coordinates for each cell.
     """
-    tsne = TSNE(
-        n_components=n_components,
-        perplexity=perplexity,
-        random_state=random_state,
-        max_iter=1000,
-    )
-    tsne_results = tsne.fit_transform(dge_matrix_filtered.T)
+    params = {
+        "n_components": n_components,
+        "random_state": random_state,
+        "perplexity": perplexity,
+        "max_iter": max_iter,
+        "n_pca_components": n_pca_components,
+        "n_top_genes": n_top_genes,
+        "version": sklearn.__version__,
+    }
+    if n_pca_components:
+        params["pca_version"] = PCA_VERSION
+
+    def compute():
+        tsne = TSNE(
+            n_components=n_components,
+            perplexity=perplexity,
+            random_state=random_state,
+            max_iter=max_iter,
+        )
+        return tsne.fit_transform(
+            embedding_input(
+                dge_matrix_filtered, n_pca_components, n_top_genes, random_state
+            )
+        )
+
+    tsne_results = cached_embedding("tsne", dge_matrix_filtered, params, cache, compute)
 
     if save_path:
         tsne_results_df = pd.DataFrame(tsne_results, columns=["x", "y"])
@@ -34,29 +422,120 @@ def compute_tsne(
     return tsne_results
 
 
+@profiled("preprocessing.run_umap")
 def run_umap(
-    dge_matrix_filtered, random_state=42, n_neighbors=15, min_dist=0.1, save_path=None
+    dge_matrix_filtered,
+    random_state=42,
+    n_neighbors=15,
+    min_dist=0.1,
+    n_pca_components=None,
+    n_top_genes=2000,
+    save_path=None,
+    cache=True,
+    return_model=False,
+    model_path=None,
 ):
     """
     Run UMAP on the filtered data.
 
     Parameters:
-    - dge_matrix_filtered: A dataframe containing the filtered data.
+    - dge_matrix_filtered: A dataframe or ExpressionMatrix containing the filtered data.
     - random_state: The random state for reproducibility.
     - n_neighbors: The number of neighbors for UMAP.
     - min_dist: The minimum distance for UMAP.
+    - n_pca_components: If set, run UMAP on this many principal components of the
+      normalized data (see compute_pca) instead of on every gene.
+    - n_top_genes: The number of highly variable genes kept before PCA.
     - save_path: Path to save the UMAP results.
+    - cache: True to reuse embeddings from the default EmbeddingCache, False to
+      always recompute, or a cache directory or EmbeddingCache.
+    - return_model: If True, also return the fitted EmbeddingModel, which embeds
+      new cells with project_cells.
+    - model_path: Path to save the fitted EmbeddingModel.
 
     Returns:
     - umap_results: A 2D numpy array with the UMAP coordinates for each cell.
+    - model: The EmbeddingModel (only if return_model).
+
+    The cache only holds coordinates, so UMAP is always fitted when the model is
+    requested (the coordinates are still stored). Without PCA the reducer keeps
+    the full cell x gene training matrix, so saved models are much smaller with
+    n_pca_components set.
     """
-    umap_reducer = UMAP(
-        n_neighbors=n_neighbors, min_dist=min_dist, random_state=random_state
+    params = {
+        "random_state": random_state,
+        "n_neighbors": n_neighbors,
+        "min_dist": min_dist,
+        "n_pca_components": n_pca_components,
+        "n_top_genes": n_top_genes,
+        "version": umap.__version__,
+    }
+    if n_pca_components:
+        params["pca_version"] = PCA_VERSION
+
+    models = []
+
+    def compute():
+        umap_reducer = UMAP(
+            n_neighbors=n_neighbors, min_dist=min_dist, random_state=random_state
+        )
+        if n_pca_components is None:
+            pca = None
+            umap_input = cells_by_genes(dge_matrix_filtered)
+        else:
+            umap_input, pca = compute_pca(
+                dge_matrix_filtered,
+                n_components=n_pca_components,
+                n_top_genes=n_top_genes,
+                random_state=random_state,
+                return_model=True,
+            )
+        umap_results = umap_reducer.fit_transform(umap_input)
+        models.append(EmbeddingModel(umap_reducer, dge_matrix_filtered.index, pca))
+        return umap_results
+
+    fit_model = return_model or model_path is not None
+    umap_results = cached_embedding(
+        "umap", dge_matrix_filtered, params, cache, compute, refresh=fit_model
     )
-    umap_results = umap_reducer.fit_transform(dge_matrix_filtered.T)
 
     if save_path:
         umap_results_df = pd.DataFrame(umap_results, columns=["x", "y"])
         umap_results_df.to_csv(save_path, index=False)
+    if model_path:
+        models[0].save(model_path)
 
+    if return_model:
+        return umap_results, models[0]
     return umap_results
+
+
+@profiled("preprocessing.project_cells")
+def project_cells(
+    model, dge_matrix, embedding, labels, n_neighbors=15, max_distance=None
+):
+    """
+    Embed new cells into an existing UMAP embedding and label them.
+
+    Only the new cells are transformed; the existing coordinates and labels are
+    left untouched. Each new cell takes the majority cluster label of its
+    nearest existing cells (see assign_cluster_labels).
+
+    Parameters:
+    - model: An EmbeddingModel from run_umap (or EmbeddingModel.load).
+    - dge_matrix: A dataframe or ExpressionMatrix of the new cells (rows = genes).
+    - embedding: 2D numpy array with the coordinates of the existing cells.
+    - labels: DBSCAN cluster labels of the existing cells (0 is noise).
+    - n_neighbors: The number of existing cells voting for each new cell's label.
+    - max_distance: Optional distance beyond which existing cells do not vote
+      (e.g., the DBSCAN eps); cells without votes are labeled noise (0).
+
+    Returns:
+    - new_embedding: A 2D numpy array with the coordinates of the new cells.
+    - new_labels: A 1D numpy array with their cluster labels.
+    """
+    new_embedding = model.transform(dge_matrix)
+    new_labels = assign_cluster_labels(
+        embedding, labels, new_embedding, n_neighbors, max_distance
+    )
+    return new_embedding, new_labels
@@ -1,17 +1,46 @@
+import os
+
+import numpy as np
+from biorsp.data.cache import write_expression_cache
+from biorsp.data.expression import ExpressionMatrix, threshold_matrix
+from biorsp.data.gene_stats import load_gene_stats
+from biorsp.preprocessing.loading import load_dge_matrix
+from biorsp.utils.profiling import profiled
+
+
+def save_dge_matrix(dge_matrix, save_path):
+    """
+    Save a DGE matrix as a tab-delimited file.
+
+    Parameters:
+    - dge_matrix: DataFrame or ExpressionMatrix (rows = genes, columns = cells).
+    - save_path: Path of the output file.
+    """
+    if isinstance(dge_matrix, ExpressionMatrix):
+        dge_matrix = dge_matrix.to_dataframe()
+    dge_matrix.to_csv(save_path, sep="\t")
+
+
+@profiled("preprocessing.filter_cells_by_umi")
 def filter_cells_by_umi(dge_matrix, threshold_umi, plot=False, save_path=None):
     """
     Filter cells by UMI count.
 
     Parameters:
-    - dge_matrix: A dataframe containing the gene expression data (rows = genes, columns = cells).
+    - dge_matrix: A dataframe or ExpressionMatrix containing the gene expression data
+      (rows = genes, columns = cells).
     - threshold_umi: The minimum UMI count threshold.
     - plot: If True, plot the UMI count histogram.
     - save_path: Path to save the filtered data.
 
     Returns:
-    - dge_matrix_filtered: A dataframe containing the filtered cells.
+    - dge_matrix_filtered: The filtered cells, of the same type as dge_matrix.
     """
-    umi_counts_per_cell = dge_matrix.sum(axis=0)
+    sparse = isinstance(dge_matrix, ExpressionMatrix)
+    if sparse:
+        umi_counts_per_cell = dge_matrix.cell_totals()
+    else:
+        umi_counts_per_cell = dge_matrix.sum(axis=0)
 
     if plot:
         import matplotlib.pyplot as plt
@@ -21,44 +50,155 @@ def filter_cells_by_umi(dge_matrix, threshold_umi, plot=False, save_path=None):
         plt.ylabel("Number of cells")
         plt.show()
 
-    filtered_cells = umi_counts_per_cell[umi_counts_per_cell > threshold_umi].index
-    dge_matrix_filtered = dge_matrix[filtered_cells]
+    if sparse:
+        dge_matrix_filtered = dge_matrix.subset(
+            cells=umi_counts_per_cell > threshold_umi
+        )
+    else:
+        filtered_cells = umi_counts_per_cell[umi_counts_per_cell > threshold_umi].index
+        dge_matrix_filtered = dge_matrix[filtered_cells]
 
     if save_path:
-        dge_matrix_filtered.to_csv(save_path, sep="\t")
+        save_dge_matrix(dge_matrix_filtered, save_path)
 
     return dge_matrix_filtered
 
 
-def filter_genes_by_expression(dge_matrix_filtered, threshold_gene, save_path=None):
-    gene_counts_per_cell = (dge_matrix_filtered > 0).sum(axis=1)
-    filtered_genes = gene_counts_per_cell[gene_counts_per_cell > threshold_gene].index
-    dge_matrix_filtered = dge_matrix_filtered.loc[filtered_genes]
+@profiled("preprocessing.filter_genes_by_expression")
+def filter_genes_by_expression(
+    dge_matrix_filtered, threshold_gene, save_path=None, gene_stats=None
+):
+    """
+    Filter genes by the number of cells in which they are detected.
+
+    Parameters:
+    - dge_matrix_filtered: A dataframe or ExpressionMatrix containing the gene
+      expression data (rows = genes, columns = cells).
+    - threshold_gene: The minimum gene expression count threshold.
+    - save_path: Path to save the filtered data.
+    - gene_stats: Optional gene statistics table of the matrix, with its genes in
+      the same order (see compute_gene_stats). For an ExpressionMatrix it is
+      otherwise read with load_gene_stats, from the cache of a memory-mapped matrix.
+
+    Returns:
+    - dge_matrix_filtered: The filtered genes, of the same type as dge_matrix_filtered.
+    """
+    if gene_stats is None and isinstance(dge_matrix_filtered, ExpressionMatrix):
+        gene_stats = load_gene_stats(dge_matrix_filtered, thresholds=())
+
+    if gene_stats is not None:
+        if len(gene_stats) != dge_matrix_filtered.shape[0]:
+            raise ValueError("Gene statistics do not match the genes of the matrix.")
+        detected = gene_stats["n_cells"].to_numpy() > threshold_gene
+        if isinstance(dge_matrix_filtered, ExpressionMatrix):
+            dge_matrix_filtered = dge_matrix_filtered.subset(genes=detected)
+        else:
+            dge_matrix_filtered = dge_matrix_filtered.iloc[np.flatnonzero(detected)]
+    else:
+        gene_counts_per_cell = (dge_matrix_filtered > 0).sum(axis=1)
+        filtered_genes = gene_counts_per_cell[
+            gene_counts_per_cell > threshold_gene
+        ].index
+        dge_matrix_filtered = dge_matrix_filtered.loc[filtered_genes]
 
     if save_path:
-        dge_matrix_filtered.to_csv(save_path, sep="\t")
+        save_dge_matrix(dge_matrix_filtered, save_path)
 
     return dge_matrix_filtered
 
 
-def filter_dge_matrix(dge_matrix, threshold_umi, threshold_gene, save_path=None):
+def compute_qc_masks(dge_matrix, threshold_umi, threshold_gene, max_elements=2**24):
+    """
+    Cell and gene QC masks of a DGE matrix, in one pass over its values.
+
+    Per-cell UMI totals select the cells; per-gene detection counts are then
+    taken over the selected cells only, as when filtering cells before genes.
+    Dense input is read in blocks of gene rows, so no full boolean copy is made.
+
+    Parameters:
+    - dge_matrix: A dataframe or ExpressionMatrix (rows = genes, columns = cells).
+    - threshold_umi: The minimum UMI count threshold.
+    - threshold_gene: The minimum gene expression count threshold.
+    - max_elements: Upper bound on the number of dense entries compared at once.
+
+    Returns:
+    - cell_mask: Boolean numpy array of the cells with more than threshold_umi UMIs.
+    - gene_mask: Boolean numpy array of the genes detected in more than
+      threshold_gene of the selected cells.
+    """
+    if isinstance(dge_matrix, ExpressionMatrix):
+        cell_mask = dge_matrix.cell_totals() > threshold_umi
+        detected = threshold_matrix(dge_matrix.matrix, 0)
+        # Detected entries in selected cells, counted per row from prefix sums.
+        selected = np.concatenate(([0], np.cumsum(cell_mask[detected.indices])))
+        gene_detection = np.diff(selected[detected.indptr])
+        return cell_mask, gene_detection > threshold_gene
+
+    values = dge_matrix.to_numpy()
+    cell_mask = values.sum(axis=0) > threshold_umi
+    block_size = max(1, max_elements // max(1, values.shape[1]))
+    gene_detection = np.empty(values.shape[0], dtype=np.int64)
+    for start in range(0, values.shape[0], block_size):
+        block = values[start : start + block_size]
+        gene_detection[start : start + block_size] = np.count_nonzero(
+            (block > 0) & cell_mask, axis=1
+        )
+    return cell_mask, gene_detection > threshold_gene
+
+
+@profiled("preprocessing.filter_dge_matrix")
+def filter_dge_matrix(
+    dge_matrix, threshold_umi, threshold_gene, save_path=None, save_format="auto"
+):
     """
     Filter the DGE matrix by UMI and gene thresholds.
 
+    Both QC masks are computed in one pass (see compute_qc_masks) and applied
+    in a single selection. A path to a DGE file is streamed with
+    load_dge_matrix, which applies the thresholds while reading.
+
     Parameters:
-    - dge_matrix: A dataframe containing the gene expression data (rows = genes, columns = cells).
+    - dge_matrix: A dataframe or ExpressionMatrix containing the gene expression data
+      (rows = genes, columns = cells), or the path of a DGE file.
     - threshold_umi: The minimum UMI count threshold.
     - threshold_gene: The minimum gene expression count threshold.
     - save_path: Path to save the filtered data.
+    - save_format: "biorsp" to save a memory-mappable cache (see
+      write_expression_cache), "tsv" for a tab-delimited file, or "auto" to
+      pick from the path: an existing directory or a ".biorsp" suffix means a
+      cache, anything else (e.g., "filtered.tsv" or an existing file) a
+      tab-delimited file, as before caches existed.
 
     Returns:
-    - dge_matrix_filtered: A dataframe containing the filtered cells and genes.
+    - dge_matrix_filtered: The filtered cells and genes, of the same type as
+      dge_matrix (an ExpressionMatrix for a file path).
     """
-    dge_matrix_filtered = filter_cells_by_umi(
-        dge_matrix, threshold_umi, save_path=save_path
-    )
-    dge_matrix_filtered = filter_genes_by_expression(
-        dge_matrix_filtered, threshold_gene, save_path=save_path
-    )
+    if save_format not in ("auto", "biorsp", "tsv"):
+        raise ValueError(f"Unknown save format: {save_format}.")
+    if save_path and save_format == "auto":
+        suffix = os.path.splitext(os.path.normpath(save_path))[1]
+        is_cache = os.path.isdir(save_path) or suffix == ".biorsp"
+        save_format = "biorsp" if is_cache else "tsv"
+
+    if isinstance(dge_matrix, (str, os.PathLike)):
+        dge_matrix_filtered = load_dge_matrix(
+            dge_matrix, threshold_umi=threshold_umi, threshold_gene=threshold_gene
+        )
+    else:
+        cell_mask, gene_mask = compute_qc_masks(
+            dge_matrix, threshold_umi, threshold_gene
+        )
+        if isinstance(dge_matrix, ExpressionMatrix):
+            dge_matrix_filtered = dge_matrix.subset(genes=gene_mask, cells=cell_mask)
+        else:
+            dge_matrix_filtered = dge_matrix.iloc[
+                np.flatnonzero(gene_mask), np.flatnonzero(cell_mask)
+            ]
+
+    if save_path:
+        if save_format == "biorsp":
+            write_expression_cache(dge_matrix_filtered, save_path)
+        else:
+            save_dge_matrix(dge_matrix_filtered, save_path)
 
     return dge_matrix_filtered
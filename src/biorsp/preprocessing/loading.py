@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, vstack
+from biorsp.data.cache import (
+    cache_is_valid,
+    open_expression_cache,
+    write_expression_cache,
+)
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.utils.profiling import profiled
+
+
+@profiled("preprocessing.load_dge_matrix")
+def load_dge_matrix(
+    file_path,
+    delimiter="\t",
+    chunk_size=1000,
+    threshold_umi=None,
+    threshold_gene=None,
+    dtype=np.float32,
+    cache_path=None,
+):
+    """
+    Stream a DGE text file into a sparse expression matrix.
+
+    The file is read in chunks of gene rows, and each chunk is converted to a
+    sparse block before the next is read, so peak memory is bounded by the chunk
+    rather than by the dense matrix. Cell and gene QC thresholds follow
+    filter_dge_matrix: cells are kept if their total UMI count exceeds
+    threshold_umi, then genes are kept if detected in more than threshold_gene of
+    the retained cells. Genes already at or below threshold_gene across all
+    cells are dropped while reading.
+
+    Parameters:
+    - file_path: Path to the delimited DGE file (rows = genes, columns = cells,
+      first column = gene names).
+    - delimiter: Field delimiter (default: tab).
+    - chunk_size: Number of gene rows read at once.
+    - threshold_umi: Optional minimum UMI count threshold for cells.
+    - threshold_gene: Optional minimum number of cells expressing a gene.
+    - dtype: Numpy type of the stored expression values.
+    - cache_path: Optional directory of a biorsp cache (see write_expression_cache).
+      A cache written from the same file and parameters is memory-mapped instead
+      of parsing the file; otherwise the file is parsed and the cache (re)written.
+
+    Returns:
+    - An ExpressionMatrix with gene and barcode indexes.
+    """
+    if cache_path is not None:
+        params = {
+            "threshold_umi": threshold_umi,
+            "threshold_gene": threshold_gene,
+            "dtype": np.dtype(dtype).name,
+        }
+        if cache_is_valid(cache_path, file_path, params):
+            return open_expression_cache(cache_path)
+        expression = load_dge_matrix(
+            file_path, delimiter, chunk_size, threshold_umi, threshold_gene, dtype
+        )
+        write_expression_cache(expression, cache_path, source=file_path, params=params)
+        return open_expression_cache(cache_path)
+
+    blocks = []
+    genes = []
+    barcodes = None
+    cell_totals = None
+
+    reader = pd.read_csv(
+        file_path, delimiter=delimiter, index_col=0, chunksize=chunk_size
+    )
+    for chunk in reader:
+        if barcodes is None:
+            barcodes = chunk.columns
+            cell_totals = np.zeros(len(barcodes))
+
+        values = chunk.to_numpy(dtype=dtype)
+        cell_totals += values.sum(axis=0, dtype=np.float64)
+        chunk_genes = chunk.index
+
+        if threshold_gene is not None:
+            # Dropping cells can only lower detection counts, so these genes
+            # would be filtered out later anyway.
+            keep = np.count_nonzero(values > 0, axis=1) > threshold_gene
+            values, chunk_genes = values[keep], chunk_genes[keep]
+
+        blocks.append(csr_matrix(values))
+        genes.extend(chunk_genes)
+
+    if barcodes is None:
+        raise ValueError(f"No expression data found in '{file_path}'.")
+
+    if blocks:
+        matrix = vstack(blocks, format="csr")
+    else:
+        matrix = csr_matrix((0, len(barcodes)), dtype=dtype)
+    expression = ExpressionMatrix(matrix, genes, barcodes)
+
+    if threshold_umi is not None:
+        expression = expression.subset(cells=cell_totals > threshold_umi)
+    if threshold_gene is not None:
+        expression = expression.subset(
+            genes=expression.gene_detection() > threshold_gene
+        )
+
+    return expression
@@ -0,0 +1,271 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+import pandas as pd
+
+_profilers = []
+_hooks = []
+_enabled = False
+_null_stage = nullcontext()
+
+
+def _update_enabled():
+    global _enabled
+    _enabled = bool(_profilers or _hooks)
+
+
+def is_profiling():
+    """
+    Whether any profiler or hook is currently recording stages.
+    """
+    return _enabled
+
+
+def register_hook(hook):
+    """
+    Call a function with every finished stage while it is registered.
+
+    Parameters:
+    - hook: Callable receiving an event dictionary with name, start and duration
+      (nanoseconds), pid, tid and size.
+    """
+    _hooks.append(hook)
+    _update_enabled()
+
+
+def unregister_hook(hook):
+    """
+    Stop calling a hook registered with register_hook.
+    """
+    _hooks.remove(hook)
+    _update_enabled()
+
+
+def reset_profiling():
+    """
+    Drop every active profiler and hook, e.g. those inherited by a forked worker process.
+    """
+    _profilers.clear()
+    _hooks.clear()
+    _update_enabled()
+
+
+def record_event(event):
+    """
+    Deliver a finished stage to every active profiler and hook.
+
+    Parameters:
+    - event: Event dictionary (see register_hook).
+    """
+    for profiler in _profilers:
+        profiler.events.append(event)
+    for hook in _hooks:
+        hook(event)
+
+
+def merge_events(events):
+    """
+    Record events collected elsewhere, e.g. returned by worker processes.
+
+    Parameters:
+    - events: Iterable of event dictionaries.
+    """
+    for event in events:
+        record_event(event)
+
+
+class _Stage:
+    __slots__ = ("name", "size", "start")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        record_event(
+            {
+                "name": self.name,
+                "start": self.start,
+                "duration": end - self.start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "size": self.size,
+            }
+        )
+        return False
+
+
+def stage(name, size=None):
+    """
+    Context manager timing a named stage while profiling is enabled.
+
+    When no profiler or hook is active this returns a shared no-op context.
+
+    Parameters:
+    - name: Stage name, prefixed with its subpackage (e.g., "analysis.sweep").
+    - size: Optional number of elements processed (e.g., cells).
+
+    Returns:
+    - A context manager.
+    """
+    if not _enabled:
+        return _null_stage
+    return _Stage(name, size)
+
+
+def _array_size(args):
+    for arg in args:
+        shape = getattr(arg, "shape", None)
+        if shape:
+            return int(shape[0])
+    return None
+
+
+def profiled(name):
+    """
+    Decorate a function so each call is recorded as a stage while profiling is enabled.
+
+    The recorded size is the length of the first array argument. When profiling
+    is disabled the wrapper only checks one global flag.
+
+    Parameters:
+    - name: Stage name, prefixed with its subpackage (e.g., "analysis.convert_to_polar").
+
+    Returns:
+    - The decorator.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name, _array_size(args)):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Profiler:
+    """
+    Collect the stages recorded while it is active.
+
+    Use as a context manager:
+
+        with Profiler() as profiler:
+            perform_rsp_analysis(...)
+        print(profiler.summary())
+        profiler.write_chrome_trace("trace.json")
+
+    Stages recorded in worker processes of a gene scan are sent back to the
+    parent and merged, so one profiler covers the whole scan.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def start(self):
+        """
+        Start recording stages.
+        """
+        _profilers.append(self)
+        _update_enabled()
+
+    def stop(self):
+        """
+        Stop recording stages.
+        """
+        if self in _profilers:
+            _profilers.remove(self)
+        _update_enabled()
+
+    def drain(self):
+        """
+        Return the recorded events and forget them.
+
+        Returns:
+        - List of event dictionaries.
+        """
+        events, self.events = self.events, []
+        return events
+
+    def summary(self):
+        """
+        Aggregate the recorded stages.
+
+        Returns:
+        - DataFrame with one row per stage: calls, total, mean and max wall time in
+          seconds, total size and number of processes, sorted by total time.
+        """
+        columns = ["calls", "total_time", "mean_time", "max_time", "total_size"]
+        if not self.events:
+            return pd.DataFrame(columns=columns + ["processes"])
+
+        events = pd.DataFrame(self.events)
+        events["duration"] = events["duration"] / 1e9
+        grouped = events.groupby("name")
+        summary = pd.DataFrame(
+            {
+                "calls": grouped.size(),
+                "total_time": grouped["duration"].sum(),
+                "mean_time": grouped["duration"].mean(),
+                "max_time": grouped["duration"].max(),
+                "total_size": grouped["size"].sum(min_count=1),
+                "processes": grouped["pid"].nunique(),
+            }
+        )
+        summary.index.name = "stage"
+        return summary.sort_values("total_time", ascending=False)
+
+    def chrome_trace(self):
+        """
+        Recorded stages in the Chrome trace event format (chrome://tracing, Perfetto).
+
+        Returns:
+        - Dictionary with a "traceEvents" list of complete ("X") events.
+        """
+        trace_events = []
+        for event in self.events:
+            args = {} if event["size"] is None else {"size": event["size"]}
+            trace_events.append(
+                {
+                    "name": event["name"],
+                    "cat": event["name"].split(".")[0],
+                    "ph": "X",
+                    "ts": event["start"] / 1e3,
+                    "dur": event["duration"] / 1e3,
+                    "pid": event["pid"],
+                    "tid": event["tid"],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        """
+        Save the recorded stages as a Chrome trace JSON file.
+
+        Parameters:
+        - path: Output file path.
+        """
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
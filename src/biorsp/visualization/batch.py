@@ -0,0 +1,367 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from scipy.sparse import issparse
+from biorsp.analysis.scan import pool_context
+from biorsp.utils.profiling import profiled
+from biorsp.visualization.rsp import (
+    ForegroundBackgroundPlot,
+    RSPComparisonPlot,
+    RSPPolarPlot,
+    foreground_background_raster,
+    rsp_angles,
+)
+
+PLOT_KINDS = ("foreground_background", "rsp_polar", "rsp_comparison")
+FIGURE_SIZES = {
+    "foreground_background": (8, 6),
+    "rsp_polar": (6.4, 4.8),
+    "rsp_comparison": (6.4, 4.8),
+}
+
+_renderer = None
+
+
+def figure_path(output_dir, gene, kind, file_format="png"):
+    """
+    Path of the figure of one gene, with characters unsafe in file names replaced.
+
+    Parameters:
+    - output_dir: Directory of the figures.
+    - gene: Gene name.
+    - kind: One of PLOT_KINDS.
+    - file_format: Extension of the figure files.
+
+    Returns:
+    - Path of the figure.
+    """
+    name = re.sub(r"[^\w.-]", "_", str(gene))
+    return os.path.join(output_dir, f"{name}_{kind}.{file_format}")
+
+
+def figure_names(genes):
+    """
+    File name stems of the figures of many genes, without collisions.
+
+    Gene names that collide once unsafe characters are replaced (e.g. "HLA/DRA"
+    and "HLA_DRA", or duplicate genes), compared case-insensitively for
+    case-insensitive file systems, get their row number as a suffix.
+
+    Parameters:
+    - genes: Sequence of gene names.
+
+    Returns:
+    - List of names, one per gene, for figure_path.
+    """
+    names = [re.sub(r"[^\w.-]", "_", str(gene)) for gene in genes]
+    counts = pd.Series([name.lower() for name in names]).value_counts()
+    used = set(counts.index)
+    for row, name in enumerate(names):
+        if counts[name.lower()] > 1:
+            suffixed = f"{name}_{row}"
+            while suffixed.lower() in used:
+                suffixed += "_"
+            used.add(suffixed.lower())
+            names[row] = suffixed
+    return names
+
+
+class GeneFigureRenderer:
+    """
+    Per-process figures of a batch render, drawn once and updated for each gene.
+
+    Figures are plain Agg figures, not pyplot figures, so nothing accumulates in
+    pyplot's figure manager and no GUI backend is involved.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        genes,
+        kinds,
+        background_points=None,
+        foreground_masks=None,
+        differences=None,
+        rsp_areas=None,
+        angles=None,
+        angle_range=np.array([0, 2 * np.pi]),
+        file_format="png",
+        dpi=100,
+        render="auto",
+        raster_bins=512,
+    ):
+        """
+        Parameters:
+        - The parameters of render_gene_figures.
+        """
+        self.output_dir = output_dir
+        self.genes = genes
+        self.names = figure_names(genes)
+        self.kinds = kinds
+        self.background_points = background_points
+        self.foreground_masks = foreground_masks
+        self.differences = differences
+        self.rsp_areas = rsp_areas
+        self.angles = angles
+        # One array for every gene, or one array per gene.
+        self.shared_angles = angles is not None and np.ndim(angles[0]) == 0
+        self.angle_range = angle_range
+        self.file_format = file_format
+        self.dpi = dpi
+        self.render = render
+        self.raster_bins = raster_bins
+        self.figures = {}
+        self.laid_out = set()
+
+    def gene_angles(self, row):
+        """
+        Angles of the differences of one gene.
+
+        Parameters:
+        - row: Index of the gene.
+
+        Returns:
+        - Numpy array of angles, one per difference.
+        """
+        if self.angles is None:
+            return rsp_angles(len(self.differences[row]), self.angle_range)
+        if self.shared_angles:
+            return np.asarray(self.angles)
+        return np.asarray(self.angles[row])
+
+    def figure(self, kind, row):
+        """
+        Figure and plot of one kind for a gene, created on first use.
+
+        Foreground/background figures are kept separately for scatter and raster
+        rendering, which is decided per gene as in plot_foreground_background.
+
+        Parameters:
+        - kind: One of PLOT_KINDS.
+        - row: Index of the gene.
+
+        Returns:
+        - figure: Matplotlib Figure.
+        - plot: ForegroundBackgroundPlot, RSPPolarPlot or RSPComparisonPlot.
+        """
+        raster = None
+        if kind == "foreground_background":
+            raster = foreground_background_raster(
+                self.foreground_size(row), self.background_points.shape[0], self.render
+            )
+        if (kind, raster) not in self.figures:
+            figure = Figure(figsize=FIGURE_SIZES[kind])
+            FigureCanvasAgg(figure)
+            if kind == "foreground_background":
+                plot = ForegroundBackgroundPlot(
+                    figure,
+                    self.background_points,
+                    raster=raster,
+                    raster_bins=self.raster_bins,
+                )
+            else:
+                plot_class = RSPPolarPlot if kind == "rsp_polar" else RSPComparisonPlot
+                plot = plot_class(figure, self.gene_angles(row))
+            self.figures[(kind, raster)] = (figure, plot)
+        return self.figures[(kind, raster)]
+
+    def foreground_size(self, row):
+        """
+        Number of foreground points of one gene.
+
+        Parameters:
+        - row: Index of the gene.
+
+        Returns:
+        - Integer count.
+        """
+        if issparse(self.foreground_masks):
+            return self.foreground_masks[row].count_nonzero()
+        return int(np.count_nonzero(self.foreground_masks[row]))
+
+    def foreground_points(self, row):
+        """
+        Background points in the foreground of one gene.
+
+        Parameters:
+        - row: Index of the gene.
+
+        Returns:
+        - Numpy array of (x, y) coordinates.
+        """
+        if issparse(self.foreground_masks):
+            cells = self.foreground_masks[row].indices
+        else:
+            cells = np.flatnonzero(self.foreground_masks[row])
+        return self.background_points[cells]
+
+    @profiled("visualization.render_chunk")
+    def render_rows(self, rows):
+        """
+        Write the figures of a chunk of genes.
+
+        Parameters:
+        - rows: Integer numpy array of gene indices.
+
+        Returns:
+        - List of (row, kind, path) tuples, one per written figure.
+        """
+        written = []
+        for row in rows:
+            gene = self.genes[row]
+            for kind in self.kinds:
+                figure, plot = self.figure(kind, row)
+                if kind == "foreground_background":
+                    plot.update(self.foreground_points(row), title=str(gene))
+                elif kind == "rsp_polar":
+                    plot.update(self.differences[row], self.gene_angles(row))
+                else:
+                    plot.update(
+                        self.rsp_areas[row],
+                        self.differences[row],
+                        self.gene_angles(row),
+                    )
+                if kind != "rsp_comparison" and figure not in self.laid_out:
+                    # Only the data and title change between genes: lay out once.
+                    figure.tight_layout()
+                    self.laid_out.add(figure)
+                path = figure_path(
+                    self.output_dir, self.names[row], kind, self.file_format
+                )
+                figure.savefig(path, dpi=self.dpi)
+                written.append((row, kind, path))
+        return written
+
+
+def _init_renderer(params):
+    global _renderer
+    _renderer = GeneFigureRenderer(**params)
+
+
+def _render_chunk(rows):
+    return _renderer.render_rows(rows)
+
+
+@profiled("visualization.render_gene_figures")
+def render_gene_figures(
+    output_dir,
+    genes,
+    background_points=None,
+    foreground_masks=None,
+    differences=None,
+    rsp_areas=None,
+    kinds=PLOT_KINDS,
+    angles=None,
+    angle_range=np.array([0, 2 * np.pi]),
+    file_format="png",
+    dpi=100,
+    render="auto",
+    raster_bins=512,
+    n_jobs=1,
+    chunk_size=16,
+):
+    """
+    Write the foreground/background, polar and comparison figures of many genes.
+
+    Each worker draws one figure per kind and only updates its data from gene to
+    gene, instead of building a new pyplot figure per call. Differences are
+    plotted at the angles of the analysis: the given angles, or else the uniform
+    grid of one angle per difference over angle_range.
+
+    Parameters:
+    - output_dir: Directory of the figures (created if missing). Files are named
+      "{gene}_{kind}.{file_format}"; genes whose names collide as file names get
+      their row number appended (see figure_names).
+    - genes: Sequence of gene names, one per row of the arrays below.
+    - background_points: Numpy array of (x, y) coordinates for the background
+      points (required for "foreground_background").
+    - foreground_masks: Boolean numpy array or sparse matrix of shape
+      (len(genes), len(background_points)) marking the foreground of each gene
+      (required for "foreground_background").
+    - differences: Numpy array of shape (len(genes), resolution) from the RSP
+      analysis, or a list of one array per gene (e.g. from adaptive analyses)
+      (required for "rsp_polar" and "rsp_comparison").
+    - rsp_areas: Numpy array of RSP areas, one per gene (required for "rsp_comparison").
+    - kinds: Figures to write, a subset of PLOT_KINDS.
+    - angles: Optional. Angles of the differences as returned by the analysis:
+      one array shared by every gene, or one array per gene (a 2D array or a
+      list, e.g. the angles of perform_adaptive_rsp_analysis).
+    - angle_range: Angular range of the analysis, used without angles.
+    - file_format: Extension of the figure files (any format supported by Agg).
+    - dpi: Resolution of the figures.
+    - render: Rendering of the foreground/background figures (see plot_foreground_background).
+    - raster_bins: Number of pixels per axis of rasterized figures.
+    - n_jobs: Number of worker processes (-1 for all cores, 1 to render serially).
+    - chunk_size: Number of genes per task.
+
+    Returns:
+    - DataFrame with columns Gene, Plot and Path, in gene order.
+    """
+    unknown = set(kinds) - set(PLOT_KINDS)
+    if unknown:
+        raise ValueError(f"Unknown plot kinds: {sorted(unknown)}.")
+    required = {
+        "foreground_background": (
+            ("background_points", background_points),
+            ("foreground_masks", foreground_masks),
+        ),
+        "rsp_polar": (("differences", differences),),
+        "rsp_comparison": (("differences", differences), ("rsp_areas", rsp_areas)),
+    }
+    for kind in kinds:
+        for name, value in required[kind]:
+            if value is None:
+                raise ValueError(f"{name} is required for {kind} plots.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    genes = np.asarray(genes)
+    params = dict(
+        output_dir=output_dir,
+        genes=genes,
+        kinds=tuple(kinds),
+        background_points=background_points,
+        foreground_masks=foreground_masks,
+        differences=differences,
+        rsp_areas=rsp_areas,
+        angles=angles,
+        angle_range=angle_range,
+        file_format=file_format,
+        dpi=dpi,
+        render=render,
+        raster_bins=raster_bins,
+    )
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    chunks = [
+        np.arange(start, min(start + chunk_size, len(genes)))
+        for start in range(0, len(genes), chunk_size)
+    ]
+
+    if n_jobs <= 1 or len(chunks) <= 1:
+        renderer = GeneFigureRenderer(**params)
+        written = [item for rows in chunks for item in renderer.render_rows(rows)]
+    else:
+        with pool_context().Pool(
+            n_jobs, initializer=_init_renderer, initargs=(params,)
+        ) as pool:
+            written = [
+                item
+                for result in pool.imap_unordered(_render_chunk, chunks)
+                for item in result
+            ]
+        order = {kind: i for i, kind in enumerate(kinds)}
+        written.sort(key=lambda item: (item[0], order[item[1]]))
+
+    return pd.DataFrame(
+        {
+            "Gene": [genes[row] for row, _, _ in written],
+            "Plot": [kind for _, kind, _ in written],
+            "Path": [path for _, _, path in written],
+        },
+        columns=["Gene", "Plot", "Path"],
+    )
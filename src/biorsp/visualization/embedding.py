@@ -1,6 +1,17 @@
+import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm, Normalize
+from matplotlib.lines import Line2D
+from biorsp.utils.profiling import profiled
+from biorsp.visualization.raster import (
+    density_image,
+    label_image,
+    raster_extent,
+    use_raster,
+)
 
 
+@profiled("visualization.plot_embedding")
 def plot_embedding(
     embedding_results,
     labels=None,
@@ -9,6 +20,8 @@ def plot_embedding(
     show_plot=False,
     point_size=1,
     colormap="tab20",
+    render="auto",
+    raster_bins=512,
 ):
     """
     Plot embedding results (e.g., t-SNE, UMAP) with optional cluster labels.
@@ -21,8 +34,48 @@ def plot_embedding(
     - show_plot: If True, display the plot.
     - point_size: Size of points in the scatter plot.
     - colormap: Colormap to use for the scatter plot (only applies when labels are provided).
+    - render: "scatter" to draw every point, "raster" to draw one image of
+      raster_bins x raster_bins pixels coloured by the majority cluster label (or
+      by point density without labels), or "auto" to rasterize from
+      RASTER_THRESHOLD points on.
+    - raster_bins: Number of pixels per axis of the raster image.
     """
-    if labels is not None:
+    if use_raster(embedding_results.shape[0], render):
+        extent = raster_extent(embedding_results)
+        if labels is not None:
+            labels = np.asarray(labels)
+            norm = Normalize(labels.min(), labels.max())
+            plt.imshow(
+                label_image(embedding_results, labels, extent, raster_bins),
+                origin="lower",
+                extent=extent,
+                aspect="auto",
+                interpolation="nearest",
+                cmap=colormap,
+                norm=norm,
+            )
+            cmap = plt.get_cmap(colormap)
+            handles = [
+                Line2D([], [], marker="o", linestyle="", color=cmap(norm(label)))
+                for label in np.unique(labels)
+            ]
+            legend = plt.legend(
+                handles, [f"{i}" for i in range(len(handles))], title="Cluster"
+            )
+            legend.get_texts()[0].set_text("Noise")
+            plt.gca().add_artist(legend)
+        else:
+            density = density_image(embedding_results, extent, raster_bins)
+            plt.imshow(
+                np.ma.masked_equal(density, 0),
+                origin="lower",
+                extent=extent,
+                aspect="auto",
+                interpolation="nearest",
+                norm=LogNorm(),
+            )
+            plt.colorbar(label="Points per pixel")
+    elif labels is not None:
         scatter = plt.scatter(
             embedding_results[:, 0],
             embedding_results[:, 1],
@@ -0,0 +1,137 @@
+import numpy as np
+
+RASTER_THRESHOLD = 500_000
+RENDER_MODES = ("auto", "scatter", "raster")
+
+
+def use_raster(n_points, render="auto", threshold=RASTER_THRESHOLD):
+    """
+    Decide whether a plot is drawn as a raster image or as a scatter plot.
+
+    Parameters:
+    - n_points: Number of points to draw.
+    - render: "scatter", "raster", or "auto" to rasterize from threshold points on.
+    - threshold: Number of points from which "auto" rasterizes.
+
+    Returns:
+    - True for a raster image.
+    """
+    if render not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode: {render}.")
+    if render == "auto":
+        return n_points >= threshold
+    return render == "raster"
+
+
+def raster_extent(points, padding=0.01):
+    """
+    Bounding box of the points, padded so no point falls on the outer edge.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - padding: Fraction of the box size added on every side.
+
+    Returns:
+    - (x_min, x_max, y_min, y_max), as used by imshow's extent.
+    """
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    margin = np.maximum(upper - lower, 1e-12) * padding
+    return (
+        lower[0] - margin[0],
+        upper[0] + margin[0],
+        lower[1] - margin[1],
+        upper[1] + margin[1],
+    )
+
+
+def pixel_indices(points, extent, bins):
+    """
+    Flat pixel index of every point on a raster grid.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - extent: (x_min, x_max, y_min, y_max) of the grid.
+    - bins: Number of pixels per axis (int) or (n_x, n_y).
+
+    Returns:
+    - Integer numpy array of pixel indices, row-major over (y, x), so the counts
+      reshape to an image of shape (n_y, n_x).
+    """
+    n_x, n_y = np.broadcast_to(bins, 2)
+    columns = (points[:, 0] - extent[0]) / (extent[1] - extent[0]) * n_x
+    rows = (points[:, 1] - extent[2]) / (extent[3] - extent[2]) * n_y
+    columns = np.clip(columns.astype(np.int64), 0, n_x - 1)
+    rows = np.clip(rows.astype(np.int64), 0, n_y - 1)
+    return rows * n_x + columns
+
+
+def density_image(points, extent, bins=512):
+    """
+    Number of points per pixel.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - extent: (x_min, x_max, y_min, y_max) of the grid.
+    - bins: Number of pixels per axis (int) or (n_x, n_y).
+
+    Returns:
+    - Integer numpy array of shape (n_y, n_x).
+    """
+    n_x, n_y = np.broadcast_to(bins, 2)
+    counts = np.bincount(pixel_indices(points, extent, bins), minlength=n_x * n_y)
+    return counts.reshape(n_y, n_x)
+
+
+def label_image(points, labels, extent, bins=512):
+    """
+    Most frequent label of the points in every pixel.
+
+    Parameters:
+    - points: Numpy array of (x, y) coordinates.
+    - labels: Numpy array with the label of every point.
+    - extent: (x_min, x_max, y_min, y_max) of the grid.
+    - bins: Number of pixels per axis (int) or (n_x, n_y).
+
+    Returns:
+    - Masked numpy array of shape (n_y, n_x) with the majority label of every
+      pixel (ties go to the smallest label); empty pixels are masked.
+    """
+    n_x, n_y = np.broadcast_to(bins, 2)
+    values, codes = np.unique(labels, return_inverse=True)
+    n_labels = values.shape[0]
+    # Count only the (pixel, label) pairs that occur, sorted by pixel then label.
+    pairs, counts = np.unique(
+        pixel_indices(points, extent, bins) * n_labels + codes.ravel(),
+        return_counts=True,
+    )
+    pixels, pair_codes = np.divmod(pairs, n_labels)
+    # Most frequent label first within each pixel; the stable sort keeps the
+    # smallest label first among ties.
+    order = np.lexsort((-counts, pixels))
+    first = order[np.r_[True, pixels[order][1:] != pixels[order][:-1]]]
+
+    image = np.full(n_y * n_x, values[0] if n_labels else 0, dtype=values.dtype)
+    mask = np.ones(n_y * n_x, dtype=bool)
+    image[pixels[first]] = values[pair_codes[first]]
+    mask[pixels[first]] = False
+    return np.ma.masked_array(image.reshape(n_y, n_x), mask=mask.reshape(n_y, n_x))
+
+
+def fraction_image(foreground_points, background_points, extent, bins=512):
+    """
+    Fraction of the background points of every pixel that are foreground points.
+
+    Parameters:
+    - foreground_points: Numpy array of (x, y) coordinates of the foreground.
+    - background_points: Numpy array of (x, y) coordinates of the background.
+    - extent: (x_min, x_max, y_min, y_max) of the grid.
+    - bins: Number of pixels per axis (int) or (n_x, n_y).
+
+    Returns:
+    - Masked numpy array of shape (n_y, n_x) with fractions in [0, 1]; pixels
+      without background points are masked.
+    """
+    foreground = density_image(foreground_points, extent, bins)
+    background = density_image(background_points, extent, bins)
+    fractions = np.minimum(foreground / np.maximum(background, 1), 1.0)
+    return np.ma.masked_array(fractions, mask=background == 0)
@@ -1,7 +1,217 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import LinearSegmentedColormap
+from biorsp.utils.profiling import profiled
+from biorsp.visualization.raster import fraction_image, raster_extent, use_raster
 
 
+def rsp_angles(n_angles, angle_range=np.array([0, 2 * np.pi])):
+    """
+    Angle grid of a differences array, as used by the RSP analysis.
+
+    Parameters:
+    - n_angles: Number of angles (the resolution of the analysis).
+    - angle_range: Angular range of the analysis.
+
+    Returns:
+    - Numpy array of n_angles angles.
+    """
+    return np.linspace(angle_range[0], angle_range[1], n_angles, endpoint=False)
+
+
+def foreground_background_raster(n_foreground, n_background, render="auto"):
+    """
+    Decide whether a foreground/background plot is drawn as a raster image.
+
+    Parameters:
+    - n_foreground: Number of foreground points.
+    - n_background: Number of background points.
+    - render: "scatter", "raster", or "auto" (see use_raster).
+
+    Returns:
+    - True for a raster image.
+    """
+    return use_raster(n_foreground + n_background, render)
+
+
+def check_angles(angles, differences):
+    """
+    Check that a differences array has one value per angle.
+
+    Parameters:
+    - angles: Numpy array of angles.
+    - differences: Numpy array of differences.
+
+    Returns:
+    - The angles as a numpy array.
+    """
+    angles = np.asarray(angles)
+    if angles.shape != np.shape(differences):
+        raise ValueError(
+            f"Got {angles.shape[0]} angles for {len(differences)} differences."
+        )
+    return angles
+
+
+class ForegroundBackgroundPlot:
+    """
+    Foreground and background points on one figure, updated in place per gene.
+
+    The background is drawn once; each update only replaces the foreground
+    points (or, for a raster image, the pixel values) and the title.
+    """
+
+    def __init__(
+        self,
+        figure,
+        background_points,
+        raster=False,
+        foreground_color="red",
+        background_color="grey",
+        point_size=1,
+        xlabel="x",
+        ylabel="y",
+        raster_bins=512,
+    ):
+        """
+        Parameters:
+        - figure: Matplotlib Figure to draw on.
+        - background_points: Numpy array of (x, y) coordinates for the background points.
+        - raster: If True, draw the foreground fraction of each pixel as one image.
+        - Other parameters are those of plot_foreground_background.
+        """
+        self.ax = figure.add_subplot()
+        self.background_points = background_points
+        self.raster = raster
+        self.raster_bins = raster_bins
+
+        if raster:
+            self.extent = raster_extent(background_points)
+            self.image = self.ax.imshow(
+                np.ma.masked_all((raster_bins, raster_bins)),
+                origin="lower",
+                extent=self.extent,
+                aspect="auto",
+                interpolation="nearest",
+                cmap=LinearSegmentedColormap.from_list(
+                    "foreground", [background_color, foreground_color]
+                ),
+                vmin=0,
+                vmax=1,
+            )
+            figure.colorbar(self.image, ax=self.ax, label="Foreground fraction")
+        else:
+            self.ax.scatter(
+                background_points[:, 0],
+                background_points[:, 1],
+                color=background_color,
+                s=point_size,
+                label="Background",
+                alpha=0.5,
+            )
+            self.foreground = self.ax.scatter(
+                np.empty(0),
+                np.empty(0),
+                color=foreground_color,
+                s=point_size,
+                label="Foreground",
+                alpha=0.8,
+            )
+            self.ax.legend()
+
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+
+    def update(self, foreground_points, title=None):
+        """
+        Show the foreground points of one gene.
+
+        Parameters:
+        - foreground_points: Numpy array of (x, y) coordinates for the foreground points.
+        - title: Optional. Title of the plot.
+        """
+        if self.raster:
+            self.image.set_data(
+                fraction_image(
+                    foreground_points,
+                    self.background_points,
+                    self.extent,
+                    self.raster_bins,
+                )
+            )
+        else:
+            self.foreground.set_offsets(foreground_points)
+        self.ax.set_title(title or "")
+
+
+class RSPPolarPlot:
+    """
+    Polar plot of RSP differences, updated in place per gene.
+    """
+
+    def __init__(self, figure, angles):
+        """
+        Parameters:
+        - figure: Matplotlib Figure to draw on.
+        - angles: Numpy array of the default angles of the differences (see
+          rsp_angles).
+        """
+        self.ax = figure.add_subplot(polar=True)
+        self.angles = np.asarray(angles)
+        (self.line,) = self.ax.plot(
+            self.angles, np.zeros_like(self.angles), color="red"
+        )
+        self.ax.set_ylim(0, 1)
+
+    def update(self, differences, angles=None):
+        """
+        Parameters:
+        - differences: The differences array calculated during RSP analysis.
+        - angles: Optional. Angles of the differences, e.g. the non-uniform
+          angles of an adaptive analysis (default: the angles of the plot).
+        """
+        angles = check_angles(self.angles if angles is None else angles, differences)
+        self.line.set_data(angles, differences)
+
+
+class RSPComparisonPlot:
+    """
+    RSP differences against the uniform radius of the same area, updated in
+    place per gene.
+    """
+
+    def __init__(self, figure, angles):
+        """
+        Parameters:
+        - figure: Matplotlib Figure to draw on.
+        - angles: Numpy array of the default angles of the differences (see
+          rsp_angles).
+        """
+        self.ax = figure.add_subplot(polar=True)
+        self.angles = np.asarray(angles)
+        zeros = np.zeros_like(self.angles)
+        (self.radius_line,) = self.ax.plot(self.angles, zeros, color="black")
+        (self.differences_line,) = self.ax.plot(self.angles, zeros, color="red")
+        (self.overlap,) = self.ax.fill(self.angles, zeros, color="gray", alpha=0.5)
+
+    def update(self, rsp_area, differences, angles=None):
+        """
+        Parameters:
+        - rsp_area: The RSP area calculated.
+        - differences: The differences array calculated during RSP analysis.
+        - angles: Optional. Angles of the differences, e.g. the non-uniform
+          angles of an adaptive analysis (default: the angles of the plot).
+        """
+        angles = check_angles(self.angles if angles is None else angles, differences)
+        radius = np.sqrt(rsp_area / np.pi)
+        self.radius_line.set_data(angles, np.full(angles.shape[0], radius))
+        self.differences_line.set_data(angles, differences)
+        self.overlap.set_xy(np.column_stack([angles, np.minimum(radius, differences)]))
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+
+@profiled("visualization.plot_foreground_background")
 def plot_foreground_background(
     foreground_points,
     background_points,
@@ -13,6 +223,8 @@ def plot_foreground_background(
     title=None,
     xlabel="x",
     ylabel="y",
+    render="auto",
+    raster_bins=512,
 ):
     """
     Plot foreground and background points.
@@ -28,47 +240,51 @@ def plot_foreground_background(
     - title: Optional. Title of the plot.
     - xlabel: Label for the x-axis (default='x').
     - ylabel: Label for the y-axis (default='y').
+    - render: "scatter" to draw every point, "raster" to draw one image of
+      raster_bins x raster_bins pixels coloured by the fraction of background
+      points that are foreground, or "auto" to rasterize from RASTER_THRESHOLD
+      points on.
+    - raster_bins: Number of pixels per axis of the raster image.
 
     Returns:
     - None
     """
-    plt.figure(figsize=(8, 6))
-    plt.scatter(
-        background_points[:, 0],
-        background_points[:, 1],
-        color=background_color,
-        s=point_size,
-        label="Background",
-        alpha=0.5,
-    )
-    plt.scatter(
-        foreground_points[:, 0],
-        foreground_points[:, 1],
-        color=foreground_color,
-        s=point_size,
-        label="Foreground",
-        alpha=0.8,
+    figure = plt.figure(figsize=(8, 6))
+    plot = ForegroundBackgroundPlot(
+        figure,
+        background_points,
+        raster=foreground_background_raster(
+            foreground_points.shape[0], background_points.shape[0], render
+        ),
+        foreground_color=foreground_color,
+        background_color=background_color,
+        point_size=point_size,
+        xlabel=xlabel,
+        ylabel=ylabel,
+        raster_bins=raster_bins,
     )
+    plot.update(foreground_points, title)
 
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    if title:
-        plt.title(title)
-    plt.legend()
-
-    plt.tight_layout()
+    figure.tight_layout()
 
     if save_path:
-        plt.savefig(save_path)
+        figure.savefig(save_path)
         print(f"Plot saved at {save_path}")
 
     if show_plot:
         plt.show()
 
-    plt.clf()
+    plt.close(figure)
 
 
-def plot_rsp_polar(differences, save_path=None, show_plot=True):
+@profiled("visualization.plot_rsp_polar")
+def plot_rsp_polar(
+    differences,
+    save_path=None,
+    show_plot=True,
+    angle_range=np.array([0, 2 * np.pi]),
+    angles=None,
+):
     """
     Plot the RSP in polar coordinates.
 
@@ -76,24 +292,39 @@ def plot_rsp_polar(differences, save_path=None, show_plot=True):
     - differences: The differences array calculated during RSP analysis.
     - save_path: Optional. If provided, saves the plot to the specified path.
     - show_plot: If True, displays the plot on screen.
+    - angle_range: Angular range of the analysis; without angles, the differences
+      are taken on the analysis' uniform grid over it (see rsp_angles).
+    - angles: Optional. Angles of the differences as returned by the analysis,
+      e.g. the non-uniform angles of perform_adaptive_rsp_analysis.
     """
-    plt.figure()
-    plt.subplot(polar=True)
-    plt.plot(np.linspace(0, 2 * np.pi, 1000), differences, color="red")
-    plt.ylim(0, 1)
+    if angles is None:
+        angles = rsp_angles(len(differences), angle_range)
+    # Validate before creating the figure, so that no pyplot figure is left open.
+    angles = check_angles(angles, differences)
+    figure = plt.figure()
+    plot = RSPPolarPlot(figure, angles)
+    plot.update(differences)
 
-    plt.tight_layout()
+    figure.tight_layout()
 
     if save_path:
-        plt.savefig(save_path)
+        figure.savefig(save_path)
 
     if show_plot:
         plt.show()
 
-    plt.clf()
+    plt.close(figure)
 
 
-def plot_rsp_comparison(rsp_area, differences, save_path=None, show_plot=True):
+@profiled("visualization.plot_rsp_comparison")
+def plot_rsp_comparison(
+    rsp_area,
+    differences,
+    save_path=None,
+    show_plot=True,
+    angle_range=np.array([0, 2 * np.pi]),
+    angles=None,
+):
     """
     Plot the RSP comparison between the uniform radius and the RSP differences.
 
@@ -102,22 +333,23 @@ def plot_rsp_comparison(rsp_area, differences, save_path=None, show_plot=True):
     - differences: The differences array calculated during RSP analysis.
     - save_path: Optional. If provided, saves the plot to the specified path.
     - show_plot: If True, displays the plot on screen.
+    - angle_range: Angular range of the analysis; without angles, the differences
+      are taken on the analysis' uniform grid over it (see rsp_angles).
+    - angles: Optional. Angles of the differences as returned by the analysis,
+      e.g. the non-uniform angles of perform_adaptive_rsp_analysis.
     """
-    radius = np.sqrt(rsp_area / np.pi)
-
-    plt.figure()
-    plt.subplot(polar=True)
-
-    plt.plot(np.linspace(0, 2 * np.pi, 1000), np.ones(1000) * radius, color="black")
-    plt.plot(np.linspace(0, 2 * np.pi, 1000), differences, color="red")
-
-    overlap = np.minimum(radius, differences)
-    plt.fill(np.linspace(0, 2 * np.pi, 1000), overlap, color="gray", alpha=0.5)
+    if angles is None:
+        angles = rsp_angles(len(differences), angle_range)
+    # Validate before creating the figure, so that no pyplot figure is left open.
+    angles = check_angles(angles, differences)
+    figure = plt.figure()
+    plot = RSPComparisonPlot(figure, angles)
+    plot.update(rsp_area, differences)
 
     if save_path:
-        plt.savefig(save_path)
+        figure.savefig(save_path)
 
     if show_plot:
         plt.show()
 
-    plt.clf()
+    plt.close(figure)
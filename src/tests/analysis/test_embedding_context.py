@@ -0,0 +1,64 @@
+import numpy as np
+from biorsp.analysis.embedding_context import EmbeddingContext
+from biorsp.analysis.polar_conversion import convert_to_polar
+from biorsp.analysis.rsp_analysis import (
+    perform_rsp_analysis,
+    perform_context_rsp_analysis,
+)
+
+
+def test_embedding_context():
+    """
+    Test the EmbeddingContext polar cache and index-based RSP analysis.
+    - Verifies cached polar subsets match convert_to_polar on the same points.
+    - Verifies the LRU cache stays bounded.
+    - Verifies index-based analysis matches perform_rsp_analysis on points.
+    """
+    rng = np.random.default_rng(0)
+    embedding = rng.normal(size=(2000, 2))
+    labels = rng.integers(0, 3, size=2000)
+    context = EmbeddingContext(embedding, labels, max_cached=2)
+
+    background_indices = context.cluster_indices([1, 2])
+    foreground_indices = background_indices[embedding[background_indices, 0] > 0.2]
+    vantage_point = context.centroid(background_indices)
+
+    r, theta = context.polar_subset(foreground_indices, vantage_point)
+    expected_r, expected_theta = convert_to_polar(
+        embedding[foreground_indices], vantage_point
+    )
+    assert np.array_equal(theta, expected_theta)
+    assert np.allclose(np.sort(r), np.sort(expected_r))
+
+    transform = context.polar(vantage_point)
+    assert np.array_equal(transform.order[transform.rank], np.arange(2000))
+    assert context.polar(vantage_point) is transform
+
+    context.polar(np.zeros(2))
+    context.polar(np.ones(2))
+    assert len(context._polar_cache) == 2
+    assert context.polar(vantage_point) is not transform
+
+    for scanning_window in [np.pi / 2, 1.0]:
+        result = perform_context_rsp_analysis(
+            context,
+            foreground_indices,
+            background_indices,
+            scanning_window=scanning_window,
+            resolution=150,
+        )
+        expected = perform_rsp_analysis(
+            embedding[foreground_indices],
+            embedding[background_indices],
+            vantage_point,
+            scanning_window=scanning_window,
+            resolution=150,
+        )
+        assert np.allclose(result[3], expected[3])
+        assert np.allclose(result[:3], expected[:3])
+
+    print("All embedding context tests passed successfully.")
+
+
+if __name__ == "__main__":
+    test_embedding_context()
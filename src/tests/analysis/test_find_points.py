@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from biorsp.analysis.find_points import find_foreground_background_points
+from biorsp.data.expression import ExpressionMatrix
+
+
+def reference_points(
+    gene_name, dge_matrix, tsne_results, dbscan_df, threshold, clusters
+):
+    """
+    Barcode-based reference implementation of find_foreground_background_points.
+    """
+    dbscan_clusters = dbscan_df["cluster"].values
+    gene_expression = dge_matrix.loc[gene_name]
+    cell_barcodes = dge_matrix.columns
+
+    if clusters is not None:
+        selected = [i for i, c in enumerate(dbscan_clusters) if c in clusters]
+        tsne_results = tsne_results[selected]
+        selected_barcodes = [cell_barcodes[i] for i in selected]
+        gene_expression = gene_expression[selected_barcodes]
+        cell_index_map = {b: i for i, b in enumerate(selected_barcodes)}
+    else:
+        cell_index_map = {b: i for i, b in enumerate(cell_barcodes)}
+
+    foreground_barcodes = gene_expression[gene_expression > threshold].index
+    foreground_points = np.array(
+        [tsne_results[cell_index_map[b]] for b in foreground_barcodes]
+    ).reshape(-1, 2)
+    return foreground_points, np.array(tsne_results)
+
+
+def test_find_points():
+    """
+    Test foreground/background extraction.
+    - Generates a random expression matrix, embedding and cluster labels.
+    - Verifies dense DataFrame and ExpressionMatrix inputs match the barcode-based reference.
+    """
+    rng = np.random.default_rng(0)
+    num_genes, num_cells = 20, 500
+    values = rng.poisson(0.8, size=(num_genes, num_cells)).astype(float)
+    genes = [f"Gene{i}" for i in range(num_genes)]
+    barcodes = [f"Cell{i}" for i in range(num_cells)]
+    dge_matrix = pd.DataFrame(values, index=genes, columns=barcodes)
+    expression = ExpressionMatrix.from_dataframe(dge_matrix)
+    tsne_results = rng.normal(size=(num_cells, 2))
+    dbscan_df = pd.DataFrame(rng.integers(0, 4, num_cells), columns=["cluster"])
+
+    for gene_name in ["Gene0", "Gene7"]:
+        for threshold in [0, 1, 2]:
+            for clusters in [None, [1], [0, 3]]:
+                expected = reference_points(
+                    gene_name, dge_matrix, tsne_results, dbscan_df, threshold, clusters
+                )
+                for data in [dge_matrix, expression]:
+                    foreground_points, background_points = (
+                        find_foreground_background_points(
+                            gene_name,
+                            data,
+                            tsne_results,
+                            dbscan_df,
+                            threshold=threshold,
+                            selected_clusters=clusters,
+                        )
+                    )
+                    assert np.array_equal(foreground_points, expected[0])
+                    assert np.array_equal(background_points, expected[1])
+
+    try:
+        find_foreground_background_points(
+            "Missing", expression, tsne_results, dbscan_df
+        )
+        assert False, "A missing gene should raise a ValueError."
+    except ValueError as e:
+        print(f"Expected ValueError: {e}")
+
+    print("All find points tests passed successfully.")
+
+
+if __name__ == "__main__":
+    test_find_points()
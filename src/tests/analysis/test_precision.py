@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from biorsp.analysis.polar_conversion import convert_to_polar
+from biorsp.analysis.precision import get_precision
+from biorsp.analysis.rsp_analysis import (
+    perform_batch_rsp_analysis,
+    perform_rsp_analysis,
+)
+
+
+def test_single_precision():
+    """
+    Test the compact single precision mode.
+    - Verifies polar conversion returns float32 angles and int32 indices.
+    - Verifies single and batch RSP analysis stay within the documented bounds
+      of the double precision results.
+    """
+    rng = np.random.default_rng(0)
+    background_points = rng.normal(size=(20000, 2)) * 10
+    foreground_points = background_points[background_points[:, 0] > 2]
+    vantage_point = background_points.mean(axis=0)
+
+    r, theta, order = convert_to_polar(
+        background_points, vantage_point, return_order=True, precision="single"
+    )
+    assert r.dtype == theta.dtype == np.float32
+    assert order.dtype == np.int32
+
+    scanning_window = np.pi / 2
+    double = perform_rsp_analysis(
+        foreground_points, background_points, vantage_point, scanning_window
+    )
+    single = perform_rsp_analysis(
+        foreground_points,
+        background_points,
+        vantage_point,
+        scanning_window,
+        precision="single",
+    )
+    print(f"RSP area relative error: {abs(single[0] - double[0]) / double[0]:.2e}")
+
+    assert single[3].dtype == np.float32
+    # A handful of cells near bin edges, each worth scanning_window / n.
+    assert np.allclose(
+        single[3], double[3], rtol=0, atol=4 * scanning_window / len(foreground_points)
+    )
+    assert np.isclose(single[0], double[0], rtol=1e-4)
+
+    masks = rng.random((5, background_points.shape[0])) < 0.3
+    double_batch = perform_batch_rsp_analysis(masks, background_points, vantage_point)
+    single_batch = perform_batch_rsp_analysis(
+        masks, background_points, vantage_point, precision="single"
+    )
+    assert np.allclose(single_batch[0], double_batch[0], rtol=1e-4)
+
+    with pytest.raises(ValueError):
+        get_precision("half")
+
+    print("All precision tests passed successfully.")
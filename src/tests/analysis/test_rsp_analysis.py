@@ -0,0 +1,178 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from biorsp.analysis.rsp_analysis import (
+    perform_rsp_analysis,
+    perform_multiscale_rsp_analysis,
+    perform_batch_rsp_analysis,
+    perform_adaptive_rsp_analysis,
+)
+from biorsp.analysis.rsp_calculations import calculate_rsp_area
+
+
+def generate_points(num_points=4000, seed=0):
+    """
+    Generate background points and a foreground biased towards positive x.
+    """
+    rng = np.random.default_rng(seed)
+    background_points = rng.normal(size=(num_points, 2))
+    foreground_points = background_points[background_points[:, 0] > 0.5]
+    return foreground_points, background_points
+
+
+def test_multiscale_rsp_analysis():
+    """
+    Test the multi-window RSP analysis.
+    - Runs one multiscale analysis over several window sizes.
+    - Verifies every row matches a separate perform_rsp_analysis call.
+    """
+    foreground_points, background_points = generate_points()
+    vantage_point = background_points.mean(axis=0)
+    scanning_windows = [np.pi / 8, np.pi / 4, np.pi / 2, np.pi, 1.0]
+    resolution = 200
+
+    rsp_areas, rmsds, deviation_scores, differences = perform_multiscale_rsp_analysis(
+        foreground_points,
+        background_points,
+        vantage_point,
+        scanning_windows=scanning_windows,
+        resolution=resolution,
+    )
+    print(f"Multiscale differences shape: {differences.shape}")
+
+    assert differences.shape == (len(scanning_windows), resolution)
+    assert rsp_areas.shape == rmsds.shape == deviation_scores.shape
+
+    for i, scanning_window in enumerate(scanning_windows):
+        rsp_area, rmsd, deviation_score, single = perform_rsp_analysis(
+            foreground_points,
+            background_points,
+            vantage_point,
+            scanning_window=scanning_window,
+            resolution=resolution,
+        )
+        assert np.allclose(differences[i], single)
+        assert np.isclose(rsp_areas[i], rsp_area)
+        assert np.isclose(rmsds[i], rmsd)
+        assert np.isclose(deviation_scores[i], deviation_score)
+
+    print("All multiscale RSP analysis tests passed successfully.")
+
+
+def test_batch_rsp_analysis():
+    """
+    Test the batched multi-gene RSP analysis.
+    - Builds a gene x cell foreground mask matrix over a shared background.
+    - Verifies every gene matches a separate perform_rsp_analysis call,
+      for both dense and sparse masks.
+    """
+    _, background_points = generate_points(num_points=3000, seed=1)
+    rng = np.random.default_rng(2)
+    vantage_point = background_points.mean(axis=0)
+    resolution = 120
+
+    foreground_masks = np.vstack(
+        [
+            background_points[:, 0] > 0.5,
+            background_points[:, 1] < -0.2,
+            rng.random(background_points.shape[0]) < 0.1,
+            np.zeros(background_points.shape[0], dtype=bool),
+            np.ones(background_points.shape[0], dtype=bool),
+        ]
+    )
+
+    for scanning_window in [np.pi / 2, 1.0]:
+        rsp_areas, rmsds, deviation_scores, differences = perform_batch_rsp_analysis(
+            foreground_masks,
+            background_points,
+            vantage_point,
+            scanning_window=scanning_window,
+            resolution=resolution,
+            chunk_size=2,
+        )
+        assert differences.shape == (foreground_masks.shape[0], resolution)
+
+        for i, mask in enumerate(foreground_masks):
+            rsp_area, rmsd, deviation_score, single = perform_rsp_analysis(
+                background_points[mask],
+                background_points,
+                vantage_point,
+                scanning_window=scanning_window,
+                resolution=resolution,
+            )
+            assert np.allclose(differences[i], single)
+            assert np.isclose(rsp_areas[i], rsp_area)
+            assert np.isclose(rmsds[i], rmsd)
+            assert np.isclose(deviation_scores[i], deviation_score)
+
+        sparse_results = perform_batch_rsp_analysis(
+            csr_matrix(foreground_masks),
+            background_points,
+            vantage_point,
+            scanning_window=scanning_window,
+            resolution=resolution,
+        )
+        assert np.allclose(sparse_results[3], differences)
+
+    print("All batch RSP analysis tests passed successfully.")
+
+
+def test_adaptive_rsp_analysis():
+    """
+    Test the adaptive angle grid and the separate CDF bin count.
+    - Verifies a zero tolerance refines to the uniform grid at max_resolution.
+    - Verifies a positive tolerance evaluates fewer angles with a close RSP area.
+    - Verifies non-uniform integration reduces to the uniform formula on a uniform grid.
+    """
+    foreground_points, background_points = generate_points()
+    vantage_point = background_points.mean(axis=0)
+    n_bins = 300
+
+    uniform = perform_rsp_analysis(
+        foreground_points,
+        background_points,
+        vantage_point,
+        resolution=256,
+        n_bins=n_bins,
+    )
+    assert uniform[3].shape == (256,)
+
+    refined = perform_adaptive_rsp_analysis(
+        foreground_points,
+        background_points,
+        vantage_point,
+        n_bins=n_bins,
+        initial_resolution=16,
+        max_resolution=256,
+        tolerance=0,
+    )
+    assert np.allclose(refined[4], np.linspace(0, 2 * np.pi, 256, endpoint=False))
+    for expected, result in zip(uniform, refined):
+        assert np.allclose(expected, result)
+
+    adaptive = perform_adaptive_rsp_analysis(
+        foreground_points,
+        background_points,
+        vantage_point,
+        n_bins=n_bins,
+        initial_resolution=16,
+        max_resolution=256,
+        tolerance=0.02,
+    )
+    print(f"Adaptive angles: {len(adaptive[4])}")
+    assert len(adaptive[4]) < 256
+    assert np.isclose(adaptive[0], uniform[0], rtol=1e-2)
+    assert np.isclose(adaptive[2], uniform[2], rtol=1e-2)
+
+    angle_range = np.array([0, 2 * np.pi])
+    assert np.isclose(
+        calculate_rsp_area(uniform[3], angle_range, 256, angles=refined[4]),
+        uniform[0],
+    )
+
+    print("All adaptive RSP analysis tests passed successfully.")
+
+
+if __name__ == "__main__":
+    test_multiscale_rsp_analysis()
+    test_batch_rsp_analysis()
+    test_adaptive_rsp_analysis()
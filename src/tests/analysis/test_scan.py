@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import pytest
+from biorsp.analysis.find_points import find_foreground_background_points
+from biorsp.analysis.rsp_analysis import perform_rsp_analysis
+from biorsp.analysis.scan import (
+    ScanWriter,
+    iter_saved_differences,
+    run_gene_scan,
+    stream_gene_scan,
+)
+
+
+def generate_data(num_genes=40, num_cells=1500, seed=0):
+    """
+    Generate a sparse expression matrix, an embedding and cluster labels.
+    """
+    rng = np.random.default_rng(seed)
+    tsne_results = rng.normal(size=(num_cells, 2))
+    expression = rng.poisson(0.4, size=(num_genes, num_cells))
+    expression[:5, tsne_results[:, 0] > 0.5] += 3
+    dge_matrix = pd.DataFrame(
+        expression,
+        index=[f"Gene{i}" for i in range(num_genes)],
+        columns=[f"Cell{j}" for j in range(num_cells)],
+    )
+    dbscan_df = pd.DataFrame({"cluster": rng.integers(0, 3, num_cells)})
+    return dge_matrix, tsne_results, dbscan_df
+
+
+def reference_scan(dge_matrix, tsne_results, dbscan_df, selected_clusters, resolution):
+    """
+    Gene-by-gene loop with the single-gene functions.
+    """
+    rows = []
+    for gene in dge_matrix.index:
+        foreground_points, background_points = find_foreground_background_points(
+            gene, dge_matrix, tsne_results, dbscan_df, 0, selected_clusters
+        )
+        if len(foreground_points) / len(background_points) < 0.05:
+            continue
+        rsp_area, rmsd, deviation_score, _ = perform_rsp_analysis(
+            foreground_points,
+            background_points,
+            background_points.mean(axis=0),
+            resolution=resolution,
+        )
+        rows.append([gene, rsp_area, rmsd, deviation_score])
+    return pd.DataFrame(rows, columns=["Gene", "RSP_Area", "RMSD", "Deviation_Score"])
+
+
+def test_gene_scan():
+    """
+    Test the genome-wide scan.
+    - Compares a serial scan against a gene-by-gene reference loop.
+    - Verifies a parallel scan returns the same table as the serial scan.
+    """
+    dge_matrix, tsne_results, dbscan_df = generate_data()
+    selected_clusters = [1, 2]
+    resolution = 180
+
+    expected = reference_scan(
+        dge_matrix, tsne_results, dbscan_df, selected_clusters, resolution
+    )
+    serial = run_gene_scan(
+        dge_matrix,
+        tsne_results,
+        dbscan_df,
+        threshold=0,
+        selected_clusters=selected_clusters,
+        resolution=resolution,
+        chunk_size=7,
+    )
+    print(f"Scanned genes: {len(serial)}")
+
+    assert list(serial["Gene"]) == list(expected["Gene"])
+    for column in ["RSP_Area", "RMSD", "Deviation_Score"]:
+        assert np.allclose(serial[column], expected[column])
+
+    parallel = run_gene_scan(
+        dge_matrix,
+        tsne_results,
+        dbscan_df,
+        threshold=0,
+        selected_clusters=selected_clusters,
+        resolution=resolution,
+        n_jobs=2,
+        chunk_size=7,
+    )
+    pd.testing.assert_frame_equal(parallel, serial)
+
+    print("All gene scan tests passed successfully.")
+
+
+def test_stream_gene_scan_resume(tmp_path, monkeypatch):
+    """
+    Test the streamed gene scan with checkpoints.
+    - Interrupts a scan after two chunks and leaves a partial row in the CSV.
+    - Verifies the resumed scan matches run_gene_scan and saves every differences vector.
+    - Verifies resuming with different parameters raises a ValueError.
+    """
+    dge_matrix, tsne_results, dbscan_df = generate_data()
+    scan_kwargs = dict(threshold=0, resolution=120, chunk_size=6)
+    expected = run_gene_scan(dge_matrix, tsne_results, dbscan_df, **scan_kwargs)
+
+    write = ScanWriter.write
+    calls = []
+
+    def interrupted_write(self, *args):
+        if len(calls) == 2:
+            with open(self.results_path, "a") as f:
+                f.write("Gene39,0.1,")
+            raise KeyboardInterrupt
+        calls.append(args)
+        write(self, *args)
+
+    monkeypatch.setattr(ScanWriter, "write", interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        stream_gene_scan(
+            dge_matrix,
+            tsne_results,
+            dbscan_df,
+            tmp_path,
+            save_differences=True,
+            **scan_kwargs,
+        )
+    monkeypatch.setattr(ScanWriter, "write", write)
+
+    results_path = stream_gene_scan(
+        dge_matrix,
+        tsne_results,
+        dbscan_df,
+        tmp_path,
+        save_differences=True,
+        **scan_kwargs,
+    )
+    streamed = pd.read_csv(results_path)
+    print(f"Streamed genes: {len(streamed)}")
+    pd.testing.assert_frame_equal(streamed, expected)
+
+    saved_genes = np.concatenate(
+        [genes for genes, _ in iter_saved_differences(tmp_path)]
+    )
+    assert list(saved_genes) == list(expected["Gene"])
+
+    with pytest.raises(ValueError):
+        stream_gene_scan(
+            dge_matrix, tsne_results, dbscan_df, tmp_path, threshold=1, resolution=120
+        )
+
+    print("All streamed gene scan tests passed successfully.")
+
+
+def test_stream_gene_scan_existing_results(tmp_path):
+    """
+    Test that a streamed scan never truncates results it did not write.
+    - Verifies a non-empty results file without a manifest raises a ValueError
+      and is left unchanged.
+    - Verifies an empty results file is reused.
+    """
+    dge_matrix, tsne_results, dbscan_df = generate_data()
+    results_path = tmp_path / "biorsp_results.csv"
+    results_path.write_text("Gene,RSP_Area\nGene0,0.1\n")
+    with pytest.raises(ValueError):
+        stream_gene_scan(dge_matrix, tsne_results, dbscan_df, tmp_path, resolution=60)
+    assert results_path.read_text() == "Gene,RSP_Area\nGene0,0.1\n"
+
+    results_path.write_text("")
+    stream_gene_scan(dge_matrix, tsne_results, dbscan_df, tmp_path, resolution=60)
+    assert len(pd.read_csv(results_path)) > 0
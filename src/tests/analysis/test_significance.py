@@ -0,0 +1,107 @@
+import numpy as np
+from biorsp.analysis.rsp_analysis import perform_rsp_analysis
+from biorsp.analysis.significance import benjamini_hochberg, permutation_test
+
+
+def test_benjamini_hochberg():
+    """
+    Test the Benjamini-Hochberg adjustment against hand-computed values.
+    """
+    p_values = np.array([0.01, 0.04, 0.03, np.nan, 0.2])
+    q_values = benjamini_hochberg(p_values)
+    assert np.allclose(q_values[[0, 1, 2, 4]], [0.04, 0.16 / 3, 0.16 / 3, 0.2])
+    assert np.isnan(q_values[3])
+
+
+def test_permutation_test():
+    """
+    Test the permutation significance engine.
+    - A spatially biased foreground should be significant; a random one should not.
+    - Observed statistics match perform_rsp_analysis.
+    - Results are reproducible for a fixed seed, and early stopping saves permutations.
+    """
+    rng = np.random.default_rng(0)
+    background_points = rng.normal(size=(1500, 2))
+    vantage_point = background_points.mean(axis=0)
+    foreground_masks = np.vstack(
+        [background_points[:, 0] > 0.8, rng.random(1500) < 0.2]
+    )
+    kwargs = dict(scanning_window=np.pi / 2, resolution=60, n_permutations=200, seed=7)
+
+    observed, p_values, q_values, n_used = permutation_test(
+        foreground_masks,
+        background_points,
+        vantage_point,
+        early_stopping=False,
+        **kwargs,
+    )
+    print(f"p-values: {p_values}, q-values: {q_values}")
+
+    expected = perform_rsp_analysis(
+        background_points[foreground_masks[0]],
+        background_points,
+        vantage_point,
+        scanning_window=np.pi / 2,
+        resolution=60,
+    )
+    assert np.isclose(observed[0], expected[0])
+    assert p_values[0] == 1 / 201
+    assert p_values[1] > 0.05
+    assert np.all(n_used == 200)
+    assert np.all(q_values >= p_values)
+
+    repeated = permutation_test(
+        foreground_masks,
+        background_points,
+        vantage_point,
+        early_stopping=False,
+        **kwargs,
+    )
+    assert np.array_equal(repeated[1], p_values)
+
+    _, single_p, _, single_used = permutation_test(
+        foreground_masks[1],
+        background_points,
+        vantage_point,
+        batch_size=20,
+        **kwargs,
+    )
+    assert single_used < 200
+    assert single_p > 0.05
+
+    print("All permutation test tests passed successfully.")
+
+
+def test_permutation_early_stopping():
+    """
+    Test early stopping across many genes.
+    - Random foregrounds stop early once clearly above alpha.
+    - A strongly biased foreground runs every permutation and stays significant
+      after the Benjamini-Hochberg adjustment.
+    """
+    rng = np.random.default_rng(1)
+    background_points = rng.normal(size=(1000, 2))
+    foreground_masks = np.vstack(
+        [background_points[:, 0] > 0.8] + [rng.random(1000) < 0.2 for _ in range(19)]
+    )
+
+    _, p_values, q_values, n_used = permutation_test(
+        foreground_masks,
+        background_points,
+        background_points.mean(axis=0),
+        scanning_window=np.pi / 2,
+        resolution=60,
+        n_permutations=1000,
+        seed=3,
+    )
+    print(f"Permutations used: {n_used}, q-value of the biased gene: {q_values[0]}")
+    assert n_used[0] == 1000
+    assert p_values[0] == 1 / 1001
+    assert q_values[0] < 0.05
+    assert np.median(n_used[1:]) < 1000
+
+
+if __name__ == "__main__":
+    test_benjamini_hochberg()
+    test_permutation_test()
+    test_permutation_early_stopping()
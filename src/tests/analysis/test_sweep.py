@@ -0,0 +1,181 @@
+import numpy as np
+from biorsp.analysis import cdf_calculations
+from biorsp.analysis.cdf_calculations import compute_cdfs, compute_area
+from biorsp.analysis.polar_conversion import convert_to_polar, in_scanning_range
+from biorsp.analysis.rsp_calculations import calculate_differences
+
+
+def reference_differences(
+    foreground_points,
+    background_points,
+    scanning_window,
+    resolution,
+    vantage_point,
+    angle_range,
+    mode,
+):
+    """
+    Per-angle reference implementation of calculate_differences.
+    """
+    _, fg_theta = convert_to_polar(foreground_points, vantage_point)
+    _, bg_theta = convert_to_polar(background_points, vantage_point)
+
+    differences = np.empty(resolution)
+    angles = np.linspace(angle_range[0], angle_range[1], resolution, endpoint=False)
+
+    for i, angle in enumerate(angles):
+        fg_projection = fg_theta[in_scanning_range(fg_theta, angle, scanning_window)]
+        bg_projection = bg_theta[in_scanning_range(bg_theta, angle, scanning_window)]
+
+        fg_cdf, bg_cdf = compute_cdfs(
+            fg_projection, bg_projection, angle, scanning_window, resolution, mode
+        )
+        differences[i] = compute_area(fg_cdf, bg_cdf, scanning_window)
+
+    return differences
+
+
+def test_sweep_matches_reference():
+    """
+    Test the angular sweep engine behind calculate_differences.
+    - Generates clustered background points and a biased foreground subset.
+    - Verifies the sweep matches the per-angle reference for several windows and modes.
+    """
+    rng = np.random.default_rng(0)
+    background_points = rng.normal(size=(3000, 2))
+    foreground_points = background_points[background_points[:, 0] > 0.3]
+    vantage_point = background_points.mean(axis=0)
+    angle_range = np.array([0, 2 * np.pi])
+    resolution = 180
+
+    for scanning_window in [np.pi / 8, np.pi / 2, 1.0, np.pi, 3 * np.pi / 2]:
+        for mode in ["absolute", "relative"]:
+            expected = reference_differences(
+                foreground_points,
+                background_points,
+                scanning_window,
+                resolution,
+                vantage_point,
+                angle_range,
+                mode,
+            )
+            differences = calculate_differences(
+                foreground_points,
+                background_points,
+                scanning_window,
+                resolution,
+                vantage_point,
+                angle_range,
+                mode,
+            )
+            assert differences.shape == (resolution,)
+            assert np.allclose(
+                differences, expected
+            ), f"Sweep differs from reference for window={scanning_window}, mode={mode}."
+
+    print("All sweep tests passed successfully.")
+
+
+def test_sweep_empty_foreground():
+    """
+    Test the sweep with no foreground points.
+    """
+    rng = np.random.default_rng(1)
+    background_points = rng.uniform(-1, 1, size=(500, 2))
+    foreground_points = np.array([])
+
+    args = (foreground_points, background_points, np.pi / 2, 64, np.zeros(2))
+    differences = calculate_differences(*args, [0, 2 * np.pi], "absolute")
+    expected = reference_differences(*args, [0, 2 * np.pi], "absolute")
+
+    assert np.allclose(differences, expected)
+
+
+def reference_exact_difference(fg_theta, bg_theta, angle, scanning_window, mode):
+    """
+    Exact area between the window CDFs, integrated piece by piece.
+    """
+    start = (angle - scanning_window / 2) % (2 * np.pi)
+    fg = np.sort((fg_theta - start) % (2 * np.pi))
+    bg = np.sort((bg_theta - start) % (2 * np.pi))
+    fg, bg = fg[fg <= scanning_window], bg[bg <= scanning_window]
+
+    fg_scale = 1 / len(fg) if len(fg) else 0.0
+    bg_scale = 1 / len(bg) if len(bg) else 0.0
+    if mode == "absolute" and len(bg):
+        fg_scale = bg_scale
+
+    points = np.concatenate([fg, bg, [scanning_window]])
+    area = 0.0
+    for left, right in zip(np.sort(points)[:-1], np.sort(points)[1:]):
+        gap = fg_scale * np.sum(fg <= left) - bg_scale * np.sum(bg <= left)
+        area += abs(gap) * (right - left)
+    return area
+
+
+def test_exact_differences():
+    """
+    Test the exact CDF difference mode.
+    - Compares against a piecewise reference integral for several windows and modes.
+    - Verifies binned differences converge to the exact ones as n_bins grows.
+    - Verifies cdf_calculations.calculate_differences takes n_bins and precision
+      like rsp_calculations.calculate_differences.
+    """
+    rng = np.random.default_rng(3)
+    background_points = rng.normal(size=(800, 2))
+    foreground_points = background_points[background_points[:, 1] > 0.2]
+    vantage_point = background_points.mean(axis=0)
+    _, fg_theta = convert_to_polar(foreground_points, vantage_point)
+    _, bg_theta = convert_to_polar(background_points, vantage_point)
+    resolution = 48
+    angles = np.linspace(0, 2 * np.pi, resolution, endpoint=False)
+
+    for scanning_window in [np.pi / 8, 1.0, np.pi, 2 * np.pi]:
+        for mode in ["absolute", "relative"]:
+            exact = calculate_differences(
+                foreground_points,
+                background_points,
+                scanning_window,
+                resolution,
+                vantage_point,
+                [0, 2 * np.pi],
+                mode,
+                exact=True,
+            )
+            expected = [
+                reference_exact_difference(
+                    fg_theta, bg_theta, angle, scanning_window, mode
+                )
+                for angle in angles
+            ]
+            assert np.allclose(exact, expected)
+
+    args = (
+        foreground_points,
+        background_points,
+        np.pi,
+        resolution,
+        vantage_point,
+        [0, 2 * np.pi],
+        "absolute",
+    )
+    exact = calculate_differences(*args, exact=True)
+    errors = [
+        np.abs(calculate_differences(*args, n_bins=n_bins) - exact).max()
+        for n_bins in [100, 1000, 10000]
+    ]
+    print(f"Binned vs exact errors: {errors}")
+    assert errors[0] > errors[1] > errors[2]
+    assert errors[2] < 1e-3
+
+    for kwargs in [dict(n_bins=500), dict(precision="single"), dict(exact=True)]:
+        assert np.array_equal(
+            cdf_calculations.calculate_differences(*args, **kwargs),
+            calculate_differences(*args, **kwargs),
+        )
+
+
+if __name__ == "__main__":
+    test_sweep_matches_reference()
+    test_sweep_empty_foreground()
+    test_exact_differences()
@@ -0,0 +1,101 @@
+import numpy as np
+from biorsp.analysis.rsp_analysis import perform_rsp_analysis
+from biorsp.analysis.vantage import (
+    cluster_vantage_points,
+    evaluate_vantage_points,
+    find_best_vantage_points,
+    vantage_grid,
+)
+
+
+def test_vantage_points():
+    """
+    Test multi-vantage-point evaluation and vantage search.
+    - Verifies batched evaluation matches perform_rsp_analysis at every vantage point.
+    - Verifies the chunked path gives the same results as one chunk.
+    - Verifies the search returns the best candidate and refinement never worsens it.
+    """
+    rng = np.random.default_rng(0)
+    background_points = np.vstack(
+        [rng.normal(0, 1, size=(800, 2)), rng.normal(6, 1, size=(800, 2))]
+    )
+    labels = np.repeat([1, 2], 800)
+    foreground_masks = np.vstack([background_points[:, 0] > 5, rng.random(1600) < 0.2])
+
+    grid = vantage_grid(background_points, grid_size=3)
+    assert grid.shape == (9, 2)
+
+    clusters, centroids = cluster_vantage_points(background_points, labels)
+    assert list(clusters) == [1, 2]
+    assert np.allclose(centroids[1], background_points[800:].mean(axis=0))
+    _, medoids = cluster_vantage_points(background_points, labels, method="medoid")
+    assert any(np.array_equal(medoids[0], point) for point in background_points[:800])
+
+    vantage_points = np.vstack([centroids, grid[:2]])
+    rsp_areas, rmsds, deviation_scores, differences = evaluate_vantage_points(
+        foreground_masks,
+        background_points,
+        vantage_points,
+        scanning_window=np.pi / 2,
+        resolution=90,
+        return_differences=True,
+    )
+    assert rsp_areas.shape == (4, 2)
+    assert differences.shape == (4, 2, 90)
+
+    for i, vantage_point in enumerate(vantage_points):
+        for gene, mask in enumerate(foreground_masks):
+            expected = perform_rsp_analysis(
+                background_points[mask],
+                background_points,
+                vantage_point,
+                scanning_window=np.pi / 2,
+                resolution=90,
+            )
+            assert np.allclose(differences[i, gene], expected[3])
+            assert np.isclose(rsp_areas[i, gene], expected[0])
+            assert np.isclose(rmsds[i, gene], expected[1])
+            assert np.isclose(deviation_scores[i, gene], expected[2])
+
+    chunked = evaluate_vantage_points(
+        foreground_masks[0],
+        background_points,
+        vantage_points,
+        scanning_window=np.pi / 2,
+        resolution=90,
+        max_elements=1600,
+    )
+    assert np.allclose(chunked[0], rsp_areas[:, 0])
+
+    best_points, best_scores = find_best_vantage_points(
+        foreground_masks,
+        background_points,
+        candidates=vantage_points,
+        statistic="rmsd",
+        objective="min",
+        scanning_window=np.pi / 2,
+        resolution=90,
+    )
+    assert np.allclose(best_scores, rmsds.min(axis=0))
+    assert np.allclose(best_points, vantage_points[rmsds.argmin(axis=0)])
+
+    refined_point, refined_score = find_best_vantage_points(
+        foreground_masks[0],
+        background_points,
+        candidates="centroids",
+        labels=labels,
+        statistic="rmsd",
+        objective="min",
+        grid_size=3,
+        n_refinements=2,
+        scanning_window=np.pi / 2,
+        resolution=90,
+    )
+    assert refined_point.shape == (2,)
+    assert refined_score <= rmsds[:2, 0].min() + 1e-12
+
+    print("All vantage point tests passed successfully.")
+
+
+if __name__ == "__main__":
+    test_vantage_points()
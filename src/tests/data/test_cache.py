@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from biorsp.analysis.scan import run_gene_scan
+from biorsp.data.cache import (
+    cache_is_valid,
+    open_expression_cache,
+    write_expression_cache,
+)
+from biorsp.preprocessing.loading import load_dge_matrix
+
+
+def is_memory_mapped(array):
+    while array is not None and not isinstance(array, np.memmap):
+        array = array.base
+    return array is not None
+
+
+def test_expression_cache(tmp_path):
+    """
+    Test the biorsp on-disk cache.
+    - Loads a DGE file through the cache and verifies the arrays are memory-mapped.
+    - Verifies the cache is reused while the source is unchanged and rejected once
+      the source is edited or the loading parameters change.
+    - Verifies a parallel gene scan over the mapped matrix matches the DataFrame scan.
+    """
+    rng = np.random.default_rng(0)
+    num_genes, num_cells = 30, 600
+    tsne_results = rng.normal(size=(num_cells, 2))
+    counts = rng.poisson(0.4, size=(num_genes, num_cells))
+    counts[:5, tsne_results[:, 0] > 0.5] += 3
+    dge_matrix = pd.DataFrame(
+        counts.astype(np.float64),
+        index=[f"Gene{i}" for i in range(num_genes)],
+        columns=[f"Cell{j}" for j in range(num_cells)],
+    )
+    dge_file_path = tmp_path / "dge.txt"
+    cache_path = str(tmp_path / "dge.biorsp")
+    dge_matrix.to_csv(dge_file_path, sep="\t")
+
+    expression = load_dge_matrix(dge_file_path, cache_path=cache_path)
+    assert is_memory_mapped(expression.matrix.data)
+    assert is_memory_mapped(expression.cell_matrix().indices)
+    assert np.array_equal(expression.to_dataframe().to_numpy(), dge_matrix.to_numpy())
+    assert list(expression.columns) == list(dge_matrix.columns)
+
+    params = {"threshold_umi": None, "threshold_gene": None, "dtype": "float32"}
+    assert cache_is_valid(cache_path, dge_file_path, params)
+    assert not cache_is_valid(cache_path, dge_file_path, {**params, "threshold_umi": 1})
+
+    # Touching the file without changing it keeps the cache valid.
+    os.utime(dge_file_path, ns=(0, 0))
+    assert cache_is_valid(cache_path, dge_file_path, params)
+
+    dge_matrix.iloc[0, 0] += 1
+    dge_matrix.to_csv(dge_file_path, sep="\t")
+    assert not cache_is_valid(cache_path, dge_file_path, params)
+    with pytest.raises(ValueError):
+        open_expression_cache(cache_path, source=dge_file_path, params=params)
+    reloaded = load_dge_matrix(dge_file_path, cache_path=cache_path)
+    assert reloaded.matrix[0, 0] == dge_matrix.iloc[0, 0]
+    print("Stale cache rebuilt after the source changed.")
+
+    write_expression_cache(dge_matrix, cache_path)
+    expression = open_expression_cache(cache_path)
+    dbscan_df = pd.DataFrame({"cluster": rng.integers(0, 3, num_cells)})
+    scan_kwargs = dict(threshold=0, resolution=120, chunk_size=7)
+    expected = run_gene_scan(dge_matrix, tsne_results, dbscan_df, **scan_kwargs)
+    parallel = run_gene_scan(
+        expression, tsne_results, dbscan_df, n_jobs=2, **scan_kwargs
+    )
+    pd.testing.assert_frame_equal(parallel, expected)
+
+    print("All cache tests passed successfully.")
+
+
+def test_cache_replacement(tmp_path, monkeypatch):
+    """
+    Test how write_expression_cache treats an existing path.
+    - Verifies directories and files that are not biorsp caches are left untouched.
+    - Verifies a failed rewrite keeps the previous cache and leaves no temporary
+      directories behind.
+    """
+    dge_matrix = pd.DataFrame(
+        np.eye(4),
+        index=[f"Gene{i}" for i in range(4)],
+        columns=[f"Cell{j}" for j in range(4)],
+    )
+
+    results = tmp_path / "results"
+    results.mkdir()
+    (results / "notes.txt").write_text("keep me")
+    with pytest.raises(ValueError):
+        write_expression_cache(dge_matrix, str(results))
+    assert (results / "notes.txt").read_text() == "keep me"
+
+    existing_file = tmp_path / "filtered.tsv"
+    existing_file.write_text("keep me")
+    with pytest.raises(ValueError):
+        write_expression_cache(dge_matrix, str(existing_file))
+    assert existing_file.read_text() == "keep me"
+
+    cache_path = str(tmp_path / "dge.biorsp")
+    write_expression_cache(dge_matrix, cache_path)
+    write_expression_cache(dge_matrix * 2, cache_path + os.sep)
+    assert open_expression_cache(cache_path).matrix[0, 0] == 2
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("biorsp.data.cache._write_lines", fail)
+    with pytest.raises(OSError):
+        write_expression_cache(dge_matrix * 3, cache_path)
+    assert open_expression_cache(cache_path).matrix[0, 0] == 2
+    assert sorted(os.listdir(tmp_path)) == ["dge.biorsp", "filtered.tsv", "results"]
+    print("Existing paths are only replaced when they hold a biorsp cache.")
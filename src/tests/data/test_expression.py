@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from biorsp.data.expression import ExpressionMatrix
+
+
+def test_expression_matrix():
+    """
+    Test the sparse expression store.
+    - Builds an ExpressionMatrix from a dense DataFrame.
+    - Verifies per-gene lookups, foreground masks and the round trip to a DataFrame.
+    """
+    dge_matrix = pd.DataFrame(
+        [[0, 3, 0, 1], [2, 0, 0, 5], [0, 0, 0, 0]],
+        index=["A", "B", "C"],
+        columns=["c1", "c2", "c3", "c4"],
+        dtype=float,
+    )
+    expression = ExpressionMatrix.from_dataframe(dge_matrix)
+
+    assert expression.shape == dge_matrix.shape
+    assert list(expression.index) == ["A", "B", "C"]
+    assert list(expression.columns) == ["c1", "c2", "c3", "c4"]
+
+    cell_indices, values = expression.gene_expression("B")
+    assert np.array_equal(cell_indices, [0, 3])
+    assert np.array_equal(values, [2, 5])
+
+    assert np.array_equal(expression.foreground_indices("A", threshold=0), [1, 3])
+    assert np.array_equal(expression.foreground_indices("A", threshold=1), [1])
+    assert np.array_equal(
+        expression.foreground_indices(
+            "B", threshold=0, cell_mask=np.array([0, 1, 1, 1], bool)
+        ),
+        [3],
+    )
+    assert np.array_equal(
+        expression.foreground_indices("C", threshold=-1), [0, 1, 2, 3]
+    )
+    assert np.array_equal(
+        expression.foreground_mask("B", threshold=0), [True, False, False, True]
+    )
+
+    masks = expression.foreground_matrix(
+        ["B", "A"], threshold=0, cell_mask=np.array([1, 1, 0, 1], bool)
+    )
+    assert np.array_equal(masks.toarray(), [[1, 0, 1], [0, 1, 1]])
+
+    assert expression.to_dataframe().equals(dge_matrix)
+
+    print("All expression matrix tests passed successfully.")
+
+
+if __name__ == "__main__":
+    test_expression_matrix()
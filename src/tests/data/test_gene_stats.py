@@ -0,0 +1,100 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+from biorsp.analysis.scan import prepare_scan
+from biorsp.data.cache import open_expression_cache, write_expression_cache
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.data.gene_stats import (
+    compute_gene_stats,
+    foreground_counts,
+    load_gene_stats,
+)
+from biorsp.preprocessing.filtering import filter_genes_by_expression
+
+
+def test_gene_stats(tmp_path, monkeypatch):
+    """
+    Test the per-gene QC statistics table.
+    - Verifies totals, detection and per-threshold and per-cluster counts against
+      dense computations.
+    - Verifies the table is cached next to a memory-mapped matrix, removed when
+      the cache is rewritten, and still returned when the cache is read-only.
+    - Verifies gene filtering and scan preparation drop the same genes as before.
+    """
+    rng = np.random.default_rng(0)
+    num_genes, num_cells = 40, 300
+    counts = rng.poisson(
+        rng.uniform(0.01, 2, size=(num_genes, 1)), (num_genes, num_cells)
+    )
+    dge_matrix = pd.DataFrame(
+        counts.astype(np.float64),
+        index=[f"Gene{i}" for i in range(num_genes)],
+        columns=[f"Cell{j}" for j in range(num_cells)],
+    )
+    clusters = rng.integers(0, 4, num_cells)
+
+    stats = compute_gene_stats(dge_matrix, thresholds=(1, 2), cluster_labels=clusters)
+    print(stats.head())
+    assert np.allclose(stats["total_counts"], counts.sum(axis=1))
+    assert np.array_equal(stats["n_cells"], (counts > 0).sum(axis=1))
+    assert np.array_equal(stats["n_cells_above_2"], (counts > 2).sum(axis=1))
+    for cluster in range(4):
+        in_cluster = counts[:, clusters == cluster]
+        assert np.array_equal(
+            stats[f"n_cells_cluster_{cluster}"], (in_cluster > 0).sum(axis=1)
+        )
+        assert np.array_equal(
+            stats[f"n_cells_above_1_cluster_{cluster}"], (in_cluster > 1).sum(axis=1)
+        )
+    assert np.array_equal(
+        foreground_counts(stats, threshold=1, clusters=[1, 3]),
+        (counts[:, np.isin(clusters, [1, 3])] > 1).sum(axis=1),
+    )
+
+    cache_path = str(tmp_path / "dge.biorsp")
+    write_expression_cache(dge_matrix, cache_path)
+    expression = open_expression_cache(cache_path)
+    cached = load_gene_stats(expression, thresholds=(1, 2), cluster_labels=clusters)
+    assert len(glob.glob(os.path.join(cache_path, "gene_stats_*.npz"))) == 1
+    reloaded = load_gene_stats(expression, thresholds=(1, 2), cluster_labels=clusters)
+    pd.testing.assert_frame_equal(cached, stats)
+    pd.testing.assert_frame_equal(reloaded, stats)
+    write_expression_cache(dge_matrix, cache_path)
+    assert not glob.glob(os.path.join(cache_path, "gene_stats_*.npz"))
+    print("Gene statistics cached next to the expression data.")
+
+    def read_only(*args, **kwargs):
+        raise PermissionError("read-only cache")
+
+    with monkeypatch.context() as patch:
+        patch.setattr("biorsp.data.gene_stats.tempfile.NamedTemporaryFile", read_only)
+        uncached = load_gene_stats(
+            open_expression_cache(cache_path),
+            thresholds=(1, 2),
+            cluster_labels=clusters,
+        )
+    pd.testing.assert_frame_equal(uncached, stats)
+    assert not glob.glob(os.path.join(cache_path, "gene_stats_*"))
+
+    expected = dge_matrix.loc[(dge_matrix > 0).sum(axis=1) > 20]
+    filtered = filter_genes_by_expression(expression, threshold_gene=20)
+    assert list(filtered.index) == list(expected.index)
+    filtered = filter_genes_by_expression(dge_matrix, 20, gene_stats=stats)
+    pd.testing.assert_frame_equal(filtered, expected)
+
+    tsne_results = rng.normal(size=(num_cells, 2))
+    dbscan_df = pd.DataFrame({"cluster": clusters})
+    _, rows, _, _ = prepare_scan(
+        ExpressionMatrix.from_dataframe(dge_matrix),
+        tsne_results,
+        dbscan_df,
+        selected_clusters=[1, 3],
+        min_coverage=0.2,
+    )
+    background = counts[:, np.isin(clusters, [1, 3])]
+    coverage = (background > 1).sum(axis=1) / background.shape[1]
+    assert np.array_equal(rows, np.flatnonzero(coverage >= 0.2))
+    assert 0 < len(rows) < num_genes
+    print("All gene statistics tests passed successfully.")
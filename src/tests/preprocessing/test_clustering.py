@@ -1,6 +1,12 @@
 import pandas as pd
 import numpy as np
-from biorsp.preprocessing.clustering import compute_dbscan
+import pytest
+from biorsp.preprocessing.clustering import (
+    assign_cluster_labels,
+    compute_dbscan,
+    grid_dbscan,
+    sweep_dbscan,
+)
 
 
 def test_clustering():
@@ -44,5 +50,96 @@ def test_clustering():
     print("All clustering tests passed successfully.")
 
 
+def test_assign_cluster_labels():
+    """
+    Test labeling new points from their nearest labeled points.
+    - Verifies points inside a cluster take its label.
+    - Verifies points farther than max_distance from every labeled point are noise.
+    """
+    rng = np.random.default_rng(0)
+    centers = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    points = np.concatenate([center + rng.normal(size=(200, 2)) for center in centers])
+    labels = np.repeat([1, 2, 3], 200)
+
+    new_points = np.array([[0.2, -0.1], [9.5, 0.3], [0.1, 9.8], [30.0, 30.0]])
+    new_labels = assign_cluster_labels(points, labels, new_points)
+    print(f"Assigned labels: {new_labels}")
+    assert list(new_labels[:3]) == [1, 2, 3]
+
+    new_labels = assign_cluster_labels(points, labels, new_points, max_distance=4)
+    assert list(new_labels) == [1, 2, 3, 0]
+    print("All label assignment tests passed successfully.")
+
+
+def test_sweep_dbscan():
+    """
+    Test the DBSCAN parameter sweep over a shared neighbour graph.
+    - Verifies every setting matches a separate compute_dbscan run.
+    - Verifies the summary counts the clusters and the noise of each setting.
+    """
+    rng = np.random.default_rng(0)
+    centers = np.array([[0.0, 0.0], [6.0, 0.0], [0.0, 7.0]])
+    points = np.concatenate(
+        [center + rng.normal(size=(300, 2)) for center in centers]
+        + [rng.uniform(-5, 12, size=(200, 2))]
+    )
+    eps_values = [0.3, 0.6, 1.0]
+    min_samples_values = [3, 10, 25]
+
+    summary, labels = sweep_dbscan(points, eps_values, min_samples_values)
+    print(summary)
+    assert labels.shape == (9, points.shape[0])
+    assert list(summary.columns) == [
+        "eps",
+        "min_samples",
+        "n_clusters",
+        "noise_fraction",
+    ]
+
+    for i, setting in summary.iterrows():
+        expected = compute_dbscan(
+            points, eps=setting["eps"], min_samples=int(setting["min_samples"])
+        )
+        assert np.array_equal(labels[i], expected)
+        assert summary.loc[i, "n_clusters"] == expected.max()
+        assert np.isclose(summary.loc[i, "noise_fraction"], np.mean(expected == 0))
+    print("All DBSCAN sweep tests passed successfully.")
+
+
+def test_grid_dbscan():
+    """
+    Test the grid DBSCAN engine for 2D embeddings.
+    - Verifies labels match sklearn's engine, including points exactly eps apart.
+    - Verifies small pair chunks give the same labels.
+    - Verifies unknown engines and non-2D coordinates are rejected.
+    """
+    rng = np.random.default_rng(0)
+    centers = np.array([[0.0, 0.0], [6.0, 0.0], [0.0, 7.0]])
+    points = np.concatenate(
+        [center + rng.normal(size=(300, 2)) for center in centers]
+        + [rng.uniform(-5, 12, size=(200, 2))]
+    )
+    lattice = np.round(rng.uniform(0, 5, size=(1000, 2)), 1)
+
+    for data in (points, lattice):
+        for eps in (0.2, 0.5, 1.0):
+            for min_samples in (1, 4, 20):
+                expected = compute_dbscan(data, eps=eps, min_samples=min_samples)
+                labels = compute_dbscan(
+                    data, eps=eps, min_samples=min_samples, engine="grid"
+                )
+                assert np.array_equal(labels, expected), (eps, min_samples)
+
+    chunked = grid_dbscan(lattice, eps=0.3, min_samples=5, max_elements=100)
+    assert np.array_equal(chunked, grid_dbscan(lattice, eps=0.3, min_samples=5))
+    print(f"Grid DBSCAN found {chunked.max() + 1} clusters.")
+
+    with pytest.raises(ValueError):
+        compute_dbscan(points, engine="kd_tree")
+    with pytest.raises(ValueError):
+        grid_dbscan(rng.normal(size=(10, 3)))
+    print("All grid DBSCAN tests passed successfully.")
+
+
 if __name__ == "__main__":
     test_clustering()
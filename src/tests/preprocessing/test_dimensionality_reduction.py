@@ -1,6 +1,22 @@
 import pandas as pd
 import numpy as np
-from biorsp.preprocessing.dimensionality_reduction import compute_tsne, run_umap
+import biorsp.preprocessing.dimensionality_reduction as dimensionality_reduction
+from sklearn.decomposition import PCA
+from biorsp.data.embedding_cache import EmbeddingCache
+from biorsp.data.expression import ExpressionMatrix
+from biorsp.preprocessing.dimensionality_reduction import (
+    EmbeddingModel,
+    align_genes,
+    apply_pca,
+    cells_by_genes,
+    compute_pca,
+    compute_tsne,
+    highly_variable_genes,
+    normalize_log1p,
+    project_cells,
+    randomized_pca,
+    run_umap,
+)
 
 
 def test_dimensionality_reduction():
@@ -50,5 +66,181 @@ def test_dimensionality_reduction():
     print("All dimensionality reduction tests passed successfully.")
 
 
+def test_embedding_cache(tmp_path, monkeypatch):
+    """
+    Test the embedding cache.
+    - Verifies a second t-SNE call with the same data and parameters is read from
+      the cache, and a changed parameter or matrix is recomputed.
+    - Verifies numpy integer seeds share entries with Python integers and
+      RandomState seeds bypass the cache.
+    - Verifies least-recently-used eviction and clearing, and that a hit survives
+      a concurrent eviction.
+    """
+    rng = np.random.default_rng(0)
+    dge_matrix = pd.DataFrame(rng.poisson(1.0, size=(40, 150)).astype(float))
+    cache = EmbeddingCache(tmp_path / "embeddings")
+
+    tsne_results = compute_tsne(dge_matrix, perplexity=10, max_iter=250, cache=cache)
+    assert len(cache.entries()) == 1
+
+    calls = []
+    tsne = dimensionality_reduction.TSNE
+
+    def counting_tsne(*args, **kwargs):
+        calls.append(kwargs)
+        return tsne(*args, **kwargs)
+
+    monkeypatch.setattr(dimensionality_reduction, "TSNE", counting_tsne)
+    cached = compute_tsne(dge_matrix, perplexity=10, max_iter=250, cache=cache)
+    assert not calls, "Unchanged data and parameters should hit the cache."
+    assert np.array_equal(cached, tsne_results)
+
+    compute_tsne(dge_matrix, perplexity=12, max_iter=250, cache=cache)
+    changed = dge_matrix.copy()
+    changed.iloc[0, 0] += 1
+    compute_tsne(changed, perplexity=10, max_iter=250, cache=cache)
+    assert len(calls) == 2, "Changed parameters or data should be recomputed."
+    assert len(cache.entries()) == 3
+
+    # A numpy integer seed hits the entry of the same Python integer; a
+    # RandomState cannot be keyed and bypasses the cache.
+    from_numpy = compute_tsne(
+        dge_matrix, random_state=np.int64(42), perplexity=10, max_iter=250, cache=cache
+    )
+    assert len(calls) == 2 and np.array_equal(from_numpy, tsne_results)
+    compute_tsne(
+        dge_matrix,
+        random_state=np.random.RandomState(0),
+        perplexity=10,
+        max_iter=250,
+        cache=cache,
+    )
+    assert len(calls) == 3 and len(cache.entries()) == 3
+    print(f"Cache size: {cache.size()} bytes")
+
+    # Reading the first entry makes the second one the least recently used.
+    first_key = cache.key(
+        "tsne",
+        dge_matrix,
+        {
+            "n_components": 2,
+            "random_state": 42,
+            "perplexity": 10,
+            "max_iter": 250,
+            "n_pca_components": None,
+            "n_top_genes": 2000,
+            "version": dimensionality_reduction.sklearn.__version__,
+        },
+    )
+    assert cache.get(first_key) is not None
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert len(cache.entries()) == 2
+    assert cache.get(first_key) is not None, "Recently read entries should be kept."
+
+    def evicted_meanwhile(path):
+        raise FileNotFoundError(path)
+
+    # An entry evicted by another process between loading and touching it is
+    # still returned.
+    with monkeypatch.context() as patch:
+        patch.setattr("biorsp.data.embedding_cache.os.utime", evicted_meanwhile)
+        assert np.array_equal(cache.get(first_key), tsne_results)
+
+    cache.clear()
+    assert cache.entries() == []
+    print("All embedding cache tests passed successfully.")
+
+
+def test_compute_pca():
+    """
+    Test the PCA pre-reduction.
+    - Verifies normalization, highly variable gene selection and the shape of the scores.
+    - Compares the sparse randomized PCA against a dense exact PCA.
+    - Verifies applying the fitted PCA to the fitted cells gives back their scores.
+    - Runs t-SNE on the principal components.
+    """
+    rng = np.random.default_rng(0)
+    num_genes, num_cells = 400, 300
+    programs = rng.gamma(1.0, size=(num_genes, 3))
+    cell_types = rng.integers(0, 3, num_cells)
+    counts = rng.poisson(programs[:, cell_types] * 0.5)
+    dge_matrix = pd.DataFrame(counts.astype(float))
+
+    matrix = normalize_log1p(cells_by_genes(dge_matrix), target_sum=1e4)
+    totals = np.expm1(matrix.toarray()).sum(axis=1)
+    assert np.allclose(totals[totals > 0], 1e4, rtol=1e-4)
+
+    genes = highly_variable_genes(matrix, n_top_genes=100)
+    assert genes.shape == (100,) and np.all(np.diff(genes) > 0)
+
+    selected = matrix[:, genes]
+    scores = randomized_pca(selected, n_components=10, n_iter=6)
+    expected = PCA(10, svd_solver="full").fit_transform(selected.toarray())
+    print(f"Max PCA score error: {np.abs(scores[:, :2] - expected[:, :2]).max():.2e}")
+    assert np.allclose(scores[:, :2], expected[:, :2], atol=1e-3)
+
+    pca_results, model = compute_pca(
+        dge_matrix, n_components=10, n_top_genes=100, return_model=True
+    )
+    assert pca_results.shape == (num_cells, 10)
+    reapplied = apply_pca(model, dge_matrix)
+    print(f"Max reapplied PCA error: {np.abs(reapplied - pca_results).max():.2e}")
+    assert np.allclose(reapplied, pca_results, rtol=1e-5, atol=1e-5)
+
+    tsne_results = compute_tsne(
+        dge_matrix, perplexity=10, max_iter=250, n_pca_components=10, cache=False
+    )
+    assert tsne_results.shape == (num_cells, 2)
+    assert not np.isnan(tsne_results).any()
+    print("All PCA tests passed successfully.")
+
+
+def test_project_cells(tmp_path):
+    """
+    Test projecting new cells into a fitted UMAP embedding.
+    - Fits UMAP with PCA on one batch and saves the model.
+    - Projects a second batch with shuffled genes through the loaded model.
+    - Verifies the new cells get the cluster labels of their cell type.
+    """
+    rng = np.random.default_rng(0)
+    num_genes, num_cells = 300, 700
+    programs = rng.gamma(1.0, size=(num_genes, 3)) ** 2
+    cell_types = rng.integers(0, 3, num_cells)
+    counts = rng.poisson(programs[:, cell_types])
+    dge_matrix = pd.DataFrame(
+        counts.astype(float),
+        index=[f"Gene{i}" for i in range(num_genes)],
+        columns=[f"Cell{j}" for j in range(num_cells)],
+    )
+    fitted, new = dge_matrix.iloc[:, :600], dge_matrix.iloc[:, 600:]
+
+    model_path = tmp_path / "umap_model.pkl"
+    embedding, model = run_umap(
+        fitted,
+        n_pca_components=10,
+        n_top_genes=100,
+        cache=False,
+        return_model=True,
+        model_path=model_path,
+    )
+    assert isinstance(model, EmbeddingModel)
+    labels = cell_types[:600] + 1
+
+    shuffled = new.sample(frac=1.0, random_state=0)
+    shuffled.loc["ExtraGene"] = 1.0
+    aligned = align_genes(ExpressionMatrix.from_dataframe(shuffled), fitted.index)
+    assert np.array_equal(aligned.to_dataframe().to_numpy(), new.to_numpy())
+
+    new_embedding, new_labels = project_cells(
+        EmbeddingModel.load(model_path), shuffled, embedding, labels
+    )
+    assert new_embedding.shape == (100, 2)
+    accuracy = np.mean(new_labels == cell_types[600:] + 1)
+    print(f"Projected label accuracy: {accuracy:.2f}")
+    assert accuracy > 0.9
+    print("All projection tests passed successfully.")
+
+
 if __name__ == "__main__":
     test_dimensionality_reduction()
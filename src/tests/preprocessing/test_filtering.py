@@ -1,6 +1,11 @@
+import numpy as np
 import pandas as pd
+import pytest
+from biorsp.data.cache import open_expression_cache
+from biorsp.data.expression import ExpressionMatrix
 from biorsp.preprocessing.filtering import (
     filter_cells_by_umi,
+    filter_dge_matrix,
     filter_genes_by_expression,
 )
 
@@ -50,5 +55,65 @@ def test_filtering():
     print("All tests passed successfully.")
 
 
+def test_fused_filtering(tmp_path):
+    """
+    Test the fused filter_dge_matrix.
+    - Compares dense, sparse and file inputs against cell then gene filtering.
+    - Verifies the filtered matrix is saved as a biorsp cache for a ".biorsp"
+      path and as a tab-delimited file otherwise, including over an existing file.
+    """
+    rng = np.random.default_rng(0)
+    counts = rng.poisson(0.3, size=(300, 120)) * (rng.random((300, 120)) < 0.4)
+    dge_matrix = pd.DataFrame(
+        counts.astype(np.float64),
+        index=[f"gene_{i}" for i in range(300)],
+        columns=[f"cell_{j}" for j in range(120)],
+    )
+    threshold_umi, threshold_gene = 30, 3
+
+    expected = filter_genes_by_expression(
+        filter_cells_by_umi(dge_matrix, threshold_umi), threshold_gene
+    )
+    print(f"Two-step filtering shape: {expected.shape}")
+
+    save_path = str(tmp_path / "filtered.biorsp")
+    fused = filter_dge_matrix(
+        dge_matrix, threshold_umi, threshold_gene, save_path=save_path
+    )
+    pd.testing.assert_frame_equal(fused, expected)
+    saved = open_expression_cache(save_path)
+    pd.testing.assert_frame_equal(saved.to_dataframe(), expected)
+
+    tsv_path = tmp_path / "filtered.tsv"
+    tsv_path.write_text("previous run\n")
+    filter_dge_matrix(dge_matrix, threshold_umi, threshold_gene, save_path=tsv_path)
+    assert tsv_path.is_file()
+    reread = pd.read_csv(tsv_path, sep="\t", index_col=0)
+    assert np.array_equal(reread.to_numpy(), expected.to_numpy())
+    with pytest.raises(ValueError):
+        filter_dge_matrix(
+            dge_matrix,
+            threshold_umi,
+            threshold_gene,
+            save_path=tsv_path,
+            save_format="biorsp",
+        )
+    assert tsv_path.is_file()
+
+    sparse = filter_dge_matrix(
+        ExpressionMatrix.from_dataframe(dge_matrix), threshold_umi, threshold_gene
+    )
+    pd.testing.assert_frame_equal(sparse.to_dataframe(), expected)
+
+    dge_file_path = tmp_path / "dge.txt"
+    dge_matrix.to_csv(dge_file_path, sep="\t")
+    streamed = filter_dge_matrix(dge_file_path, threshold_umi, threshold_gene)
+    assert list(streamed.index) == list(expected.index)
+    assert list(streamed.columns) == list(expected.columns)
+    assert np.array_equal(streamed.matrix.toarray(), expected.to_numpy())
+
+    print("All fused filtering tests passed successfully.")
+
+
 if __name__ == "__main__":
     test_filtering()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from biorsp.preprocessing.filtering import (
+    filter_cells_by_umi,
+    filter_dge_matrix,
+    filter_genes_by_expression,
+)
+from biorsp.preprocessing.loading import load_dge_matrix
+
+
+def test_load_dge_matrix(tmp_path):
+    """
+    Test the chunked sparse DGE loader.
+    - Writes a random sparse DGE file and streams it in small chunks.
+    - Verifies that QC while reading matches cell then gene filtering of the DataFrame.
+    - Verifies that filtering accepts the sparse matrix directly.
+    """
+    rng = np.random.default_rng(0)
+    counts = rng.poisson(0.3, size=(200, 80)) * (rng.random((200, 80)) < 0.3)
+    dge_matrix = pd.DataFrame(
+        counts.astype(np.float64),
+        index=[f"gene_{i}" for i in range(200)],
+        columns=[f"cell_{j}" for j in range(80)],
+    )
+    dge_matrix.index.name = "GENE"
+    dge_file_path = tmp_path / "dge.txt"
+    dge_matrix.to_csv(dge_file_path, sep="\t")
+
+    threshold_umi, threshold_gene = 10, 2
+    expected = filter_genes_by_expression(
+        filter_cells_by_umi(dge_matrix, threshold_umi), threshold_gene
+    )
+    print(f"Dense filtering shape: {expected.shape}")
+
+    expression = load_dge_matrix(
+        dge_file_path,
+        chunk_size=17,
+        threshold_umi=threshold_umi,
+        threshold_gene=threshold_gene,
+    )
+    print(f"Streamed loading shape: {expression.shape}")
+
+    assert list(expression.index) == list(expected.index), "Genes should match."
+    assert list(expression.columns) == list(expected.columns), "Cells should match."
+    assert np.array_equal(
+        expression.matrix.toarray(), expected.to_numpy()
+    ), "Values should match the dense filtering."
+
+    unfiltered = load_dge_matrix(dge_file_path, chunk_size=17)
+    assert unfiltered.shape == dge_matrix.shape, "All genes and cells should load."
+    filtered = filter_dge_matrix(unfiltered, threshold_umi, threshold_gene)
+    assert np.array_equal(
+        filtered.to_dataframe().to_numpy(), expected.to_numpy()
+    ), "Sparse filtering should match dense filtering."
+
+    print("All tests passed successfully.")
@@ -0,0 +1,81 @@
+import json
+
+import numpy as np
+import pandas as pd
+from biorsp.analysis.rsp_analysis import perform_rsp_analysis
+from biorsp.analysis.scan import run_gene_scan
+from biorsp.utils.profiling import (
+    Profiler,
+    is_profiling,
+    register_hook,
+    stage,
+    unregister_hook,
+)
+
+
+def test_profiler(tmp_path):
+    """
+    Test the profiling hooks.
+    - Records analysis stages with their call counts and sizes.
+    - Verifies nothing is recorded when profiling is disabled.
+    - Verifies hooks receive events and the Chrome trace is valid JSON.
+    """
+    rng = np.random.default_rng(0)
+    background_points = rng.normal(size=(2000, 2))
+    foreground_points = background_points[:300]
+    vantage_point = background_points.mean(axis=0)
+
+    with Profiler() as profiler:
+        assert is_profiling()
+        perform_rsp_analysis(foreground_points, background_points, vantage_point)
+        with stage("analysis.custom", size=5):
+            pass
+    assert not is_profiling()
+
+    summary = profiler.summary()
+    print(summary)
+    assert summary.loc["analysis.perform_rsp_analysis", "calls"] == 1
+    assert summary.loc["analysis.convert_to_polar", "calls"] == 2
+    assert summary.loc["analysis.convert_to_polar", "total_size"] == 2300
+    assert summary.loc["analysis.custom", "total_size"] == 5
+
+    n_events = len(profiler.events)
+    perform_rsp_analysis(foreground_points, background_points, vantage_point)
+    assert len(profiler.events) == n_events
+
+    received = []
+    register_hook(received.append)
+    perform_rsp_analysis(foreground_points, background_points, vantage_point)
+    unregister_hook(received.append)
+    assert {event["name"] for event in received} >= {"analysis.calculate_differences"}
+
+    trace_path = tmp_path / "trace.json"
+    profiler.write_chrome_trace(trace_path)
+    with open(trace_path) as f:
+        trace = json.load(f)
+    assert len(trace["traceEvents"]) == n_events
+    assert all(event["ph"] == "X" for event in trace["traceEvents"])
+
+    print("All profiler tests passed successfully.")
+
+
+def test_profiler_worker_processes():
+    """
+    Test that stages recorded in scan worker processes are merged into the parent profiler.
+    """
+    rng = np.random.default_rng(0)
+    tsne_results = rng.normal(size=(500, 2))
+    dge_matrix = pd.DataFrame(rng.poisson(1.0, size=(12, 500)))
+    dbscan_df = pd.DataFrame({"cluster": np.ones(500, dtype=int)})
+
+    with Profiler() as profiler:
+        run_gene_scan(
+            dge_matrix, tsne_results, dbscan_df, threshold=0, n_jobs=2, chunk_size=3
+        )
+
+    summary = profiler.summary()
+    print(summary)
+    assert summary.loc["analysis.scan_chunk", "calls"] == 4
+    assert summary.loc["analysis.scan_chunk", "total_size"] == 12
+    assert summary.loc["analysis.sweep_batch_differences", "processes"] >= 1
+    assert summary.loc["analysis.run_gene_scan", "processes"] == 1
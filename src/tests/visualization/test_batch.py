@@ -0,0 +1,178 @@
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from biorsp.analysis.rsp_analysis import perform_adaptive_rsp_analysis
+from biorsp.visualization.batch import (
+    PLOT_KINDS,
+    GeneFigureRenderer,
+    figure_path,
+    render_gene_figures,
+)
+from biorsp.visualization.rsp import plot_rsp_comparison, plot_rsp_polar
+
+
+def test_render_gene_figures(tmp_path):
+    """
+    Test the batch rendering of per-gene figures.
+    - Verifies every figure is written, serially and from a process pool, with
+      the same table of paths.
+    - Verifies the angle grid follows the resolution of the differences.
+    - Verifies no pyplot figures are left open and missing inputs are rejected.
+    """
+    rng = np.random.default_rng(0)
+    num_genes, num_cells, resolution = 5, 2000, 90
+    genes = [f"Gene{i}" for i in range(num_genes - 1)] + ["HLA/DRA"]
+    background_points = rng.normal(size=(num_cells, 2))
+    masks = rng.random((num_genes, num_cells)) < 0.2
+    differences = rng.uniform(0, 1, (num_genes, resolution))
+    rsp_areas = rng.uniform(0.5, 2, num_genes)
+    open_figures = len(plt.get_fignums())
+
+    tables = {}
+    for n_jobs, foreground_masks in ((1, masks), (2, csr_matrix(masks))):
+        output_dir = str(tmp_path / f"jobs_{n_jobs}")
+        tables[n_jobs] = render_gene_figures(
+            output_dir,
+            genes,
+            background_points=background_points,
+            foreground_masks=foreground_masks,
+            differences=differences,
+            rsp_areas=rsp_areas,
+            n_jobs=n_jobs,
+            chunk_size=2,
+        )
+        print(tables[n_jobs].head())
+        assert len(tables[n_jobs]) == num_genes * len(PLOT_KINDS)
+        assert all(os.path.getsize(path) > 0 for path in tables[n_jobs]["Path"])
+    assert tables[1]["Gene"].tolist() == tables[2]["Gene"].tolist()
+    assert tables[1]["Plot"].tolist() == tables[2]["Plot"].tolist()
+    assert figure_path("out", "HLA/DRA", "rsp_polar") == os.path.join(
+        "out", "HLA_DRA_rsp_polar.png"
+    )
+
+    table = render_gene_figures(
+        str(tmp_path / "raster"),
+        genes[:1],
+        background_points=background_points,
+        foreground_masks=masks[:1],
+        kinds=("foreground_background",),
+        render="raster",
+        file_format="pdf",
+    )
+    assert table["Path"].iloc[0].endswith("Gene0_foreground_background.pdf")
+    assert len(plt.get_fignums()) == open_figures
+
+    with pytest.raises(ValueError):
+        render_gene_figures(str(tmp_path), genes, kinds=("rsp_polar",))
+    with pytest.raises(ValueError):
+        render_gene_figures(
+            str(tmp_path), genes, differences=differences, kinds=("heatmap",)
+        )
+    print("All batch rendering tests passed successfully.")
+
+
+def test_render_angles(tmp_path, monkeypatch):
+    """
+    Test the angles and render mode of batch figures.
+    - Verifies the non-uniform angles of adaptive analyses are plotted per gene,
+      and shared angles for every gene.
+    - Verifies the single-call plots take the angles of the analysis.
+    - Verifies raster rendering is decided per gene from foreground and
+      background sizes, as in plot_foreground_background.
+    """
+    rng = np.random.default_rng(1)
+    background_points = rng.normal(size=(1500, 2))
+    vantage_point = background_points.mean(axis=0)
+    foreground_masks = np.vstack(
+        [background_points[:, 0] > 0.5, background_points[:, 1] > 1.0]
+    )
+    results = [
+        perform_adaptive_rsp_analysis(
+            background_points[mask],
+            background_points,
+            vantage_point,
+            n_bins=100,
+            initial_resolution=16,
+            max_resolution=256,
+        )
+        for mask in foreground_masks
+    ]
+    rsp_areas = np.array([result[0] for result in results])
+    differences = [result[3] for result in results]
+    angles = [result[4] for result in results]
+    print(f"Adaptive angles per gene: {[len(a) for a in angles]}")
+
+    renderer = GeneFigureRenderer(
+        str(tmp_path),
+        np.array(["GeneA", "GeneB"]),
+        ("rsp_polar", "rsp_comparison"),
+        differences=differences,
+        rsp_areas=rsp_areas,
+        angles=angles,
+    )
+    for row in range(2):
+        renderer.render_rows([row])
+        _, polar = renderer.figure("rsp_polar", row)
+        assert np.array_equal(polar.line.get_xdata(), angles[row])
+        _, comparison = renderer.figure("rsp_comparison", row)
+        assert np.array_equal(comparison.differences_line.get_xdata(), angles[row])
+
+    shared = np.sort(rng.uniform(0, 2 * np.pi, 40))
+    renderer = GeneFigureRenderer(
+        str(tmp_path),
+        np.array(["GeneA", "GeneB"]),
+        ("rsp_polar",),
+        differences=rng.uniform(0, 1, (2, 40)),
+        angles=shared,
+    )
+    renderer.render_rows([0, 1])
+    assert np.array_equal(renderer.figure("rsp_polar", 1)[1].line.get_xdata(), shared)
+
+    plot_rsp_polar(differences[0], show_plot=False, angles=angles[0])
+    plot_rsp_comparison(rsp_areas[0], differences[0], show_plot=False, angles=angles[0])
+    open_figures = plt.get_fignums()
+    with pytest.raises(ValueError):
+        plot_rsp_polar(differences[0], show_plot=False, angles=angles[1][:-1])
+    with pytest.raises(ValueError):
+        plot_rsp_comparison(1.0, differences[0], show_plot=False, angles=angles[1][:-1])
+    assert plt.get_fignums() == open_figures
+
+    # 1000 background points plus 600 foreground points cross a threshold of
+    # 1500 points only for the first gene.
+    masks = np.zeros((2, 1000), dtype=bool)
+    masks[0, :600], masks[1, :100] = True, True
+    renderer = GeneFigureRenderer(
+        str(tmp_path),
+        np.array(["GeneA", "GeneB"]),
+        ("foreground_background",),
+        background_points=background_points[:1000],
+        foreground_masks=csr_matrix(masks),
+    )
+    monkeypatch.setattr(
+        "biorsp.visualization.rsp.use_raster",
+        lambda n_points, render="auto": n_points >= 1500,
+    )
+    renderer.render_rows([0, 1])
+    assert renderer.figure("foreground_background", 0)[1].raster
+    assert not renderer.figure("foreground_background", 1)[1].raster
+    print("All batch angle and render tests passed successfully.")
+
+
+def test_render_colliding_names(tmp_path):
+    """
+    Test that genes whose file names collide get separate figures.
+    - Verifies duplicate genes and names equal after replacing unsafe characters
+      write one file each, with distinct paths in the returned table.
+    """
+    genes = ["HLA/DRA", "HLA_DRA", "GeneA", "GeneA", "CD4"]
+    differences = np.random.default_rng(2).uniform(0, 1, (len(genes), 30))
+    table = render_gene_figures(
+        str(tmp_path), genes, differences=differences, kinds=("rsp_polar",)
+    )
+    print(table)
+    assert table["Path"].is_unique
+    assert len(os.listdir(tmp_path)) == len(genes)
+    assert table["Path"].iloc[4] == figure_path(str(tmp_path), "CD4", "rsp_polar")
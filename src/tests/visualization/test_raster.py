@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from biorsp.visualization.embedding import plot_embedding
+from biorsp.visualization.raster import (
+    density_image,
+    fraction_image,
+    label_image,
+    raster_extent,
+    use_raster,
+)
+from biorsp.visualization.rsp import plot_foreground_background
+
+
+def test_raster_images():
+    """
+    Test the rasterized rendering of embeddings.
+    - Verifies pixel counts, majority labels and foreground fractions against
+      numpy's 2D histogram.
+    - Verifies the automatic switch between scatter and raster rendering.
+    - Verifies raster plots are saved for embeddings and foreground/background plots.
+    """
+    rng = np.random.default_rng(0)
+    points = rng.normal(size=(20000, 2))
+    labels = (points[:, 0] > 0).astype(int) + 2 * (points[:, 1] > 0)
+    extent = raster_extent(points)
+    bins = (40, 30)
+
+    density = density_image(points, extent, bins)
+    expected, _, _ = np.histogram2d(
+        points[:, 1], points[:, 0], bins=(30, 40), range=[extent[2:], extent[:2]]
+    )
+    print(f"Density image with shape {density.shape} and {density.sum()} points.")
+    assert density.shape == (30, 40)
+    assert density.sum() == points.shape[0]
+    assert np.abs(density - expected).sum() <= 0.001 * points.shape[0]
+
+    majority = label_image(points, labels, extent, bins)
+    assert np.array_equal(majority.mask, density == 0)
+    # Pixels that do not straddle an axis hold points of a single quadrant.
+    xs = np.linspace(extent[0], extent[1], 41)
+    ys = np.linspace(extent[2], extent[3], 31)
+    single = ((ys[:-1] * ys[1:]) > 0)[:, None] & ((xs[:-1] * xs[1:]) > 0)[None, :]
+    quadrants = (xs[1:] > 0)[None, :] + 2 * (ys[1:] > 0)[:, None]
+    occupied = single & ~majority.mask
+    assert np.array_equal(majority.data[occupied], quadrants[occupied])
+
+    foreground = points[labels == 3]
+    fractions = fraction_image(foreground, points, extent, bins)
+    assert fractions.max() == 1 and fractions.min() == 0
+    assert np.array_equal(fractions.mask, density == 0)
+
+    assert not use_raster(1000) and use_raster(10**6)
+    assert use_raster(1000, render="raster") and not use_raster(10**6, "scatter")
+    with pytest.raises(ValueError):
+        use_raster(1000, render="hexbin")
+    print("Raster images match the reference histograms.")
+
+
+def test_raster_plots(tmp_path):
+    """
+    Test the raster mode of the embedding and foreground/background plots.
+    - Verifies the plots are saved with and without cluster labels.
+    """
+    rng = np.random.default_rng(1)
+    points = rng.normal(size=(50000, 2))
+    labels = rng.integers(0, 5, points.shape[0])
+
+    for name, plot_labels in (("density", None), ("labels", labels)):
+        save_path = tmp_path / f"embedding_{name}.png"
+        plot_embedding(points, labels=plot_labels, save_path=save_path, render="raster")
+        assert save_path.exists()
+
+    save_path = tmp_path / "foreground_background.png"
+    plot_foreground_background(
+        points[labels == 1],
+        points,
+        save_path=save_path,
+        show_plot=False,
+        render="raster",
+    )
+    assert save_path.exists()
+    print("All raster plotting tests passed successfully.")